@@ -1,21 +1,37 @@
 # admin.py
-from fastapi import APIRouter, Request, Form, Depends, HTTPException, UploadFile, File, Query
+from fastapi import APIRouter, Request, Form, Depends, HTTPException, UploadFile, File, Query, BackgroundTasks
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import RedirectResponse, StreamingResponse
 from datetime import datetime, timedelta, timezone
 import pandas as pd
 import io
+import tempfile
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 
 # --- INTERNAL IMPORTS ---
 from auth import get_current_admin, create_access_token, get_current_driver
 from app.database import (
     db, admin_collection, driver_collection, 
-    customer_collection, order_collection, cities_collection,
-    driver_audit_collection, driver_location_collection, change_requests_collection, daily_stats_collection, shifts_collection
+    customer_collection, order_collection,
+    driver_audit_collection, driver_location_collection, change_requests_collection, daily_stats_collection, shifts_collection,
+    import_jobs_collection
 )
 from app.schemas import StartShiftRequest, CloseShiftRequest
-from app.utils import verify_password, get_password_hash, generate_otp, send_otp_email
+from app.utils import generate_otp, send_otp_email
+from app.password_pool import password_pool
+from app.order_sync import record_reassignments
+from app.shifts import ledger_totals, ledger_page_filter, encode_ledger_cursor, open_shifts, LEDGER_PAGE_SIZE, LEDGER_MAX_PAGE_SIZE
+from app.inventory_ledger import movement, record_movements, balance_at, DAILY_BALANCE_MAX_DAYS
+from app.cities import city_registry
+from app.territories import territory_index
+from app.location_buffer import location_buffer
+from app.ping_filter import worked_seconds, stationary_filter
+from app.geocoding import geocoding_service
+from app.customer_import import (
+    REQUIRED_COLUMNS, new_import_report, load_existing_cities, import_customer_frame,
+    create_import_job, run_import_job
+)
 
 admin_router = APIRouter()
 templates = Jinja2Templates(directory="templates")
@@ -70,16 +86,12 @@ def calculate_work_time(driver_id):
     pings = list(driver_location_collection.find({
         "driver_id": ObjectId(driver_id),
         "timestamp": {"$gte": today_start_utc}
-    }).sort("timestamp", 1))
+    }, {"timestamp": 1, "dwell_until": 1}).sort("timestamp", 1))
     
     if not pings: return "0h 0m"
     
-    total_seconds = 0
-    # 🚀 IMPROVED: Increase threshold to 1 hour (3600s) to handle sparse data
-    for i in range(len(pings) - 1):
-        diff = (pings[i+1]["timestamp"] - pings[i]["timestamp"]).total_seconds()
-        if diff < 3600: 
-            total_seconds += diff
+    # Gaps under 1 hour count as work; merged stationary points count for their whole dwell
+    total_seconds = worked_seconds(pings)
             
     return f"{int(total_seconds // 3600)}h {int((total_seconds % 3600) // 60)}m"
 
@@ -88,7 +100,7 @@ def get_detailed_driver_metrics(driver_id, start_date_utc, end_date_utc):
     pings = list(driver_location_collection.find({
         "driver_id": ObjectId(driver_id),
         "timestamp": {"$gte": start_date_utc, "$lte": end_date_utc}
-    }).sort("timestamp", 1))
+    }, {"timestamp": 1, "dwell_until": 1}).sort("timestamp", 1))
 
     logins = list(driver_audit_collection.find({
         "driver_id": ObjectId(driver_id),
@@ -103,7 +115,7 @@ def get_detailed_driver_metrics(driver_id, start_date_utc, end_date_utc):
     for p in pings:
         day = to_ist(p["timestamp"]).date()
         if day not in daily_groups: daily_groups[day] = {"pings": [], "logins": []}
-        daily_groups[day]["pings"].append(to_ist(p["timestamp"]))
+        daily_groups[day]["pings"].append({"timestamp": to_ist(p["timestamp"]), "dwell_until": to_ist(p.get("dwell_until"))})
 
     for l in logins:
         day = to_ist(l["timestamp"]).date()
@@ -115,15 +127,11 @@ def get_detailed_driver_metrics(driver_id, start_date_utc, end_date_utc):
     grand_total_deliveries = 0
 
     for day_date, activity in daily_groups.items():
-        p_list = sorted(activity["pings"])
+        p_list = sorted(activity["pings"], key=lambda p: p["timestamp"])
         l_list = sorted(activity["logins"])
         
-        day_seconds = 0
-        # 🚀 THE FIX: Increased to 3600 (1 hour) to ensure sparse GPS data still counts toward work time
-        for i in range(len(p_list) - 1):
-            diff = (p_list[i+1] - p_list[i]).total_seconds()
-            if diff < 3600: 
-                day_seconds += diff
+        # 🚀 THE FIX: gaps up to 1 hour count so sparse GPS data still counts toward work time
+        day_seconds = worked_seconds(p_list)
         
         grand_total_seconds += day_seconds
         day_start_utc, day_end_utc = ist_day_start(day_date), ist_day_end(day_date)
@@ -135,7 +143,7 @@ def get_detailed_driver_metrics(driver_id, start_date_utc, end_date_utc):
         })
         grand_total_deliveries += deliveries_count
 
-        all_act = sorted(p_list + l_list)
+        all_act = sorted([p["timestamp"] for p in p_list] + [p["dwell_until"] for p in p_list if p["dwell_until"]] + l_list)
         processed_days.append({
             "date": day_date,
             "first_ping": all_act[0] if all_act else None,
@@ -182,7 +190,7 @@ async def login_page(request: Request):
 @admin_router.post("/login")
 async def login_logic(request: Request, email: str = Form(...), password: str = Form(...)):
     user = admin_collection.find_one({"email": email})
-    if user and verify_password(password, user["password_hash"]):
+    if user and await password_pool.verify(password, user["password_hash"]):
         access_token = create_access_token(data={"sub": str(user["_id"])})
         response = RedirectResponse(url="/dashboard", status_code=303)
         response.set_cookie(key="access_token", value=access_token, httponly=True)
@@ -224,7 +232,7 @@ async def reset_finalize(email: str = Form(...), otp: str = Form(...), new_passw
     if not record:
         return {"success": False, "message": "Invalid or expired code."}
     
-    hashed_pw = get_password_hash(new_password)
+    hashed_pw = await password_pool.hash(new_password)
     admin_collection.update_one({"email": email}, {"$set": {"password_hash": hashed_pw}})
     db["temp_resets"].delete_one({"email": email})
     return {"success": True, "message": "Password updated successfully."}
@@ -246,7 +254,7 @@ async def signup_request(
         return {"success": False, "message": "This email is already registered."}
 
     otp = generate_otp() #
-    hashed_pw = get_password_hash(password) #
+    hashed_pw = await password_pool.hash(password) #
     
     # 3. Store pending signup data
     db["temp_signups"].update_one(
@@ -279,6 +287,7 @@ async def get_fleet_status(admin_id: ObjectId = Depends(get_current_admin)):
         
     drivers = list(driver_collection.find({"admin_id": admin_id}))
     now_utc = datetime.now(timezone.utc)
+    shifts_by_driver = open_shifts.load([str(d["_id"]) for d in drivers])
     
     fleet_data = []
     
@@ -297,7 +306,7 @@ async def get_fleet_status(admin_id: ObjectId = Depends(get_current_admin)):
                 status_color = "yellow" # Idle
                 
         # 2. Shift Inventory Logic (The single source)
-        shift = shifts_collection.find_one({"driver_id": d_id, "status": "OPEN"})
+        shift = shifts_by_driver.get(d_id)
         
         shift_start_load = None
         remaining_full = 0
@@ -375,12 +384,13 @@ async def dashboard_view(request: Request, admin_id: ObjectId = Depends(get_curr
     drivers = list(driver_collection.find({"admin_id": admin_id}))
     stats_list = []
     now_utc = datetime.now(timezone.utc)
+    shifts_by_driver = open_shifts.load([str(d["_id"]) for d in drivers])
     for d in drivers:
         ls = d.get("last_seen")
         ls_utc = ls.replace(tzinfo=timezone.utc) if ls and ls.tzinfo is None else ls
 
         # --- SMART ADMIN: Shift & Inventory Logic ---
-        shift = shifts_collection.find_one({"driver_id": str(d["_id"]), "status": "OPEN"})
+        shift = shifts_by_driver.get(str(d["_id"]))
         
         shift_start_load = None
         current_stock = 0
@@ -451,7 +461,7 @@ async def dashboard_view(request: Request, admin_id: ObjectId = Depends(get_curr
 async def driver_management(request: Request, admin_id: ObjectId = Depends(get_current_admin)):
     if not admin_id: return RedirectResponse(url="/", status_code=303)
     drivers = list(driver_collection.find({"admin_id": admin_id}))
-    cities = list(cities_collection.find().sort("name", 1))
+    cities = city_registry.all()
     stats = {"pending": order_collection.count_documents({"admin_id": admin_id, "status": "PENDING"})}
     for d in drivers:
         d["_id"] = str(d["_id"])
@@ -459,52 +469,65 @@ async def driver_management(request: Request, admin_id: ObjectId = Depends(get_c
         d["total_deliveries"] = order_collection.count_documents({"assigned_driver_id": ObjectId(d["_id"]), "status": "DELIVERED"})
     return templates.TemplateResponse("drivers.html", {"request": request, "drivers": drivers, "cities": cities, "stats": stats})
 
+def territory_conflict_redirect(conflicts):
+    owners = {}
+    for city, owner in conflicts:
+        owners.setdefault(owner, []).append(city)
+    owner, cities = next(iter(owners.items()))
+    return RedirectResponse(url=f"/drivers?msg=Error: {', '.join(cities)} already assigned to {owner}", status_code=303)
+
 @admin_router.post("/add-driver")
 async def add_driver(name: str = Form(...), phone: str = Form(...), password: str = Form(...), cities: list = Form([]), admin_id: ObjectId = Depends(get_current_admin)):
     if not admin_id: return RedirectResponse(url="/", status_code=303)
     
-    # 🛑 TERRITORY LOCK: Prevent multiple drivers from owning the same city
-    if cities:
-        existing_drivers = list(driver_collection.find({"admin_id": admin_id, "is_active": True}))
-        for d in existing_drivers:
-            intersect = set(cities).intersection(set(d.get("assigned_cities", [])))
-            if intersect:
-                # Redirect with an error message
-                return RedirectResponse(url=f"/drivers?msg=Error: {', '.join(intersect)} already assigned to {d['name']}", status_code=303)
-
-    driver_collection.insert_one({
-        "admin_id": admin_id, "name": name, "phone_number": phone, 
-        "password_hash": get_password_hash(password), "assigned_cities": cities, 
-        "is_active": True, "created_at": datetime.now(timezone.utc)
-    })
+    # 🛑 TERRITORY LOCK: the ownership index rejects cities held by another driver
+    cities = [city_registry.canonical(c) or c for c in cities]
+    driver_id = ObjectId()
+    conflicts = territory_index.claim(admin_id, driver_id, cities)
+    if conflicts:
+        return territory_conflict_redirect(conflicts)
+
+    try:
+        driver_collection.insert_one({
+            "_id": driver_id,
+            "admin_id": admin_id, "name": name, "phone_number": phone, 
+            "password_hash": await password_pool.hash(password), "assigned_cities": cities, 
+            "is_active": True, "created_at": datetime.now(timezone.utc)
+        })
+    except Exception:
+        territory_index.release(driver_id)
+        raise
     return RedirectResponse(url="/drivers?msg=Driver added successfully", status_code=303)
 
 @admin_router.post("/update-driver")
 async def update_driver(driver_id: str = Form(...), name: str = Form(...), phone: str = Form(...), password: str = Form(None), cities: list = Form([]), is_active: str = Form(None), admin_id: ObjectId = Depends(get_current_admin)):
     if not admin_id: return RedirectResponse(url="/", status_code=303)
     
-    # 🛑 TERRITORY LOCK
-    if cities and (is_active == "true"):
-        existing_drivers = list(driver_collection.find({
-            "admin_id": admin_id, 
-            "is_active": True, 
-            "_id": {"$ne": ObjectId(driver_id)}
-        }))
-        for d in existing_drivers:
-            intersect = set(cities).intersection(set(d.get("assigned_cities", [])))
-            if intersect:
-                return RedirectResponse(url=f"/drivers?msg=Error: {', '.join(intersect)} already assigned to {d['name']}", status_code=303)
+    # Hash first: a busy pool (503) must not leave the territory index ahead of the driver document
+    password_hash = await password_pool.hash(password) if password and password.strip() else None
+
+    # 🛑 TERRITORY LOCK: inactive drivers hold no territory
+    cities = [city_registry.canonical(c) or c for c in cities]
+    d_id = ObjectId(driver_id)
+    if is_active == "true":
+        conflicts = territory_index.claim(admin_id, d_id, cities)
+        if conflicts:
+            return territory_conflict_redirect(conflicts)
+    else:
+        territory_index.release(d_id)
 
     update_data = {"name": name, "phone_number": phone, "assigned_cities": cities, "is_active": (is_active == "true"), "last_edited_at": datetime.now(timezone.utc)}
-    if password and password.strip():
-        update_data["password_hash"] = get_password_hash(password)
-    driver_collection.update_one({"_id": ObjectId(driver_id)}, {"$set": update_data})
+    if password_hash:
+        update_data["password_hash"] = password_hash
+    driver_collection.update_one({"_id": d_id}, {"$set": update_data})
     return RedirectResponse(url="/drivers?msg=Driver updated successfully", status_code=303)
 
 @admin_router.post("/delete-driver")
 async def delete_driver(driver_id: str = Form(...), admin_id: ObjectId = Depends(get_current_admin)):
     if not admin_id: return RedirectResponse(url="/", status_code=303)
-    driver_collection.delete_one({"_id": ObjectId(driver_id), "admin_id": admin_id})
+    result = driver_collection.delete_one({"_id": ObjectId(driver_id), "admin_id": admin_id})
+    if result.deleted_count:
+        territory_index.release(ObjectId(driver_id))
     return RedirectResponse(url="/drivers?msg=Driver deleted", status_code=303)
 
 # --- ASSIGNMENTS ---
@@ -549,13 +572,16 @@ async def assign_delivery(order_id: str = Form(...), driver_id: str = Form(...))
         final_driver_id, final_driver_name = None, "Unassigned"
         if driver_id == "auto":
             from customer import get_optimal_driver 
-            best_driver = get_optimal_driver(order.get("admin_id"), order.get("city"))
+            cust = customer_collection.find_one({"_id": order.get("customer_id")}, {"verified_lat": 1, "verified_lng": 1}) or {}
+            best_driver = get_optimal_driver(order.get("admin_id"), order.get("city"), cust.get("verified_lat"), cust.get("verified_lng"))
             if best_driver: final_driver_id, final_driver_name = best_driver["_id"], best_driver["name"]
             else: return {"success": False, "message": f"No active drivers for {order.get('city')}"}
         else:
             driver = driver_collection.find_one({"_id": ObjectId(driver_id)})
             if driver: final_driver_id, final_driver_name = driver["_id"], driver["name"]
-        order_collection.update_one({"_id": o_id}, {"$set": {"status": "IN_PROGRESS", "assigned_driver_id": final_driver_id, "assigned_driver_name": final_driver_name, "assigned_at": datetime.now(timezone.utc)}})
+        now = datetime.now(timezone.utc)
+        record_reassignments([order], final_driver_id, now)
+        order_collection.update_one({"_id": o_id}, {"$set": {"status": "IN_PROGRESS", "assigned_driver_id": final_driver_id, "assigned_driver_name": final_driver_name, "assigned_at": now, "updated_at": now}})
         customer_collection.update_one({"records.order_id": o_id}, {"$set": {"records.$.status": "IN_PROGRESS", "records.$.driver_name": final_driver_name}})
         return RedirectResponse(url="/assignments", status_code=303)
     except Exception as e: return {"success": False, "message": str(e)}
@@ -703,6 +729,7 @@ async def reassign_order(
             "assigned_driver_name": final_driver_name, 
             "assigned_at": now_utc,
             "assigned_date": assigned_date_str,
+            "updated_at": now_utc,
         }
 
         if is_rescheduled:
@@ -710,6 +737,7 @@ async def reassign_order(
             if not order.get("original_date"):
                 update_payload["original_date"] = orig_assigned_date.strftime("%Y-%m-%d")
 
+        record_reassignments([order], final_driver_id, now_utc)
         order_collection.update_one(
             {"_id": o_id}, 
             {"$set": update_payload}
@@ -774,6 +802,7 @@ async def batch_reschedule_orders(request: Request, admin_id: ObjectId = Depends
                 "assigned_driver_name": final_driver_name, 
                 "assigned_at": now_utc,
                 "assigned_date": assigned_date_str,
+                "updated_at": now_utc,
             }
 
             if is_rescheduled:
@@ -783,6 +812,7 @@ async def batch_reschedule_orders(request: Request, admin_id: ObjectId = Depends
 
             result = order_collection.update_one({"_id": o_id}, {"$set": update_payload})
             if result.modified_count > 0:
+                record_reassignments([order], final_driver_id, now_utc)
                 customer_collection.update_one(
                     {"records.order_id": o_id}, 
                     {"$set": {
@@ -982,7 +1012,7 @@ async def resolve_change_request(request_id: str = Form(...), action: str = Form
             if req.get("order_id"):
                 order_collection.update_one(
                     {"_id": req["order_id"]},
-                    {"$set": {"status": "DELIVERED", "is_flagged": True, "delivered_at": datetime.now(timezone.utc)}}
+                    {"$set": {"status": "DELIVERED", "is_flagged": True, "delivered_at": datetime.now(timezone.utc), "updated_at": datetime.now(timezone.utc)}}
                 )
                 customer_collection.update_one(
                     {"_id": req["customer_id"], "records.order_id": req["order_id"]},
@@ -999,7 +1029,7 @@ async def resolve_change_request(request_id: str = Form(...), action: str = Form
             # Revert to PENDING so driver has to redo it properly or another driver is assigned
             order_collection.update_one(
                 {"_id": req["order_id"]},
-                {"$set": {"status": "PENDING"}} # Revert
+                {"$set": {"status": "PENDING", "updated_at": datetime.now(timezone.utc)}} # Revert
             )
             customer_collection.update_one(
                 {"_id": req["customer_id"], "records.order_id": req["order_id"]},
@@ -1176,94 +1206,101 @@ async def upload_customers(
         df = pd.read_excel(io.BytesIO(content), dtype=str) if file.filename.endswith('.xlsx') else pd.read_csv(io.BytesIO(content), dtype=str)
         
         # 🛡️ VALIDATION: Check for required columns
-        required = ["consumer_id", "name", "phone_number", "city", "landmark", "pincode"]
-        missing = [col for col in required if col not in df.columns]
+        missing = [col for col in REQUIRED_COLUMNS if col not in df.columns]
         if missing:
             return {"summary": {"error": f"Missing columns: {', '.join(missing)}"}}
 
-        total_processed = len(df)
-        success_count = 0
-        duplicate_count = 0
-        error_count = 0
-        new_cities = set()
-        
-        errors = []
-        duplicates = []
-
-        # Get existing cities to minimize DB calls during the loop
-        existing_cities = {c["name"].lower(): c["name"] for c in cities_collection.find()}
-
-        for index, row in df.iterrows():
-            row_num = index + 2 # Header is row 1
-            
-            if pd.isna(row.get('consumer_id')) or pd.isna(row.get('name')) or pd.isna(row.get('phone_number')) or pd.isna(row.get('city')) or \
-               str(row.get('consumer_id')).strip() == "nan" or str(row.get('name')).strip() == "nan" or str(row.get('phone_number')).strip() == "nan" or str(row.get('city')).strip() == "nan":
-                error_count += 1
-                errors.append({"row": row_num, "reason": "Missing mandatory consumer_id/name/phone/city"})
-                continue
-
-            try:
-                c_str = str(row['consumer_id']).replace(".0", "").strip()
-                c_id_val = int(c_str)
-                if len(str(c_id_val)) > 7:
-                    error_count += 1
-                    errors.append({"row": row_num, "reason": "Consumer ID exceeds 7 digits"})
-                    continue
-            except ValueError:
-                error_count += 1
-                errors.append({"row": row_num, "reason": "Consumer ID must be numeric"})
-                continue
-
-            if customer_collection.find_one({"consumer_id": c_id_val}):
-                duplicate_count += 1
-                duplicates.append(c_id_val)
-                continue
-
-            city_name = str(row['city']).strip()
-            city_lower = city_name.lower()
-            if city_lower not in existing_cities:
-                db["cities"].update_one(
-                    {"name": {"$regex": f"^{city_name}$", "$options": "i"}},
-                    {"$set": {"name": city_name}},
-                    upsert=True
-                )
-                existing_cities[city_lower] = city_name
-                new_cities.add(city_name)
-            else:
-                city_name = existing_cities[city_lower] # Use proper case
-
-            landmark_val = str(row['landmark']).strip() if pd.notna(row['landmark']) and str(row['landmark']).strip() != "nan" else ""
-            pincode_val = str(row['pincode']).replace(".0", "").strip() if pd.notna(row['pincode']) and str(row['pincode']).strip() != "nan" else ""
-
-            customer_collection.insert_one({
-                "admin_id": admin_id,
-                "consumer_id": c_id_val,
-                "name": str(row['name']).strip(),
-                "phone_number": str(row['phone_number']).replace(".0", "").strip(),
-                "city": city_name,
-                "landmark": landmark_val,
-                "pincode": pincode_val,
-                "verified_lat": None, "verified_lng": None, "records": [],
-                "active_order_lock": False,
-                "created_at": datetime.utcnow()
-            })
-            success_count += 1
+        # Vectorized validation + one $in duplicate lookup + chunked insert_many
+        report = import_customer_frame(df, admin_id, load_existing_cities(), new_import_report())
 
         return {
             "summary": {
-                "total_processed": total_processed,
-                "success_count": success_count,
-                "duplicate_count": duplicate_count,
-                "error_count": error_count,
-                "new_cities": list(new_cities)
+                "total_processed": report["total_processed"],
+                "success_count": report["success_count"],
+                "duplicate_count": report["duplicate_count"],
+                "error_count": report["error_count"],
+                "new_cities": report["new_cities"]
             },
-            "errors": errors,
-            "duplicates": duplicates
+            "errors": report["errors"],
+            "duplicates": report["duplicates"]
         }
 
     except Exception as e:
         return {"summary": {"error": f"Upload failed: {str(e)}"}}
 
+UPLOAD_SPOOL_BLOCK = 1024 * 1024  # Bytes copied per read while spooling to disk
+
+@admin_router.post("/upload-customers/stream")
+async def upload_customers_stream(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    admin_id: ObjectId = Depends(get_current_admin)
+):
+    """
+    Streaming import for very large sheets. The upload is spooled to disk and
+    parsed chunk by chunk in a background worker; poll the job endpoint for progress.
+    """
+    if not admin_id: return {"summary": {"error": "Unauthorized"}}
+
+    is_xlsx = file.filename.endswith('.xlsx')
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx" if is_xlsx else ".csv") as spool:
+            while True:
+                block = await file.read(UPLOAD_SPOOL_BLOCK)
+                if not block:
+                    break
+                spool.write(block)
+            path = spool.name
+    except Exception as e:
+        return {"summary": {"error": f"Upload failed: {str(e)}"}}
+
+    job_id = create_import_job(admin_id, file.filename)
+    background_tasks.add_task(run_import_job, job_id, path, is_xlsx, admin_id)
+    return {"success": True, "job_id": str(job_id), "status": "QUEUED"}
+
+@admin_router.get("/upload-customers/jobs/{job_id}")
+async def upload_job_status(job_id: str, admin_id: ObjectId = Depends(get_current_admin)):
+    if not admin_id: return {"summary": {"error": "Unauthorized"}}
+
+    job = import_jobs_collection.find_one({"_id": ObjectId(job_id), "admin_id": admin_id}) if ObjectId.is_valid(job_id) else None
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+
+    response = {
+        "job_id": job_id,
+        "status": job["status"],
+        "progress": {
+            "chunks_done": job.get("chunks_done", 0),
+            "rows_processed": job.get("rows_processed", 0),
+            "estimated_rows": job.get("estimated_rows")
+        },
+        "summary": job["summary"],
+        "errors": job.get("errors", []),
+        "duplicates": job.get("duplicates", []),
+        "log_truncated": job.get("log_truncated", False)
+    }
+    if job["status"] == "FAILED":
+        response["summary"] = {**job["summary"], "error": f"Upload failed: {job.get('error')}"}
+    return response
+
+@admin_router.get("/admin/system/ingest")
+async def ingest_metrics(admin_id: ObjectId = Depends(get_current_admin)):
+    """GPS write-behind queue depth, flush latency and geocoder backlog, for tuning under load"""
+    if not admin_id:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return {
+        "location_buffer": location_buffer.metrics(),
+        "stationary_filter": stationary_filter.stats,
+        "geocoding": {**geocoding_service.stats, "queue_depth": geocoding_service.queue_depth}
+    }
+
+@admin_router.get("/admin/system/password-pool")
+async def password_pool_metrics(admin_id: ObjectId = Depends(get_current_admin)):
+    """bcrypt worker pool: how long logins wait for a hashing thread and how many were turned away"""
+    if not admin_id:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return password_pool.metrics()
+
 # --- SHIFT & INVENTORY MANAGEMENT ---
 
 @admin_router.get("/inventory")
@@ -1358,21 +1395,25 @@ async def inventory_management(
 async def start_shift(driver_id: str = Form(...), full_cylinders: int = Form(...), empty_cylinders: int = Form(0), admin_id: ObjectId = Depends(get_current_admin)):
     if not admin_id: return RedirectResponse("/")
     
-    # Check if shift already active
-    existing = shifts_collection.find_one({"driver_id": driver_id, "status": "OPEN"})
-    if existing:
+    # Check if shift already active; the partial unique index settles two starts racing
+    if open_shifts.refresh(driver_id):
         return RedirectResponse(url="/inventory?msg=Error: Shift Already Active for this driver.", status_code=303)
     
     # Insert with explicit UTC (which is exactly 'now' representing real time, independent of local date filtering)
-    shifts_collection.insert_one({
-        "admin_id": str(admin_id),
-        "driver_id": driver_id,
-        "date": datetime.now(timezone.utc),
-        "status": "OPEN",
-        "load_departure": {"full": full_cylinders, "empty": empty_cylinders},
-        "load_return": {"full": 0, "empty": 0},
-        "financials": {"expected_cash": 0.0, "actual_cash": 0.0, "upi_total": 0.0}
-    })
+    try:
+        shift_id = shifts_collection.insert_one({
+            "admin_id": str(admin_id),
+            "driver_id": driver_id,
+            "date": datetime.now(timezone.utc),
+            "status": "OPEN",
+            "load_departure": {"full": full_cylinders, "empty": empty_cylinders},
+            "load_return": {"full": 0, "empty": 0},
+            "financials": {"expected_cash": 0.0, "actual_cash": 0.0, "upi_total": 0.0}
+        }).inserted_id
+    except DuplicateKeyError:
+        return RedirectResponse(url="/inventory?msg=Error: Shift Already Active for this driver.", status_code=303)
+    open_shifts.put(driver_id, shift_id)
+    record_movements([movement("LOAD", admin_id, driver_id, shift_id, full=full_cylinders, empty=empty_cylinders)])
     
     return RedirectResponse(url="/inventory?msg=Shift Started", status_code=303)
 
@@ -1399,7 +1440,7 @@ async def close_shift(
     shortage_full = expected_full - actual_full
     shortage_empty = expected_empty - actual_empty
     
-    shifts_collection.update_one(
+    result = shifts_collection.update_one(
         {"_id": ObjectId(shift_id), "admin_id": str(admin_id), "status": "OPEN"},
         {"$set": {
             "status": "RECONCILED",
@@ -1414,6 +1455,14 @@ async def close_shift(
             }
         }}
     )
+    if result.modified_count:
+        open_shifts.evict(shift["driver_id"])
+        # The truck hands back what was counted; whatever is missing is written off
+        upi_total = shift.get("financials", {}).get("upi_total", 0.0)
+        moves = [movement("RETURN", admin_id, shift["driver_id"], shift_id, full=-actual_full, empty=-actual_empty, cash=-actual_cash, upi=-upi_total)]
+        if shortage_full or shortage_empty or shortage_cash:
+            moves.append(movement("ADJUSTMENT", admin_id, shift["driver_id"], shift_id, full=-shortage_full, empty=-shortage_empty, cash=-shortage_cash, note="reconciliation shortage"))
+        record_movements(moves)
     
     return RedirectResponse(url="/inventory?msg=Shift Reconciled", status_code=303)
 
@@ -1422,8 +1471,14 @@ async def get_inventory_ledger(
     start_date: str = Query(None), 
     end_date: str = Query(None), 
     driver_name: str = Query(None),
+    cursor: str = Query(None),
+    limit: int = Query(LEDGER_PAGE_SIZE, ge=1, le=LEDGER_MAX_PAGE_SIZE),
     admin_id: ObjectId = Depends(get_current_admin)
 ):
+    """
+    One page of shifts, newest first, keyset-paged on (date, _id). Stats for the
+    whole filtered range come with the first page only (no cursor).
+    """
     if not admin_id: return {"error": "Unauthorized"}
     
     query = {"admin_id": str(admin_id)}
@@ -1442,30 +1497,34 @@ async def get_inventory_ledger(
         except ValueError:
             pass # Invalid format, ignore dates or handle differently
             
-    # Fetch shifts based on query
-    shifts = list(shifts_collection.find(query).sort("date", -1))
-    
-    # If a driver search is provided, we need to filter the drivers list
+    # Driver search resolves to ids first, so the shifts query only touches their shifts
     driver_query = {"admin_id": admin_id, "is_active": True}
     if driver_name:
         driver_query["name"] = {"$regex": driver_name, "$options": "i"}
-        
-    drivers = list(driver_collection.find(driver_query))
+        drivers = list(driver_collection.find(driver_query, {"name": 1}))
+        query["driver_id"] = {"$in": [str(d["_id"]) for d in drivers]}
+
+    stats = ledger_totals(query) if not cursor else None
+
+    page_query = query
+    if cursor:
+        after = ledger_page_filter(cursor)
+        if after is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        page_query = {"$and": [query, after]}
+    shifts = list(shifts_collection.find(page_query).sort([("date", -1), ("_id", -1)]).limit(limit + 1))
+    has_more = len(shifts) > limit
+    shifts = shifts[:limit]
+
+    if not driver_name:
+        # Names only for the drivers on this page
+        driver_query["_id"] = {"$in": list({ObjectId(s["driver_id"]) for s in shifts if ObjectId.is_valid(s.get("driver_id"))})}
+        drivers = list(driver_collection.find(driver_query, {"name": 1}))
     driver_map = {str(d["_id"]): d["name"] for d in drivers}
     
     shift_data = []
-    total_cash = 0
-    total_upi = 0
-    total_delivered = 0
-    total_empties = 0
-    
     for shift in shifts:
         d_id = shift.get("driver_id")
-        
-        # Skip if driver search is active and this shift isn't for a matched driver
-        if driver_name and d_id not in driver_map:
-            continue
-            
         d_name = driver_map.get(d_id, "Unknown Driver")
         
         status = shift.get("status", "CLOSED")
@@ -1482,12 +1541,6 @@ async def get_inventory_ledger(
         upi = shift.get("financials", {}).get("upi_total", 0)
         actual_cash = shift.get("financials", {}).get("actual_cash", exp_cash) # Default to expected if not reconciled
         
-        # Aggregate stats (only for the filtered shifts)
-        total_cash += actual_cash if status == "RECONCILED" else exp_cash
-        total_upi += upi
-        total_empties += current_empty
-        total_delivered += rtn_full # Rough proxy for deliveries if not querying orders directly
-        
         reconciliation = shift.get("reconciliation_report")
         
         shift_data.append({
@@ -1507,11 +1560,77 @@ async def get_inventory_ledger(
         
     return {
         "success": True,
-        "stats": {
-            "total_cash": total_cash,
-            "total_upi": total_upi,
-            "total_delivered": total_delivered,
-            "total_empties": total_empties
-        },
-        "shift_data": shift_data
-    }
\ No newline at end of file
+        "stats": stats,
+        "shift_data": shift_data,
+        "next_cursor": encode_ledger_cursor(shifts[-1]) if has_more else None
+    }
+
+@admin_router.get("/admin/api/inventory/stock-at")
+async def get_stock_at(
+    at: str = Query(None),
+    driver_id: str = Query(None),
+    admin_id: ObjectId = Depends(get_current_admin)
+):
+    """
+    Balance at a moment (default now) from the movement ledger: one driver's
+    truck, or the agency as a whole when no driver is given.
+    """
+    if not admin_id: return {"error": "Unauthorized"}
+    try:
+        when = datetime.fromisoformat(at.replace('Z', '+00:00')) if at else datetime.now(timezone.utc)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid time")
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=IST)
+
+    if driver_id:
+        if not ObjectId.is_valid(driver_id) or not driver_collection.find_one({"_id": ObjectId(driver_id), "admin_id": admin_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Driver not found")
+        balance = balance_at("driver", driver_id, to_utc(when))
+    else:
+        balance = balance_at("agency", str(admin_id), to_utc(when))
+    return {"success": True, "at": when.isoformat(), "driver_id": driver_id, **balance}
+
+@admin_router.get("/admin/api/inventory/daily-balances")
+async def get_daily_balances(
+    start_date: str = Query(...),
+    end_date: str = Query(...),
+    admin_id: ObjectId = Depends(get_current_admin)
+):
+    """Agency balance at the end of each IST day in the range"""
+    if not admin_id: return {"error": "Unauthorized"}
+    try:
+        first = datetime.strptime(start_date, "%Y-%m-%d").date()
+        last = datetime.strptime(end_date, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    days = (last - first).days + 1
+    if days < 1 or days > DAILY_BALANCE_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range must be 1 to {DAILY_BALANCE_MAX_DAYS} days")
+
+    balances = []
+    for i in range(days):
+        day = first + timedelta(days=i)
+        balance = balance_at("agency", str(admin_id), ist_day_end(day))
+        balances.append({"date": day.isoformat(), **{k: balance[k] for k in ("full", "empty", "cash", "upi", "events")}})
+    return {"success": True, "balances": balances}
+
+@admin_router.post("/admin/api/inventory/adjustments")
+async def add_inventory_adjustment(
+    note: str = Form(...),
+    full: int = Form(0),
+    empty: int = Form(0),
+    cash: float = Form(0.0),
+    driver_id: str = Form(None),
+    admin_id: ObjectId = Depends(get_current_admin)
+):
+    """Manual correction (stock received, breakage, recount) recorded as an ADJUSTMENT movement"""
+    if not admin_id: return {"error": "Unauthorized"}
+    shift_id = None
+    if driver_id:
+        if not ObjectId.is_valid(driver_id) or not driver_collection.find_one({"_id": ObjectId(driver_id), "admin_id": admin_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Driver not found")
+        shift = open_shifts.find(driver_id, {"_id": 1})
+        shift_id = shift["_id"] if shift else None
+    record_movements([movement("ADJUSTMENT", admin_id, driver_id, shift_id, full=full, empty=empty, cash=cash, note=note)])
+    return {"success": True}
\ No newline at end of file
@@ -0,0 +1,155 @@
+# app/assignment.py
+import heapq
+
+import numpy as np
+
+from app.cities import city_slug
+from app.database import driver_collection, order_collection
+from app.geo import haversine_km, to_coord
+from app.shifts import open_shifts
+from app.territories import territory_index
+
+ACTIVE_ORDER_STATUSES = ["PENDING", "IN_PROGRESS"]
+
+# Proximity scoring weights (lower score wins). Each term is normalised to 0..1
+# across the candidates for one order, so the weights are directly comparable.
+W_DISTANCE = 0.6
+W_LOAD = 0.3
+W_STOCK = 0.1
+
+
+class AssignmentEngine:
+    """
+    In-memory auto-assignment for a batch of orders.
+    Driver, open-shift stock and active-load state are loaded once for all
+    affected cities; every assignment then updates that state, so later
+    orders in the same batch see the load and stock consumed by earlier ones.
+    Rules match the original per-order lookup:
+    1. Active driver owning the order's city in the territory index
+    2. OPEN shift with full cylinders remaining
+    3. Lowest PENDING/IN_PROGRESS load (ties go to the earlier driver)
+    When the customer has verified coordinates, step 3 becomes a weighted
+    score of distance from the driver's live position, load and stock.
+    """
+
+    def __init__(self, drivers, open_shifts, loads):
+        self._drivers = []     # slot -> driver doc
+        ranks, stock, load, lat, lng = [], [], [], [], []
+        members = {}           # city -> [slot]
+
+        for rank, d in enumerate(drivers):
+            d_id = str(d["_id"])
+            shift = open_shifts.get(d_id)
+            if not shift:
+                continue
+            current_full = shift["load_departure"]["full"] - shift["load_return"]["full"]
+            if current_full <= 0:
+                continue
+
+            slot = len(self._drivers)
+            self._drivers.append(d)
+            ranks.append(rank)
+            stock.append(current_full)
+            load.append(loads.get(d_id, 0))
+            lat.append(to_coord(d.get("current_lat")))
+            lng.append(to_coord(d.get("current_lng")))
+            for city in d.get("assigned_cities") or []:
+                members.setdefault(city_slug(city), []).append(slot)
+
+        self._rank = np.array(ranks, dtype=np.int64)
+        self.stock = np.array(stock, dtype=np.int64)
+        self.load = np.array(load, dtype=np.int64)
+        self._lat = np.array(lat, dtype=float)
+        self._lng = np.array(lng, dtype=float)
+        self._members = {slug: np.array(slots, dtype=np.int64) for slug, slots in members.items()}
+        self._heaps = {}       # city slug -> [(load, rank, slot)], built on first load-only assignment
+
+    @classmethod
+    def load(cls, admin_id, cities):
+        """Four queries total, regardless of how many cities or orders follow"""
+        owner_ids = territory_index.owners(admin_id, cities)
+        if not owner_ids:
+            return cls([], {}, {})
+        drivers = list(driver_collection.find({
+            "_id": {"$in": owner_ids},
+            "is_active": True
+        }).sort("_id", 1))
+        if not drivers:
+            return cls([], {}, {})
+
+        shifts = open_shifts.load([str(d["_id"]) for d in drivers])
+
+        loads = {
+            str(row["_id"]): row["count"]
+            for row in order_collection.aggregate([
+                {"$match": {
+                    "assigned_driver_id": {"$in": [d["_id"] for d in drivers]},
+                    "status": {"$in": ACTIVE_ORDER_STATUSES}
+                }},
+                {"$group": {"_id": "$assigned_driver_id", "count": {"$sum": 1}}}
+            ])
+        }
+        return cls(drivers, shifts, loads)
+
+    def assign(self, city, lat=None, lng=None):
+        """
+        Books one cylinder on the best driver for `city` and returns that driver, or None.
+        Pass the customer's verified coordinates to use proximity scoring.
+        """
+        lat, lng = to_coord(lat), to_coord(lng)
+        if np.isnan(lat) or np.isnan(lng):
+            slot = self._pick_least_loaded(city)
+        else:
+            slot = self._pick_by_score(city, lat, lng)
+        if slot is None:
+            return None
+
+        self.load[slot] += 1
+        self.stock[slot] -= 1
+        return self._drivers[slot]
+
+    def _pick_least_loaded(self, city):
+        slug = city_slug(city)
+        heap = self._heaps.get(slug)
+        if heap is None:
+            slots = self._members.get(slug, [])
+            heap = [(int(self.load[s]), int(self._rank[s]), int(s)) for s in slots]
+            heapq.heapify(heap)
+            self._heaps[slug] = heap
+
+        while heap:
+            load, rank, slot = heap[0]
+            if self.stock[slot] <= 0:
+                heapq.heappop(heap)
+                continue
+            if load != self.load[slot]:
+                # Stale entry: the driver took orders through another city or by proximity
+                heapq.heapreplace(heap, (int(self.load[slot]), rank, slot))
+                continue
+            return slot
+        return None
+
+    def _pick_by_score(self, city, lat, lng):
+        slots = self._members.get(city_slug(city))
+        if slots is None:
+            return None
+        slots = slots[self.stock[slots] > 0]
+        if slots.size == 0:
+            return None
+
+        dist = haversine_km(lat, lng, self._lat[slots], self._lng[slots])
+        known = ~np.isnan(dist)
+        if known.any():
+            # Drivers without a live position rank as the farthest candidate
+            dist = np.where(known, dist, dist[known].max())
+            dist_norm = dist / max(dist.max(), 1e-9)
+        else:
+            dist_norm = np.zeros(slots.size)
+
+        load = self.load[slots]
+        stock = self.stock[slots]
+        score = (W_DISTANCE * dist_norm
+                 + W_LOAD * load / max(load.max(), 1)
+                 - W_STOCK * stock / max(stock.max(), 1))
+        # argmin returns the first minimum, and slots are in driver rank order
+        return int(slots[np.argmin(score)])
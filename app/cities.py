@@ -0,0 +1,126 @@
+# app/cities.py
+import re
+import threading
+import time
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+
+from app.database import cities_collection
+
+CITY_CACHE_TTL = 60  # Seconds; other workers' new cities appear within this window
+
+
+def city_slug(name: str) -> str:
+    """Normalised key: trimmed, case-folded, inner whitespace collapsed to '-'"""
+    return re.sub(r"\s+", "-", str(name).strip()).casefold()
+
+
+class CityRegistry:
+    """
+    Cities keyed by a normalised slug with a unique index, so lookups and
+    upserts are exact index hits instead of case-insensitive regex scans.
+    The full list is cached in-process; writes through the registry
+    invalidate it and the TTL covers writes made by other workers.
+    """
+
+    def __init__(self):
+        self._cities = None        # [{"_id", "name", "slug"}] sorted by name
+        self._by_slug = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        """
+        Backfills slugs on legacy documents and adds the unique index. Case-duplicates
+        are reported for an admin to merge rather than deleted, and keep the index off.
+        """
+        seen, duplicates = {}, []
+        for city in cities_collection.find().sort("_id", 1):
+            slug = city_slug(city["name"])
+            if city.get("slug") != slug:
+                cities_collection.update_one({"_id": city["_id"]}, {"$set": {"slug": slug}})
+            if slug in seen:
+                duplicates.append((city, seen[slug]))
+            else:
+                seen[slug] = city
+        if duplicates:
+            for city, first in duplicates:
+                print(f"⚠️ City '{city['name']}' ({city['_id']}) duplicates '{first['name']}' ({first['_id']}); unique city index not created")
+        else:
+            cities_collection.create_index("slug", unique=True)
+        self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._cities = None
+
+    def _load(self):
+        with self._lock:
+            if self._cities is None or time.monotonic() - self._loaded_at > CITY_CACHE_TTL:
+                cities = list(cities_collection.find({}, {"name": 1, "slug": 1}).sort("name", 1))
+                self._by_slug = {c.get("slug") or city_slug(c["name"]): c for c in cities}
+                self._cities = cities
+                self._loaded_at = time.monotonic()
+            return self._cities, self._by_slug
+
+    def all(self):
+        """Cached city list sorted by name (treat as read-only)"""
+        return self._load()[0]
+
+    def name_map(self):
+        """slug -> stored (proper case) name"""
+        return {slug: c["name"] for slug, c in self._load()[1].items()}
+
+    def canonical(self, name: str):
+        """Stored spelling of `name`, or None if the city is not registered"""
+        city = self._load()[1].get(city_slug(name))
+        return city["name"] if city else None
+
+    def ensure(self, name: str) -> str:
+        """Registers `name` if new and returns the stored spelling"""
+        name = str(name).strip()
+        existing = self.canonical(name)
+        if existing:
+            return existing
+
+        slug = city_slug(name)
+        try:
+            cities_collection.update_one(
+                {"slug": slug},
+                {"$setOnInsert": {"name": name, "slug": slug}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass  # A concurrent request registered it first
+        self.invalidate()
+        return self.canonical(name) or name
+
+    def ensure_many(self, names):
+        """
+        Registers every unseen name with one bulk upsert.
+        Returns the names actually new to the registry (first spelling wins).
+        """
+        known = self._load()[1]
+        unseen = {}
+        for name in names:
+            slug = city_slug(name)
+            if slug not in known and slug not in unseen:
+                unseen[slug] = str(name).strip()
+        if not unseen:
+            return []
+
+        try:
+            cities_collection.bulk_write([
+                UpdateOne({"slug": slug}, {"$setOnInsert": {"name": name, "slug": slug}}, upsert=True)
+                for slug, name in unseen.items()
+            ], ordered=False)
+        except BulkWriteError as bwe:
+            # Duplicate-key races mean another worker registered the city first
+            if any(err.get("code") != 11000 for err in bwe.details.get("writeErrors", [])):
+                raise
+        self.invalidate()
+        return list(unseen.values())
+
+
+city_registry = CityRegistry()
@@ -0,0 +1,118 @@
+# app/consumer_ids.py
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.database import customer_collection
+
+CONSUMER_ID_SPACE = 10_000_000   # consumer_id is at most 7 digits: 0 .. 9,999,999
+REFRESH_SECONDS = 60             # Pull IDs inserted by other workers this often
+REFRESH_OVERLAP = timedelta(seconds=5)
+
+
+class ConsumerIdIndex:
+    """
+    In-process membership bitmap over the 7-digit consumer_id space
+    (10M bits = 1.25 MB, fixed). A clear bit means "definitely new" with no
+    round trip; a set bit is confirmed against the unique index, because the
+    customer may have been deleted since. Inside its range the bitmap is
+    exact, so it has no false positives of its own.
+    IDs inserted by another worker show up after the next refresh (at most
+    REFRESH_SECONDS later). The unique index on consumer_id stays the final
+    guard, so inserts must still handle DuplicateKeyError.
+    """
+
+    def __init__(self, size: int = CONSUMER_ID_SPACE):
+        self.size = size
+        self._bits = bytearray((size + 7) // 8)
+        self._count = 0
+        self._loaded = False
+        self._synced_at = None       # created_at watermark for incremental refresh
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _in_range(self, consumer_id) -> bool:
+        return isinstance(consumer_id, (int, np.integer)) and 0 <= consumer_id < self.size
+
+    def add(self, consumer_id):
+        if not self._in_range(consumer_id):
+            return
+        byte, mask = consumer_id >> 3, 1 << (consumer_id & 7)
+        with self._lock:
+            if not self._bits[byte] & mask:
+                self._bits[byte] |= mask
+                self._count += 1
+
+    def add_many(self, consumer_ids):
+        for consumer_id in consumer_ids:
+            self.add(int(consumer_id))
+
+    def _pull(self, query):
+        newest = self._synced_at
+        cursor = customer_collection.find(query, {"consumer_id": 1, "created_at": 1, "_id": 0})
+        for doc in cursor:
+            cid = doc.get("consumer_id")
+            if isinstance(cid, int):
+                self.add(cid)
+            created = doc.get("created_at")
+            if isinstance(created, datetime) and (newest is None or created > newest):
+                newest = created
+        self._synced_at = newest
+
+    def load(self):
+        """Full load at startup: one streamed projection over customers"""
+        started = time.perf_counter()
+        self._pull({"consumer_id": {"$type": "number"}})
+        self._loaded = True
+        self._checked_at = time.monotonic()
+        print(f"🔢 Consumer ID index: {self._count} ids, {len(self._bits) / 1024:.0f} KB, loaded in {time.perf_counter() - started:.2f}s")
+
+    def _refresh_if_stale(self):
+        if time.monotonic() - self._checked_at < REFRESH_SECONDS:
+            return
+        self._checked_at = time.monotonic()
+        query = {"consumer_id": {"$type": "number"}}
+        if self._synced_at is not None:
+            query["created_at"] = {"$gte": self._synced_at - REFRESH_OVERLAP}
+        self._pull(query)
+
+    def might_exist(self, consumer_id) -> bool:
+        """False means definitely new. Unloaded index or out-of-range IDs always answer True."""
+        if not self._loaded or not self._in_range(consumer_id):
+            return True
+        self._refresh_if_stale()
+        return bool(self._bits[consumer_id >> 3] & (1 << (consumer_id & 7)))
+
+    def might_exist_many(self, consumer_ids) -> np.ndarray:
+        """Vectorised might_exist for an int array"""
+        ids = np.asarray(consumer_ids, dtype=np.int64)
+        if not self._loaded:
+            return np.ones(ids.shape, dtype=bool)
+        self._refresh_if_stale()
+        in_range = (ids >= 0) & (ids < self.size)
+        safe = np.where(in_range, ids, 0)
+        bits = np.frombuffer(self._bits, dtype=np.uint8)
+        hit = (bits[safe >> 3] >> (safe & 7)) & 1
+        return ~in_range | hit.astype(bool)
+
+    def stats(self):
+        return {
+            "loaded": self._loaded,
+            "ids": self._count,
+            "footprint_bytes": len(self._bits),
+            "fill_ratio": round(self._count / self.size, 6),
+            # Exact bitmap: a set bit only ever comes from a stored ID
+            "false_positive_rate": 0.0
+        }
+
+
+consumer_id_index = ConsumerIdIndex()
+
+
+def consumer_id_exists(consumer_id: int) -> bool:
+    """Bitmap first; only a possible hit costs a find_one against the unique index"""
+    if not consumer_id_index.might_exist(consumer_id):
+        return False
+    return customer_collection.find_one({"consumer_id": consumer_id}, {"_id": 1}) is not None
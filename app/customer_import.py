@@ -0,0 +1,317 @@
+# app/customer_import.py
+import os
+from datetime import datetime, timezone
+
+import pandas as pd
+from openpyxl import load_workbook
+from pymongo.errors import BulkWriteError
+
+from app.database import customer_collection, import_jobs_collection
+from app.cities import city_registry, city_slug
+from app.consumer_ids import consumer_id_index
+
+REQUIRED_COLUMNS = ["consumer_id", "name", "phone_number", "city", "landmark", "pincode"]
+MANDATORY_COLUMNS = ["consumer_id", "name", "phone_number", "city"]
+
+INSERT_CHUNK_SIZE = 1000   # Documents per insert_many call
+LOOKUP_CHUNK_SIZE = 5000   # Consumer IDs per $in duplicate lookup
+DUPLICATE_KEY_ERROR = 11000
+
+STREAM_CHUNK_ROWS = 5000   # Rows parsed per chunk in streaming mode
+JOB_LOG_LIMIT = 5000       # Max error/duplicate entries kept on a job document (16MB doc cap)
+
+
+def new_import_report():
+    """Empty accumulator in the shape returned by /upload-customers"""
+    return {
+        "total_processed": 0,
+        "success_count": 0,
+        "duplicate_count": 0,
+        "error_count": 0,
+        "new_cities": [],
+        "errors": [],
+        "duplicates": []
+    }
+
+
+def load_existing_cities():
+    """City slug -> stored (proper case) name, from the registry cache"""
+    return city_registry.name_map()
+
+
+def _is_blank(col: pd.Series) -> pd.Series:
+    # Same rule as the old row loop: NaN cell or the literal text "nan"
+    return col.isna() | col.astype(str).str.strip().eq("nan")
+
+
+def _clean_number(col: pd.Series) -> pd.Series:
+    # Excel turns numeric cells into "1234.0" when read as str
+    return col.astype(str).str.replace(".0", "", regex=False).str.strip()
+
+
+def _optional_text(col: pd.Series, number: bool = False) -> pd.Series:
+    text = _clean_number(col) if number else col.astype(str).str.strip()
+    return text.where(~_is_blank(col), "")
+
+
+def _find_existing_ids(ids):
+    """
+    Returns the subset of consumer IDs already stored. IDs the in-process
+    bitmap rules out are skipped; the rest cost one $in per LOOKUP_CHUNK_SIZE ids.
+    """
+    ids = [i for i, maybe in zip(ids, consumer_id_index.might_exist_many(ids)) if maybe]
+    found = set()
+    for i in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+        batch = ids[i:i + LOOKUP_CHUNK_SIZE]
+        cursor = customer_collection.find({"consumer_id": {"$in": batch}}, {"consumer_id": 1, "_id": 0})
+        found.update(doc["consumer_id"] for doc in cursor)
+    return found
+
+
+def _register_cities(city_names: pd.Series, existing_cities: dict, report: dict):
+    """Registers each unseen city once and returns the canonical name for every row"""
+    keys = city_names.map(city_slug)
+    first_seen = pd.DataFrame({"key": keys, "name": city_names}).drop_duplicates("key")
+    unseen = first_seen[~first_seen["key"].isin(list(existing_cities))]
+
+    if not unseen.empty:
+        report["new_cities"].extend(city_registry.ensure_many(unseen["name"].tolist()))
+        existing_cities.update(city_registry.name_map())
+
+    return keys.map(existing_cities)
+
+
+def import_customer_frame(df: pd.DataFrame, admin_id, existing_cities: dict, report: dict):
+    """
+    Validates and inserts one DataFrame of customer rows.
+    Rows are numbered from the frame index (header is row 1), so chunks of a
+    larger file keep their original row numbers. `existing_cities` and `report`
+    are updated in place so the same objects can be carried across chunks.
+    """
+    rows = df.index.to_series() + 2
+    report["total_processed"] += len(df)
+
+    # 1. Mandatory fields
+    missing = pd.Series(False, index=df.index)
+    for col in MANDATORY_COLUMNS:
+        missing |= _is_blank(df[col])
+
+    # 2. Consumer ID must be an integer of at most 7 digits
+    cid_text = _clean_number(df["consumer_id"])
+    numeric = cid_text.str.fullmatch(r"[+-]?\d+").fillna(False).astype(bool)
+    digits = cid_text.str.lstrip("+-").str.lstrip("0")
+    negative = cid_text.str.startswith("-") & digits.ne("")
+    id_length = digits.str.len().where(digits.ne(""), 1) + negative.astype(int)
+
+    not_numeric = ~missing & ~numeric
+    too_long = ~missing & numeric & (id_length > 7)
+    valid = ~missing & numeric & (id_length <= 7)
+
+    error_frame = pd.concat([
+        pd.DataFrame({"row": rows[missing], "reason": "Missing mandatory consumer_id/name/phone/city"}),
+        pd.DataFrame({"row": rows[too_long], "reason": "Consumer ID exceeds 7 digits"}),
+        pd.DataFrame({"row": rows[not_numeric], "reason": "Consumer ID must be numeric"}),
+    ]).sort_values("row", kind="stable")
+    report["errors"].extend({"row": int(r), "reason": reason} for r, reason in zip(error_frame["row"], error_frame["reason"]))
+    report["error_count"] += len(error_frame)
+
+    if not valid.any():
+        return report
+
+    # 3. Duplicates: already stored, or repeated earlier in this file
+    candidates = df[valid]
+    ids = pd.to_numeric(cid_text[valid]).astype("int64")
+    existing_ids = _find_existing_ids(ids.unique().tolist())
+    duplicate = ids.isin(existing_ids) | ids.duplicated(keep="first")
+
+    report["duplicates"].extend(ids[duplicate].tolist())
+    report["duplicate_count"] += int(duplicate.sum())
+
+    fresh = candidates[~duplicate]
+    if fresh.empty:
+        return report
+    fresh_ids = ids[~duplicate]
+
+    # 4. Cities: one upsert per distinct new name
+    city_names = _register_cities(fresh["city"].astype(str).str.strip(), existing_cities, report)
+
+    # 5. Build documents column-wise and write in chunks
+    now = datetime.utcnow()
+    docs = [
+        {
+            "admin_id": admin_id,
+            "consumer_id": consumer_id,
+            "name": name,
+            "phone_number": phone,
+            "city": city,
+            "landmark": landmark,
+            "pincode": pincode,
+            "verified_lat": None, "verified_lng": None, "records": [],
+            "active_order_lock": False,
+            "created_at": now
+        }
+        for consumer_id, name, phone, city, landmark, pincode in zip(
+            fresh_ids.tolist(),
+            fresh["name"].astype(str).str.strip().tolist(),
+            _clean_number(fresh["phone_number"]).tolist(),
+            city_names.tolist(),
+            _optional_text(fresh["landmark"]).tolist(),
+            _optional_text(fresh["pincode"], number=True).tolist(),
+        )
+    ]
+    doc_rows = rows[valid][~duplicate].tolist()
+
+    for i in range(0, len(docs), INSERT_CHUNK_SIZE):
+        batch = docs[i:i + INSERT_CHUNK_SIZE]
+        try:
+            result = customer_collection.insert_many(batch, ordered=False)
+            report["success_count"] += len(result.inserted_ids)
+            consumer_id_index.add_many(doc["consumer_id"] for doc in batch)
+        except BulkWriteError as bwe:
+            # Another import or /add-customer may have claimed an ID meanwhile
+            report["success_count"] += bwe.details.get("nInserted", 0)
+            # Both inserted and duplicate-rejected IDs now exist in the collection
+            failed = {err["index"] for err in bwe.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY_ERROR}
+            consumer_id_index.add_many(doc["consumer_id"] for n, doc in enumerate(batch) if n not in failed)
+            for err in bwe.details.get("writeErrors", []):
+                if err.get("code") == DUPLICATE_KEY_ERROR:
+                    report["duplicate_count"] += 1
+                    report["duplicates"].append(batch[err["index"]]["consumer_id"])
+                else:
+                    report["error_count"] += 1
+                    report["errors"].append({"row": int(doc_rows[i + err["index"]]), "reason": err.get("errmsg", "Database write failed")})
+
+    return report
+
+
+# --- STREAMING IMPORT (large files) ---
+
+def _cell_text(value):
+    # Match read_excel(dtype=str): whole-number floats lose their ".0", blanks stay NaN
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _iter_xlsx_chunks(path: str, chunk_rows: int):
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(h) if h is not None else "" for h in header]
+        buffer, offset = [], 0
+        width = len(columns)
+        for row in rows:
+            values = [_cell_text(v) for v in row[:width]]
+            if all(v is None for v in values):
+                continue  # read_excel skips blank lines as well
+            buffer.append(values + [None] * (width - len(values)))
+            if len(buffer) >= chunk_rows:
+                yield pd.DataFrame(buffer, columns=columns, index=range(offset, offset + len(buffer)))
+                offset += len(buffer)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=columns, index=range(offset, offset + len(buffer)))
+    finally:
+        wb.close()
+
+
+def iter_customer_chunks(path: str, is_xlsx: bool, chunk_rows: int = STREAM_CHUNK_ROWS):
+    """Yields DataFrames of at most `chunk_rows` rows, indexed by position in the file"""
+    if is_xlsx:
+        yield from _iter_xlsx_chunks(path, chunk_rows)
+    else:
+        yield from pd.read_csv(path, dtype=str, chunksize=chunk_rows)
+
+
+def estimate_row_count(path: str, is_xlsx: bool):
+    """Cheap total for progress bars. XLSX uses the sheet dimension, CSV counts newlines."""
+    if is_xlsx:
+        wb = load_workbook(path, read_only=True)
+        try:
+            max_row = wb.active.max_row
+        finally:
+            wb.close()
+        return max(0, max_row - 1) if max_row else None
+    lines = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            lines += block.count(b"\n")
+    return max(0, lines - 1)
+
+
+def create_import_job(admin_id, filename: str):
+    now = datetime.now(timezone.utc)
+    result = import_jobs_collection.insert_one({
+        "admin_id": admin_id,
+        "filename": filename,
+        "status": "QUEUED",
+        "chunks_done": 0,
+        "rows_processed": 0,
+        "estimated_rows": None,
+        "summary": _job_summary(new_import_report()),
+        "created_at": now,
+        "updated_at": now
+    })
+    return result.inserted_id
+
+
+def _job_summary(report: dict):
+    return {k: report[k] for k in ("total_processed", "success_count", "duplicate_count", "error_count", "new_cities")}
+
+
+def run_import_job(job_id, path: str, is_xlsx: bool, admin_id):
+    """
+    Background worker for /upload-customers/stream. Parses the spooled file
+    chunk by chunk, runs each through import_customer_frame and records
+    progress on the job document. Always removes the spooled file.
+    """
+    report = new_import_report()
+    try:
+        import_jobs_collection.update_one({"_id": job_id}, {"$set": {
+            "status": "RUNNING",
+            "estimated_rows": estimate_row_count(path, is_xlsx),
+            "updated_at": datetime.now(timezone.utc)
+        }})
+
+        existing_cities = load_existing_cities()
+        for chunk_no, chunk in enumerate(iter_customer_chunks(path, is_xlsx), start=1):
+            if chunk_no == 1:
+                missing = [col for col in REQUIRED_COLUMNS if col not in chunk.columns]
+                if missing:
+                    raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+            import_customer_frame(chunk, admin_id, existing_cities, report)
+            import_jobs_collection.update_one({"_id": job_id}, {"$set": {
+                "chunks_done": chunk_no,
+                "rows_processed": report["total_processed"],
+                "summary": _job_summary(report),
+                "updated_at": datetime.now(timezone.utc)
+            }})
+
+        import_jobs_collection.update_one({"_id": job_id}, {"$set": {
+            "status": "COMPLETED",
+            "summary": _job_summary(report),
+            "errors": report["errors"][:JOB_LOG_LIMIT],
+            "duplicates": report["duplicates"][:JOB_LOG_LIMIT],
+            "log_truncated": len(report["errors"]) > JOB_LOG_LIMIT or len(report["duplicates"]) > JOB_LOG_LIMIT,
+            "finished_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
+        }})
+    except Exception as e:
+        print(f"❌ IMPORT JOB {job_id} FAILED: {e}")
+        import_jobs_collection.update_one({"_id": job_id}, {"$set": {
+            "status": "FAILED",
+            "error": str(e),
+            "summary": _job_summary(report),
+            "updated_at": datetime.now(timezone.utc)
+        }})
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
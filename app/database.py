@@ -5,6 +5,8 @@ import os
 import os
 from dotenv import load_dotenv
 from pymongo import MongoClient
+from app.metrics import mongo_listener
+from app.query_audit import query_listener
 load_dotenv() # Load variables from .env
 
 MONGO_URI = os.getenv("MONGO_URI")
@@ -15,7 +17,7 @@ print("--------------------------------------------------")
 print("🔄 CONNECTING TO MONGODB ATLAS...")
 
 try:
-    client = MongoClient(MONGO_URI, tlsCAFile=certifi.where())
+    client = MongoClient(MONGO_URI, tlsCAFile=certifi.where(), event_listeners=[mongo_listener, query_listener])
     client.admin.command('ping')
     print("✅ SUCCESS: Connected to MongoDB Atlas safely!")
 
@@ -24,7 +26,7 @@ except Exception as e:
     print("👉 Retrying with SSL Bypass (Fix for College WiFi)...")
 
     try:
-        client = MongoClient(MONGO_URI, tlsAllowInvalidCertificates=True)
+        client = MongoClient(MONGO_URI, tlsAllowInvalidCertificates=True, event_listeners=[mongo_listener, query_listener])
         client.admin.command('ping')
         print("✅ SUCCESS: Connected to MongoDB Atlas (SSL Bypassed).")
 
@@ -54,6 +56,13 @@ change_requests_collection = db["customer_change_requests"]
 daily_stats_collection = db["daily_stats"]
 counters_collection = db["counters"]
 shifts_collection = db["shifts"]
+import_jobs_collection = db["import_jobs"]
+territory_collection = db["territory_assignments"]
+geocode_cache_collection = db["geocode_cache"]
+sync_receipts_collection = db["sync_receipts"]
+order_tombstones_collection = db["order_tombstones"]
+inventory_movements_collection = db["inventory_movements"]
+inventory_snapshots_collection = db["inventory_snapshots"]
 
 # Initialize Counter if not exists
 if counters_collection is not None:
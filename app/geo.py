@@ -0,0 +1,22 @@
+# app/geo.py
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def to_coord(value):
+    """Float coordinate or NaN. Driver/customer coords are sometimes stored as strings or None."""
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """Great-circle distance in km from one point to every point in `lats`/`lngs` (NaN where unknown)"""
+    phi1 = np.radians(lat)
+    phi2 = np.radians(np.asarray(lats, dtype=float))
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lngs, dtype=float) - lng)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
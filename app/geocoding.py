@@ -0,0 +1,275 @@
+# app/geocoding.py
+import asyncio
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from app.database import geocode_cache_collection, driver_collection, driver_location_collection
+
+GEOHASH_PRECISION = 8          # ~38m x 19m cells: pings this close share one address
+MEMORY_CACHE_SIZE = 20_000
+CACHE_TTL_DAYS = 30            # Mongo tier entries expire so renamed streets eventually refresh
+QUEUE_SIZE = 10_000
+WORKER_CONCURRENCY = 8         # Pings handled at once; cache hits never wait behind a slow lookup
+MIN_LOOKUP_INTERVAL = 1.0      # Nominatim usage policy: at most one request per second
+STOP_DRAIN_TIMEOUT = 10.0      # Seconds shutdown waits for queued pings before dropping them
+PENDING_ADDRESS = "Address Pending..."
+BUSY_ADDRESS = "Satellite Link Active (Address Busy)"
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(lat: float, lng: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Standard base32 geohash of a point"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, ch, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            ch = (ch << 1) | 1
+            rng[0] = mid
+        else:
+            ch <<= 1
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[ch])
+            bits, ch = 0, 0
+    return "".join(chars)
+
+
+# --- GEOCODERS ---
+
+class Geocoder(ABC):
+    """Reverse geocoder interface. `reverse` may block; it is always called off the event loop."""
+    min_interval = 0.0
+
+    @abstractmethod
+    def reverse(self, lat: float, lng: float):
+        """Street address for the point, or None if nothing was found. Raises on lookup failure."""
+
+
+class NominatimGeocoder(Geocoder):
+    min_interval = MIN_LOOKUP_INTERVAL
+
+    def __init__(self, user_agent: str = "gas_flow_enterprise_system", timeout: float = 3):
+        from geopy.geocoders import Nominatim
+        self._client = Nominatim(user_agent=user_agent)
+        self.timeout = timeout
+
+    def reverse(self, lat, lng):
+        location = self._client.reverse(f"{lat}, {lng}", timeout=self.timeout)
+        return location.address if location else None
+
+
+class FakeGeocoder(Geocoder):
+    """Deterministic offline geocoder for tests and local runs (GEOCODER=fake)"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def reverse(self, lat, lng):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return f"Near {lat:.4f}, {lng:.4f}"
+
+
+def default_geocoder() -> Geocoder:
+    return FakeGeocoder() if os.getenv("GEOCODER", "").lower() == "fake" else NominatimGeocoder()
+
+
+# --- CACHE ---
+
+class GeocodeCache:
+    """Two tiers keyed by geohash: an in-process LRU in front of the geocode_cache collection"""
+
+    def __init__(self, max_entries: int = MEMORY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        geocode_cache_collection.create_index("resolved_at", expireAfterSeconds=CACHE_TTL_DAYS * 86400)
+
+    def peek(self, cell: str):
+        """Memory tier only: never does I/O, safe on the request path"""
+        with self._lock:
+            address = self._memory.get(cell)
+            if address is not None:
+                self._memory.move_to_end(cell)
+            return address
+
+    def _remember(self, cell, address):
+        with self._lock:
+            self._memory[cell] = address
+            self._memory.move_to_end(cell)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, cell: str):
+        address = self.peek(cell)
+        if address is None:
+            doc = geocode_cache_collection.find_one({"_id": cell}, {"address": 1})
+            if doc:
+                address = doc["address"]
+                self._remember(cell, address)
+        return address
+
+    def put(self, cell: str, address: str):
+        self._remember(cell, address)
+        geocode_cache_collection.update_one(
+            {"_id": cell},
+            {"$set": {"address": address, "resolved_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+
+# --- SERVICE ---
+
+class ReverseGeocodingService:
+    """
+    Resolves ping addresses off the request path. Handlers store the ping
+    right away (with the cached address if the cell is known) and submit it
+    here; a background worker resolves the cell through the cache tiers and
+    the geocoder, then back-fills the ping log and the driver's
+    current_address. Concurrent lookups for one cell share a single future,
+    and network lookups are spaced by the geocoder's min_interval.
+    """
+
+    def __init__(self, geocoder: Geocoder = None, cache: GeocodeCache = None):
+        self.geocoder = geocoder
+        self.cache = cache or GeocodeCache()
+        self._queue = None
+        self._worker = None
+        self._tasks = set()
+        self._in_flight = {}           # geohash -> Future[address]
+        self._last_lookup = 0.0
+        self._rate_lock = None
+        self.stats = {"submitted": 0, "dropped": 0, "lookups": 0, "failures": 0}
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit(self, lat: float, lng: float, driver_id=None, log_ids=()):
+        """Queues a cell for address back-fill of the given ping logs; never blocks the caller"""
+        if self._queue is None:
+            return
+        try:
+            self._queue.put_nowait((lat, lng, driver_id, list(log_ids)))
+            self.stats["submitted"] += 1
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+
+    async def resolve(self, lat: float, lng: float):
+        """Address for the point's cell, or None if the lookup failed"""
+        cell = geohash(lat, lng)
+        address = self.cache.peek(cell)
+        if address is not None:
+            return address
+
+        pending = self._in_flight.get(cell)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[cell] = future
+        try:
+            address = await asyncio.to_thread(self.cache.get, cell)
+            if address is None:
+                address = await self._lookup(lat, lng)
+                if address is not None:
+                    await asyncio.to_thread(self.cache.put, cell, address)
+            future.set_result(address)
+            return address
+        except Exception as e:
+            future.set_result(None)
+            self.stats["failures"] += 1
+            print(f"🛰️ GEOCODE ERROR ({cell}): {e}")
+            return None
+        finally:
+            del self._in_flight[cell]
+
+    async def _lookup(self, lat, lng):
+        if self.geocoder is None:
+            self.geocoder = default_geocoder()
+        if self._rate_lock is None:
+            self._rate_lock = asyncio.Lock()
+        async with self._rate_lock:
+            wait = self._last_lookup + self.geocoder.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                self.stats["lookups"] += 1
+                return await asyncio.to_thread(self.geocoder.reverse, lat, lng)
+            finally:
+                self._last_lookup = time.monotonic()
+
+    async def _apply(self, lat, lng, driver_id, log_ids):
+        address = await self.resolve(lat, lng) or BUSY_ADDRESS
+        cell = geohash(lat, lng)
+        if log_ids:
+            await asyncio.to_thread(driver_location_collection.update_many, {"_id": {"$in": log_ids}}, {"$set": {"address": address}})
+        if driver_id is not None:
+            # Only if the driver has not moved to another cell since this ping
+            await asyncio.to_thread(
+                driver_collection.update_one,
+                {"_id": driver_id, "current_geohash": cell},
+                {"$set": {"current_address": address}}
+            )
+
+    async def _handle(self, queue, item, slots):
+        try:
+            await self._apply(*item)
+        except Exception as e:
+            print(f"🛰️ GEOCODE WORKER ERROR: {e}")
+        finally:
+            slots.release()
+            queue.task_done()
+
+    async def _run(self):
+        slots = asyncio.Semaphore(WORKER_CONCURRENCY)
+        queue = self._queue
+        while True:
+            item = await queue.get()
+            await slots.acquire()
+            task = asyncio.create_task(self._handle(queue, item, slots))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def start(self):
+        """Starts the worker on the running event loop (call from app startup)"""
+        if self._worker is not None:
+            return
+        self.cache.ensure_indexes()
+        self._queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def drain(self):
+        """Waits until every submitted ping has been resolved"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self, timeout: float = STOP_DRAIN_TIMEOUT):
+        """Resolves what is already queued (up to `timeout` seconds), then cancels the worker"""
+        if self._worker is not None:
+            try:
+                await asyncio.wait_for(self.drain(), timeout)
+            except asyncio.TimeoutError:
+                print(f"🛰️ GEOCODE: shutdown dropped {self._queue.qsize() + len(self._tasks)} unresolved pings")
+            self._worker.cancel()
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(self._worker, *self._tasks, return_exceptions=True)
+            self._worker = None
+            self._queue = None
+
+
+geocoding_service = ReverseGeocodingService()
@@ -0,0 +1,173 @@
+# app/inventory_ledger.py
+import threading
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+
+from app.database import inventory_movements_collection, inventory_snapshots_collection, shifts_collection
+
+# Movement types. Every movement carries signed deltas for the truck it touches:
+#   LOAD             godown -> truck at shift start (full, empty)
+#   DELIVER          one full cylinder to a customer, with the payment (full -1, cash/upi)
+#   EMPTY_COLLECTED  empties picked up at a delivery (empty +n)
+#   RETURN           truck hands its counted stock and cash back at reconciliation
+#   ADJUSTMENT       shortages written off at reconciliation, or agency corrections
+MOVEMENT_TYPES = ("LOAD", "DELIVER", "EMPTY_COLLECTED", "RETURN", "ADJUSTMENT")
+# LOAD and RETURN move stock inside the agency, so they only count on the truck
+AGENCY_TYPES = ("DELIVER", "EMPTY_COLLECTED", "ADJUSTMENT")
+BALANCE_FIELDS = ("full", "empty", "cash", "upi")
+
+SNAPSHOT_EVERY = 100                     # Movements per driver / agency between snapshots
+SNAPSHOT_SETTLE = timedelta(seconds=60)  # Snapshots stop this far back, so in-flight inserts are not missed
+DAILY_BALANCE_MAX_DAYS = 92
+
+
+def ensure_indexes():
+    inventory_movements_collection.create_index([("driver_id", ASCENDING), ("at", ASCENDING)])
+    inventory_movements_collection.create_index([("admin_id", ASCENDING), ("agency", ASCENDING), ("at", ASCENDING)])
+    inventory_snapshots_collection.create_index([("scope", ASCENDING), ("key", ASCENDING), ("at", DESCENDING)])
+
+
+def movement(type_, admin_id, driver_id, shift_id, full=0, empty=0, cash=0.0, upi=0.0, **extra):
+    """One ledger entry; ids are stored as strings, like shifts do"""
+    return {
+        "type": type_,
+        "admin_id": str(admin_id) if admin_id else None,
+        "driver_id": str(driver_id) if driver_id else None,
+        "shift_id": str(shift_id) if shift_id else None,
+        "agency": type_ in AGENCY_TYPES,
+        "full": full, "empty": empty, "cash": float(cash), "upi": float(upi),
+        **extra
+    }
+
+
+def delivery_movements(shift, driver_id, order_id, payment_mode, amount, empties, occurred_at=None):
+    """DELIVER (+ EMPTY_COLLECTED when empties came back) for one completed order"""
+    amount = float(amount)
+    extra = {"order_id": order_id}
+    if occurred_at:
+        extra["occurred_at"] = occurred_at
+    moves = [movement(
+        "DELIVER", shift.get("admin_id"), driver_id, shift["_id"], full=-1,
+        cash=amount if payment_mode == "CASH" else 0.0,
+        upi=amount if payment_mode == "UPI" else 0.0,
+        **extra
+    )]
+    if empties:
+        moves.append(movement("EMPTY_COLLECTED", shift.get("admin_id"), driver_id, shift["_id"], empty=empties, **extra))
+    return moves
+
+
+class _SnapshotCadence:
+    """Counts movements per scope in this process and says when a snapshot is due"""
+
+    def __init__(self, every: int = SNAPSHOT_EVERY):
+        self.every = every
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def due(self, scopes):
+        ready = []
+        with self._lock:
+            for scope in scopes:
+                self._counts[scope] = self._counts.get(scope, 0) + 1
+                if self._counts[scope] >= self.every:
+                    self._counts[scope] = 0
+                    ready.append(scope)
+        return ready
+
+
+_cadence = _SnapshotCadence()
+
+
+def _scopes(m):
+    scopes = []
+    if m.get("driver_id"):
+        scopes.append(("driver", m["driver_id"]))
+    if m["agency"] and m.get("admin_id"):
+        scopes.append(("agency", m["admin_id"]))
+    return scopes
+
+
+def record_movements(moves, now=None):
+    """
+    Appends movements (never updated afterwards) and writes a snapshot for
+    every driver or agency that has reached SNAPSHOT_EVERY movements since
+    its last one.
+    """
+    if not moves:
+        return
+    now = now or datetime.now(timezone.utc)
+    for m in moves:
+        m.setdefault("at", now)
+    try:
+        inventory_movements_collection.insert_many(moves, ordered=False)
+    except BulkWriteError as bwe:
+        # Only fixed ids (opening balances) can collide, and those are already recorded
+        if any(e.get("code") != 11000 for e in bwe.details.get("writeErrors", [])):
+            raise
+    due = _cadence.due([scope for m in moves for scope in _scopes(m)])
+    for scope, key in due:
+        write_snapshot(scope, key, now - SNAPSHOT_SETTLE)
+
+
+def _scope_filter(scope, key):
+    if scope == "driver":
+        return {"driver_id": key}
+    return {"admin_id": key, "agency": True}
+
+
+def balance_at(scope: str, key: str, at: datetime):
+    """
+    Stock and money held by a driver's truck, or accumulated by an agency, at
+    `at`: the latest snapshot at or before it plus the movements after it.
+    """
+    snap = inventory_snapshots_collection.find_one(
+        {"scope": scope, "key": key, "at": {"$lte": at}}, sort=[("at", DESCENDING)]
+    )
+    window = {"$lte": at}
+    if snap:
+        window["$gt"] = snap["at"]
+    replay = next(inventory_movements_collection.aggregate([
+        {"$match": {**_scope_filter(scope, key), "at": window}},
+        {"$group": {"_id": None, "events": {"$sum": 1}, **{f: {"$sum": f"${f}"} for f in BALANCE_FIELDS}}}
+    ]), {"events": 0})
+    balance = {f: (snap or {}).get(f, 0) + replay.get(f, 0) for f in BALANCE_FIELDS}
+    balance["events"] = (snap or {}).get("events", 0) + replay["events"]
+    balance["snapshot_at"] = snap["at"] if snap else None
+    balance["replayed"] = replay["events"]
+    return balance
+
+
+def write_snapshot(scope: str, key: str, at: datetime):
+    balance = balance_at(scope, key, at)
+    inventory_snapshots_collection.insert_one({
+        "scope": scope, "key": key, "at": at,
+        "events": balance["events"],
+        **{f: balance[f] for f in BALANCE_FIELDS}
+    })
+
+
+def record_opening_balances():
+    """
+    Opening LOAD for every open shift that has no movements yet (shifts started
+    before the ledger existed), so truck balances start from what is on board.
+    Fixed ids make it safe to run at every startup.
+    """
+    recorded = set(inventory_movements_collection.distinct("shift_id", {"type": "LOAD"}))
+    opening = []
+    for shift in shifts_collection.find({"status": "OPEN"}, {"admin_id": 1, "driver_id": 1, "date": 1, "load_departure": 1, "load_return": 1, "financials": 1}):
+        if str(shift["_id"]) in recorded:
+            continue
+        dep, ret, fin = shift.get("load_departure", {}), shift.get("load_return", {}), shift.get("financials", {})
+        m = movement(
+            "LOAD", shift.get("admin_id"), shift.get("driver_id"), shift["_id"],
+            full=dep.get("full", 0) - ret.get("full", 0),
+            empty=dep.get("empty", 0) + ret.get("empty", 0),
+            cash=fin.get("expected_cash", 0.0), upi=fin.get("upi_total", 0.0),
+            note="opening balance"
+        )
+        m["_id"] = f"opening:{shift['_id']}"
+        opening.append(m)
+    record_movements(opening)
@@ -0,0 +1,201 @@
+# app/location_buffer.py
+import asyncio
+import time
+from collections import deque
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.database import driver_collection, driver_location_collection
+from app.geocoding import geocoding_service
+
+FLUSH_INTERVAL_MS = 250        # Longest a ping waits in memory before it is written
+FLUSH_POINTS = 500             # Flush early once this many points are waiting
+MAX_QUEUE_POINTS = 20_000      # Producers wait for a flush beyond this (backpressure)
+BACKPRESSURE_TIMEOUT = 5.0     # Seconds a request may wait for room before it is rejected
+LATENCY_WINDOW = 1000          # Flush durations kept for percentiles
+
+
+class BufferFull(Exception):
+    """The write-behind queue stayed full for longer than BACKPRESSURE_TIMEOUT"""
+
+
+class LocationWriteBuffer:
+    """
+    Write-behind queue for GPS pings. Requests hand their path-log documents
+    and the driver's newest position to the buffer and reply without waiting
+    on Mongo. A background task writes everything queued since the last
+    flush with one insert_many plus one bulk_write of driver updates, every
+    FLUSH_INTERVAL_MS or as soon as FLUSH_POINTS are waiting. Position
+    updates are coalesced per driver, so a flush costs at most one update
+    per driver no matter how many pings arrived.
+    When MAX_QUEUE_POINTS are waiting, producers block until a flush makes
+    room. stop() performs a final flush so nothing accepted is lost on a
+    clean shutdown; a crash loses at most one flush interval of pings.
+    """
+
+    def __init__(self):
+        self._logs = []
+        self._positions = {}           # driver_id -> $set of the newest ping
+        self._merges = {}              # stored log _id -> (dwell_until, extra pings) from the stationary filter
+        self._geocode = []             # (lat, lng, driver_id, log_ids) submitted once written
+        self._task = None
+        self._stopping = False
+        self._wake = None
+        self._room = None
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.stats = {
+            "enqueued_points": 0, "flushed_points": 0, "flushes": 0, "failed_flushes": 0,
+            "max_queue_depth": 0, "backpressure_waits": 0, "rejected_points": 0
+        }
+
+    @property
+    def queue_depth(self):
+        return len(self._logs)
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    async def enqueue(self, driver_id, logs, position, geocode=(), merges=None):
+        """
+        Queues path-log documents (with pre-assigned _ids), dwell extensions
+        of already stored points and the driver's newest position ($set
+        fields including last_seen). Waits for room
+        when the queue is full; raises BufferFull if none frees up in time.
+        Without a running flush loop (scripts, tests) it writes through.
+        """
+        if not self.running:
+            await asyncio.to_thread(self._write, logs, {driver_id: position}, merges or {})
+            for item in geocode:
+                geocoding_service.submit(*item)
+            return
+
+        while self.queue_depth + len(logs) > MAX_QUEUE_POINTS and self.queue_depth:
+            self.stats["backpressure_waits"] += 1
+            self._wake.set()
+            try:
+                await asyncio.wait_for(self._room.wait(), BACKPRESSURE_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.stats["rejected_points"] += len(logs)
+                raise BufferFull(f"location buffer full ({self.queue_depth} points waiting)")
+
+        self._logs.extend(logs)
+        current = self._positions.get(driver_id)
+        if current is None or current["last_seen"] <= position["last_seen"]:
+            self._positions[driver_id] = position
+        self._geocode.extend(geocode)
+        self._add_merges(merges or {})
+
+        self.stats["enqueued_points"] += len(logs)
+        self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self.queue_depth)
+        if self.queue_depth >= FLUSH_POINTS:
+            self._wake.set()
+
+    def _add_merges(self, merges):
+        for log_id, (until, count) in merges.items():
+            current = self._merges.get(log_id)
+            self._merges[log_id] = (max(until, current[0]), current[1] + count) if current else (until, count)
+
+    async def flush(self):
+        """Writes everything queued so far. Failed batches are put back for the next flush."""
+        if not self._logs and not self._positions and not self._merges:
+            return
+        logs, self._logs = self._logs, []
+        positions, self._positions = self._positions, {}
+        merges, self._merges = self._merges, {}
+        geocode, self._geocode = self._geocode, []
+
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._write, logs, positions, merges)
+        except Exception as e:
+            self.stats["failed_flushes"] += 1
+            print(f"🛰️ LOCATION FLUSH ERROR ({len(logs)} points re-queued): {e}")
+            self._logs[:0] = logs
+            for driver_id, position in positions.items():
+                current = self._positions.get(driver_id)
+                if current is None or current["last_seen"] < position["last_seen"]:
+                    self._positions[driver_id] = position
+            self._geocode[:0] = geocode
+            self._add_merges(merges)
+            return
+        self._latencies.append(time.perf_counter() - started)
+        self.stats["flushes"] += 1
+        self.stats["flushed_points"] += len(logs)
+
+        for item in geocode:
+            geocoding_service.submit(*item)
+        self._room.set()
+        self._room.clear()
+
+    def _write(self, logs, positions, merges):
+        if logs:
+            # Pre-assigned _ids make a retried batch idempotent: duplicates are skipped, not doubled
+            try:
+                driver_location_collection.insert_many(logs, ordered=False)
+            except BulkWriteError as bwe:
+                if any(err.get("code") != 11000 for err in bwe.details.get("writeErrors", [])):
+                    raise
+        if merges:
+            # $max/$inc after the inserts: the merged-into point is always in this flush or an earlier one.
+            # A retried flush can over-count dwell_count, but dwell_until stays exact.
+            driver_location_collection.bulk_write([
+                UpdateOne({"_id": log_id}, {"$max": {"dwell_until": until}, "$inc": {"dwell_count": count}})
+                for log_id, (until, count) in merges.items()
+            ], ordered=False)
+        if positions:
+            driver_collection.bulk_write([
+                UpdateOne(
+                    {"_id": driver_id, "$or": [{"last_seen": {"$lte": fields["last_seen"]}}, {"last_seen": {"$exists": False}}]},
+                    {"$set": fields}
+                )
+                for driver_id, fields in positions.items()
+            ], ordered=False)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), FLUSH_INTERVAL_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._wake = asyncio.Event()
+            self._room = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stops the flush loop and writes whatever is still queued"""
+        if self._task is None:
+            return
+        # Let an in-progress flush finish instead of cancelling it mid-write
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+        await self.flush()
+        if self._logs:
+            print(f"⚠️ Location buffer: {len(self._logs)} points could not be written at shutdown")
+
+    def metrics(self):
+        latencies = sorted(self._latencies)
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2) if latencies else None
+        return {
+            **self.stats,
+            "queue_depth": self.queue_depth,
+            "pending_drivers": len(self._positions),
+            "pending_merges": len(self._merges),
+            "flush_interval_ms": FLUSH_INTERVAL_MS,
+            "flush_points": FLUSH_POINTS,
+            "max_queue_points": MAX_QUEUE_POINTS,
+            "flush_latency_ms": {"p50": pct(0.5), "p95": pct(0.95), "max": pct(1.0) if latencies else None}
+        }
+
+
+location_buffer = LocationWriteBuffer()
@@ -0,0 +1,197 @@
+# app/metrics.py
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+# Seconds. HTTP covers a GPS ping (~1 ms) up to a big import; Mongo is one round trip each
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+UNMATCHED_ROUTE = "unmatched"      # 404s are folded into one label so scanners cannot grow the series
+BACKGROUND_ROUTE = "background"    # Commands issued outside a request (buffers, geocoder, startup)
+
+# The ASGI scope of the request being served, so Mongo commands can be tagged with its route
+_current_scope = ContextVar("metrics_scope", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label tuple, rendered in Prometheus text format"""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name, self.help, self.label_names, self.buckets = name, help_text, label_names, buckets
+        self._series = {}          # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            base = _labels(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name, self.help, self.label_names = name, help_text, label_names
+        self._values = {}
+
+    def inc(self, labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{{{_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+class MetricsRegistry:
+    """
+    All series live in plain dicts behind one lock: an observation is a dict
+    lookup, a bisect and two additions, so the GPS ping path pays about a
+    microsecond. Label sets are bounded by route templates and collections.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.http_latency = Histogram(
+            "http_request_duration_seconds", "HTTP request latency by route template",
+            ("method", "route"), HTTP_BUCKETS
+        )
+        self.http_requests = Counter("http_requests_total", "HTTP responses by route and status code", ("method", "route", "status"))
+        self.mongo_latency = Histogram(
+            "mongo_command_duration_seconds", "MongoDB command round trip by collection",
+            ("collection", "command"), MONGO_BUCKETS
+        )
+        self.mongo_commands = Counter("mongo_commands_total", "MongoDB commands by collection and route", ("collection", "command", "route"))
+        self.mongo_seconds = Counter("mongo_command_seconds_total", "Time spent in MongoDB commands by collection and route", ("collection", "command", "route"))
+        self.mongo_documents = Counter("mongo_documents_returned_total", "Documents returned by cursor commands", ("collection", "command", "route"))
+        self.mongo_failures = Counter("mongo_command_failures_total", "Failed MongoDB commands", ("collection", "command", "code"))
+
+    def observe_request(self, method, route, status, seconds):
+        with self._lock:
+            self.http_latency.observe((method, route), seconds)
+            self.http_requests.inc((method, route, str(status)))
+
+    def observe_command(self, collection, command, route, seconds, documents):
+        with self._lock:
+            self.mongo_latency.observe((collection, command), seconds)
+            self.mongo_commands.inc((collection, command, route))
+            self.mongo_seconds.inc((collection, command, route), seconds)
+            if documents:
+                self.mongo_documents.inc((collection, command, route), documents)
+
+    def observe_failure(self, collection, command, code):
+        with self._lock:
+            self.mongo_failures.inc((collection, command, str(code)))
+
+    def render(self) -> str:
+        with self._lock:
+            lines = []
+            for metric in (
+                self.http_latency, self.http_requests, self.mongo_latency, self.mongo_commands,
+                self.mongo_seconds, self.mongo_documents, self.mongo_failures
+            ):
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def _route_label(scope):
+    if scope is None:
+        return BACKGROUND_ROUTE
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (no request/response objects built) timing every HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        token = _current_scope.set(scope)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router has put the matched route in the scope by now
+            metrics.observe_request(scope["method"], _route_label(scope), status, time.perf_counter() - started)
+            _current_scope.reset(token)
+
+
+# Commands whose first field is not the collection name
+_COLLECTION_FIELDS = {"getMore": "collection"}
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Counts, times and sizes every command per collection and per route of the
+    request that issued it. Started events are kept by request id until the
+    matching success or failure arrives.
+    """
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        name = event.command_name
+        collection = event.command.get(_COLLECTION_FIELDS.get(name, name))
+        if not isinstance(collection, str):
+            collection = "admin" if event.database_name == "admin" else "-"
+        self._pending[(event.connection_id, event.request_id)] = (collection, _route_label(_current_scope.get()))
+
+    def succeeded(self, event):
+        labels = self._pending.pop((event.connection_id, event.request_id), None)
+        if labels is None:
+            return
+        cursor = event.reply.get("cursor") if isinstance(event.reply, dict) else None
+        documents = len(cursor.get("firstBatch") or cursor.get("nextBatch") or []) if cursor else 0
+        metrics.observe_command(labels[0], event.command_name, labels[1], event.duration_micros / 1e6, documents)
+
+    def failed(self, event):
+        labels = self._pending.pop((event.connection_id, event.request_id), None)
+        if labels is None:
+            return
+        code = event.failure.get("code", "-") if isinstance(event.failure, dict) else "-"
+        metrics.observe_failure(labels[0], event.command_name, code)
+        metrics.observe_command(labels[0], event.command_name, labels[1], event.duration_micros / 1e6, 0)
+
+
+mongo_listener = MongoCommandListener()
@@ -0,0 +1,281 @@
+# app/offline_sync.py
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic import ValidationError
+from pymongo import UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError
+
+from app.database import (
+    sync_receipts_collection, shifts_collection, order_collection,
+    customer_collection, driver_collection
+)
+from app.geo import haversine_km, to_coord
+from app.inventory_ledger import record_movements, delivery_movements
+from app.shifts import open_shifts
+from app.schemas import CompleteOrderRequest, AcceptOrderRequest
+
+CLAIM_TTL = timedelta(minutes=10)   # A crashed sync's claims expire so the phone can retry
+RECEIPT_TTL = timedelta(days=30)    # How long a replayed key keeps returning its first result
+BLOCK_DISTANCE_KM = 0.15            # Same thresholds as /driver/complete-order
+FLAG_DISTANCE_KM = 0.05
+
+
+def ensure_indexes():
+    sync_receipts_collection.create_index("expires_at", expireAfterSeconds=0)
+
+
+def _result(action, status, message, retry=False, **extra):
+    return {
+        "idempotency_key": action.idempotency_key,
+        "action_type": action.action_type,
+        "order_id": action.payload.get("order_id"),
+        "status": status,
+        "message": message,
+        "retry": retry,
+        **extra
+    }
+
+
+def apply_offline_batch(driver_id: ObjectId, actions):
+    """
+    Applies queued ACCEPT_ORDER / COMPLETE_ORDER actions in a fixed number
+    of round trips, whatever the batch size.
+    Each action is claimed by inserting a receipt keyed on
+    (driver, idempotency_key), so a replayed or concurrently sent key is
+    never applied twice; a replay gets the stored result back. Completions
+    only count towards the shift (stock, cash, UPI) for orders the bulk
+    update actually moved to DELIVERED, so an order delivered live in the
+    meantime is not counted again.
+    Result statuses: applied, duplicate, skipped, rejected,
+    requires_change_request, invalid, in_progress. `retry` tells the phone
+    whether to keep the action queued.
+    """
+    now = datetime.now(timezone.utc)
+    results = [None] * len(actions)
+
+    # 1. Validate and drop keys repeated inside the batch
+    pending, seen = [], set()
+    for i, action in enumerate(actions):
+        receipt_id = f"{driver_id}:{action.idempotency_key}"
+        if receipt_id in seen:
+            results[i] = _result(action, "duplicate", "Repeated in this batch")
+            continue
+        seen.add(receipt_id)
+        try:
+            model = CompleteOrderRequest if action.action_type == "COMPLETE_ORDER" else AcceptOrderRequest
+            payload = model(**action.payload)
+            o_id = ObjectId(payload.order_id)
+        except ValidationError as e:
+            results[i] = _result(action, "invalid", ", ".join(f"{err['loc'][-1]}: {err['msg']}" for err in e.errors()))
+            continue
+        except (InvalidId, TypeError) as e:
+            results[i] = _result(action, "invalid", str(e))
+            continue
+        when = min(datetime.fromtimestamp(action.recorded_at, timezone.utc), now) if action.recorded_at else now
+        pending.append({"i": i, "action": action, "payload": payload, "o_id": o_id, "rid": receipt_id, "when": when})
+
+    if not pending:
+        return results
+
+    # 2. Replays: keys already applied return their first result
+    receipts = {r["_id"]: r for r in sync_receipts_collection.find({"_id": {"$in": [p["rid"] for p in pending]}})}
+    fresh = []
+    for p in pending:
+        receipt = receipts.get(p["rid"])
+        if receipt is None:
+            fresh.append(p)
+        elif receipt["status"] == "DONE":
+            results[p["i"]] = {**receipt["result"], "status": "duplicate", "original_status": receipt["result"]["status"]}
+        else:
+            results[p["i"]] = _result(p["action"], "in_progress", "Another sync is applying this action", retry=True)
+    if not fresh:
+        return results
+
+    # 3. Claim: the _id unique index decides races between concurrent syncs
+    claimed = fresh
+    try:
+        sync_receipts_collection.insert_many([{
+            "_id": p["rid"], "driver_id": driver_id, "action_type": p["action"].action_type,
+            "order_id": p["o_id"], "status": "CLAIMED", "claimed_at": now, "expires_at": now + CLAIM_TTL
+        } for p in fresh], ordered=False)
+    except BulkWriteError as bwe:
+        errors = bwe.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errors):
+            raise
+        lost = {err["index"] for err in errors}
+        for idx in lost:
+            p = fresh[idx]
+            results[p["i"]] = _result(p["action"], "in_progress", "Another sync is applying this action", retry=True)
+        claimed = [p for idx, p in enumerate(fresh) if idx not in lost]
+
+    try:
+        _apply_claimed(driver_id, claimed, results, now)
+    except Exception:
+        # Nothing recorded as done: release the claims so the phone can resend
+        sync_receipts_collection.delete_many({"_id": {"$in": [p["rid"] for p in claimed]}, "status": "CLAIMED"})
+        raise
+    return results
+
+
+def _apply_claimed(driver_id, claimed, results, now):
+    # 4. Load everything the batch touches
+    shift = None
+    if any(p["action"].action_type == "COMPLETE_ORDER" for p in claimed):
+        shift = open_shifts.find(str(driver_id))
+    orders = {
+        o["_id"]: o for o in order_collection.find(
+            {"_id": {"$in": [p["o_id"] for p in claimed]}, "assigned_driver_id": driver_id},
+            {"status": 1, "customer_id": 1}
+        )
+    }
+    customers = {
+        c["_id"]: c for c in customer_collection.find(
+            {"_id": {"$in": list({o["customer_id"] for o in orders.values()})}},
+            {"verified_lat": 1, "verified_lng": 1}
+        )
+    }
+
+    # 5. Decide every action in memory, in the order the driver did them
+    stock = shift["load_departure"]["full"] - shift["load_return"]["full"] if shift else 0
+    status = {o_id: o["status"] for o_id, o in orders.items()}
+    order_ops, accepted, completions = [], [], []
+    for p in claimed:
+        action, data, o_id = p["action"], p["payload"], p["o_id"]
+        order = orders.get(o_id)
+        if order is None:
+            results[p["i"]] = _result(action, "rejected", "Order not found or not assigned to you")
+            continue
+
+        if action.action_type == "ACCEPT_ORDER":
+            if status[o_id] != "PENDING":
+                results[p["i"]] = _result(action, "skipped", "Order already started or completed")
+                continue
+            status[o_id] = "IN_PROGRESS"
+            order_ops.append(UpdateOne(
+                {"_id": o_id, "assigned_driver_id": driver_id, "status": "PENDING"},
+                {"$set": {"status": "IN_PROGRESS", "started_at": p["when"], "updated_at": now}}
+            ))
+            accepted.append(p)
+            continue
+
+        # COMPLETE_ORDER
+        if shift is None:
+            results[p["i"]] = _result(action, "rejected", "No active shift found. Please ask Admin to start your shift.", retry=True)
+            continue
+        if stock <= 0:
+            results[p["i"]] = _result(action, "rejected", "Insufficient Stock on Truck.", retry=True)
+            continue
+        if status[o_id] == "DELIVERED":
+            results[p["i"]] = _result(action, "skipped", "Order already delivered")
+            continue
+
+        is_flagged = False
+        customer = customers.get(order["customer_id"])
+        if customer and customer.get("verified_lat") and customer.get("verified_lng"):
+            distance = float(haversine_km(data.lat, data.lng, [to_coord(customer["verified_lat"])], [to_coord(customer["verified_lng"])])[0])
+            if distance > BLOCK_DISTANCE_KM:
+                # Kept on the phone until an approved change request moves the customer's pin
+                results[p["i"]] = _result(
+                    action, "requires_change_request",
+                    f"Location mismatch: You are {distance * 1000:.0f}m away from verified coordinates. Please submit a Change Request.",
+                    retry=True, distance=distance
+                )
+                continue
+            is_flagged = distance > FLAG_DISTANCE_KM
+
+        stock -= 1
+        status[o_id] = "DELIVERED"
+        p["is_flagged"] = is_flagged
+        p["customer_id"] = order["customer_id"]
+        order_ops.append(UpdateOne({"_id": o_id, "status": {"$ne": "DELIVERED"}}, {"$set": {
+            "status": "DELIVERED",
+            "delivered_at": p["when"],
+            "updated_at": now,
+            "verified_lat": data.lat,
+            "verified_lng": data.lng,
+            "payment_status": "PAID" if data.payment_mode == "UPI" else "CASH_COLLECTED",
+            "payment_mode": data.payment_mode,
+            "amount_collected": data.amount_collected,
+            "cylinders_delivered": 1,
+            "empties_collected": data.empties_collected,
+            "is_flagged": is_flagged,
+            "shift_id": str(shift["_id"]),
+            "amount_paid": float(data.amount_collected),
+            "sync_receipt": p["rid"]
+        }}))
+        completions.append(p)
+
+    # 6. Orders in one unordered bulk. Accept and complete of the same order commute:
+    #    their status guards give DELIVERED either way.
+    if order_ops:
+        try:
+            order_collection.bulk_write(order_ops, ordered=False)
+        except BulkWriteError as bwe:
+            print(f"⚠️ OFFLINE SYNC: {len(bwe.details.get('writeErrors', []))} order writes failed")
+
+    # 7. Only completions whose update really landed count towards stock and cash
+    landed = set()
+    if completions:
+        landed = {o["_id"] for o in order_collection.find(
+            {"_id": {"$in": [p["o_id"] for p in completions]}, "sync_receipt": {"$in": [p["rid"] for p in completions]}},
+            {"_id": 1}
+        )}
+    applied = [p for p in completions if p["o_id"] in landed]
+    for p in completions:
+        if p["o_id"] not in landed:
+            results[p["i"]] = _result(p["action"], "skipped", "Order already delivered")
+
+    if applied:
+        inc = {"load_return.full": 0, "load_return.empty": 0}
+        cash = 0.0
+        for p in applied:
+            data = p["payload"]
+            inc["load_return.full"] += 1
+            inc["load_return.empty"] += data.empties_collected
+            if data.payment_mode == "CASH":
+                cash += float(data.amount_collected)
+                inc["financials.expected_cash"] = inc.get("financials.expected_cash", 0.0) + float(data.amount_collected)
+                inc["financials.actual_cash_collected"] = inc.get("financials.actual_cash_collected", 0.0) + float(data.amount_collected)
+            elif data.payment_mode == "UPI":
+                inc["financials.upi_total"] = inc.get("financials.upi_total", 0.0) + float(data.amount_collected)
+        shifts_collection.update_one({"_id": shift["_id"]}, {"$inc": inc})
+        record_movements([
+            m for p in applied
+            for m in delivery_movements(shift, driver_id, p["o_id"], p["payload"].payment_mode, p["payload"].amount_collected, p["payload"].empties_collected, occurred_at=p["when"])
+        ], now)
+        driver_collection.update_one({"_id": driver_id}, {"$inc": {"current_stock": -len(applied), "collected_cash": cash}})
+
+    # 8. Customer side: record statuses and the delivery pin, in one bulk
+    customer_ops = []
+    for p in accepted:
+        customer_ops.append(UpdateOne({"records.order_id": p["o_id"]}, {"$set": {"records.$.status": "IN_PROGRESS"}}))
+        results[p["i"]] = _result(p["action"], "applied", "Order started")
+    for p in applied:
+        data = p["payload"]
+        customer_ops.append(UpdateOne({"_id": p["customer_id"]}, {"$set": {
+            "verified_lat": data.lat,
+            "verified_lng": data.lng,
+            "active_order_lock": False,
+            "last_order_date": p["when"]
+        }}))
+        customer_ops.append(UpdateOne(
+            {"_id": p["customer_id"], "records.order_id": p["o_id"]},
+            {"$set": {"records.$.status": "DELIVERED"}}
+        ))
+        results[p["i"]] = _result(p["action"], "applied", f"Success: ₹{data.amount_collected} recorded.", is_flagged=p["is_flagged"])
+    if customer_ops:
+        customer_collection.bulk_write(customer_ops, ordered=False)
+
+    # 9. Receipts: final results are stored for replays, retryable ones are released
+    receipt_ops = []
+    for p in claimed:
+        result = results[p["i"]]
+        if result["retry"]:
+            receipt_ops.append(DeleteOne({"_id": p["rid"], "status": "CLAIMED"}))
+        else:
+            receipt_ops.append(UpdateOne({"_id": p["rid"]}, {"$set": {
+                "status": "DONE", "result": result, "completed_at": now, "expires_at": now + RECEIPT_TTL
+            }}))
+    sync_receipts_collection.bulk_write(receipt_ops, ordered=False)
@@ -0,0 +1,58 @@
+# app/order_sync.py
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING
+
+from app.database import order_collection, order_tombstones_collection
+
+TOMBSTONE_TTL_DAYS = 14        # Sync tokens older than this get a full list instead of a delta
+SYNC_OVERLAP = timedelta(seconds=30)   # Tokens point this far back so writes from servers with skewed clocks are not missed
+
+
+def ensure_indexes():
+    order_collection.create_index([("assigned_driver_id", ASCENDING), ("updated_at", ASCENDING)])
+    order_tombstones_collection.create_index([("driver_id", ASCENDING), ("removed_at", ASCENDING)])
+    order_tombstones_collection.create_index("removed_at", expireAfterSeconds=TOMBSTONE_TTL_DAYS * 86400)
+
+
+def record_reassignments(orders, new_driver_id, now):
+    """
+    Leaves a tombstone for the previous driver of every order that is moving
+    to another driver, so their next delta sync drops it. `orders` are order
+    documents (at least _id and assigned_driver_id) read before the update.
+    """
+    tombstones = [
+        {"order_id": o["_id"], "driver_id": o["assigned_driver_id"], "removed_at": now}
+        for o in orders
+        if o.get("assigned_driver_id") and o["assigned_driver_id"] != new_driver_id
+    ]
+    if tombstones:
+        order_tombstones_collection.insert_many(tombstones)
+
+
+def make_sync_token(started_at: datetime) -> str:
+    """Opaque token for the client: milliseconds of the read start, minus the overlap"""
+    return str(int((started_at - SYNC_OVERLAP).timestamp() * 1000))
+
+
+def parse_sync_token(token):
+    """UTC datetime the token stands for, or None if it is malformed or older than the tombstones"""
+    try:
+        since = datetime.fromtimestamp(int(token) / 1000, timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    if since < datetime.now(timezone.utc) - timedelta(days=TOMBSTONE_TTL_DAYS):
+        return None
+    return since
+
+
+def removed_since(driver_id, since, visible_ids):
+    """
+    Ids of orders the driver's app should drop: moved to another driver, or
+    changed since the token (rescheduled, cancelled...) so that they no
+    longer fall in the requested list. `visible_ids` are the orders that are
+    still in the list.
+    """
+    changed = {o["_id"] for o in order_collection.find({"assigned_driver_id": driver_id, "updated_at": {"$gt": since}}, {"_id": 1})}
+    moved = {t["order_id"] for t in order_tombstones_collection.find({"driver_id": driver_id, "removed_at": {"$gt": since}}, {"order_id": 1})}
+    return (changed | moved) - set(visible_ids)
@@ -0,0 +1,98 @@
+# app/password_pool.py
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils import get_password_hash, verify_password
+
+# bcrypt releases the GIL while hashing, so threads give real parallelism without a process pool
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", min(4, os.cpu_count() or 1)))
+MAX_WAITING = int(os.getenv("PASSWORD_MAX_WAITING", 200))   # Calls beyond this are rejected instead of queued
+LATENCY_WINDOW = 1000                                       # Samples kept for percentiles
+
+
+class PasswordPoolBusy(Exception):
+    """More than MAX_WAITING password checks are already queued"""
+
+
+class PasswordPool:
+    """
+    Runs bcrypt hashing and verification on a small dedicated thread pool so
+    a wave of logins (~200 ms of CPU each) never blocks the event loop that
+    also serves GPS pings and dashboards. At most PASSWORD_WORKERS hashes run
+    at once; callers beyond that wait in the pool's queue, and once
+    MAX_WAITING are waiting new calls fail fast with PasswordPoolBusy.
+    Records how long each call waited for a worker and how long it ran.
+    """
+
+    def __init__(self, workers: int = PASSWORD_WORKERS, max_waiting: int = MAX_WAITING):
+        self.workers = workers
+        self.max_waiting = max_waiting
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0              # Submitted and not finished (running + waiting)
+        self._queue_waits = deque(maxlen=LATENCY_WINDOW)
+        self._run_times = deque(maxlen=LATENCY_WINDOW)
+        self.stats = {"completed": 0, "rejected": 0, "max_waiting": 0}
+
+    def _timed(self, submitted, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                self._queue_waits.append(started - submitted)
+                self._run_times.append(finished - started)
+
+    async def _run(self, fn, *args):
+        with self._lock:
+            waiting = max(self._pending - self.workers, 0)
+            if waiting >= self.max_waiting:
+                self.stats["rejected"] += 1
+                raise PasswordPoolBusy(f"{waiting} password checks already waiting")
+            self._pending += 1
+            self.stats["max_waiting"] = max(self.stats["max_waiting"], self._pending - self.workers)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._timed, time.perf_counter(), fn, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self.stats["completed"] += 1
+
+    async def verify(self, plain_password, hashed_password) -> bool:
+        if not hashed_password:
+            return False
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password) -> str:
+        return await self._run(get_password_hash, password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def metrics(self):
+        with self._lock:
+            waits, runs = sorted(self._queue_waits), sorted(self._run_times)
+            pending = self._pending
+        def pct(samples, p):
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 2) if samples else None
+        return {
+            **self.stats,
+            "workers": self.workers,
+            "max_waiting_allowed": self.max_waiting,
+            "running": min(pending, self.workers),
+            "waiting": max(pending - self.workers, 0),
+            "queue_wait_ms": {"p50": pct(waits, 0.5), "p95": pct(waits, 0.95), "max": pct(waits, 1.0)},
+            "hash_ms": {"p50": pct(runs, 0.5), "p95": pct(runs, 0.95), "max": pct(runs, 1.0)}
+        }
+
+
+password_pool = PasswordPool()
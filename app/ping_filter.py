@@ -0,0 +1,139 @@
+# app/ping_filter.py
+import threading
+from collections import OrderedDict
+from datetime import timezone
+
+from app.geo import haversine_km
+from app.utils import to_ist
+
+STATIONARY_RADIUS_M = 25       # Pings closer than this to the stored point count as "not moved"
+MERGE_WINDOW_SECONDS = 600     # ...if they also arrive within this long of its last merged ping
+WORK_GAP_SECONDS = 3600        # Gaps shorter than this between pings count as work time
+TRACKED_DRIVERS = 10_000
+
+assert MERGE_WINDOW_SECONDS < WORK_GAP_SECONDS, "merged gaps must always count as work time"
+
+
+def _utc(dt):
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+class StationaryFilter:
+    """
+    Merges pings from a driver who has not moved into the previously stored
+    point instead of storing a new one. A merge extends the stored point's
+    dwell_until and dwell_count, so the point still records when the driver
+    arrived, how long they stayed and how many pings it stands for.
+    A ping is merged when it is within STATIONARY_RADIUS_M of the stored
+    point, no more than MERGE_WINDOW_SECONDS after that point's last merged
+    ping, and on the same IST day (daily metrics group by IST day).
+    Because the merge window is shorter than the work-time gap, every merged
+    gap would have counted as work anyway, and worked_seconds() gives the
+    same totals as it did on the raw pings.
+    State is per process. A driver whose pings alternate between workers
+    merges less often but is never miscounted.
+    """
+
+    def __init__(self, radius_m: float = STATIONARY_RADIUS_M, window_seconds: float = MERGE_WINDOW_SECONDS):
+        self.radius_km = radius_m / 1000
+        self.window_seconds = window_seconds
+        self._last = OrderedDict()     # driver_id -> stored point {_id, lat, lng, timestamp, dwell_until}
+        self._lock = threading.Lock()
+        self.stats = {"pings": 0, "stored": 0, "merged": 0}
+
+    def _mergeable(self, last, lat, lng, ts):
+        if last is None:
+            return False
+        gap = (ts - last["dwell_until"]).total_seconds()
+        if gap < 0 or gap > self.window_seconds:
+            return False
+        if to_ist(ts).date() != to_ist(last["timestamp"]).date():
+            return False
+        return haversine_km(last["lat"], last["lng"], lat, lng) <= self.radius_km
+
+    def plan(self, driver_id, logs):
+        """
+        Splits time-ordered path-log documents into (logs to insert, merges, tail).
+        Kept documents get dwell_until/dwell_count; merges maps an already
+        stored log _id to (dwell_until, extra pings) to apply with $max/$inc.
+        Nothing is remembered until commit(driver_id, tail, ...) is called
+        once the documents are safely queued.
+        """
+        kept, merges = [], {}
+        with self._lock:
+            stored = self._last.get(driver_id)
+        last = dict(stored) if stored is not None else None
+        for log in logs:
+            ts = _utc(log["timestamp"])
+            if self._mergeable(last, log["lat"], log["lng"], ts):
+                last["dwell_until"] = ts
+                if last.get("doc") is not None:
+                    # Stored point is from this same batch: fold into the document itself
+                    last["doc"]["dwell_until"] = ts
+                    last["doc"]["dwell_count"] += 1
+                else:
+                    until, count = merges.get(last["_id"], (ts, 0))
+                    merges[last["_id"]] = (max(until, ts), count + 1)
+                continue
+
+            log["dwell_until"] = log["timestamp"]
+            log["dwell_count"] = 1
+            kept.append(log)
+            if last is None or ts >= last["dwell_until"]:
+                # Late points from an old batch never replace the newer stored point
+                last = {"_id": log["_id"], "lat": log["lat"], "lng": log["lng"], "timestamp": ts, "dwell_until": ts, "doc": log}
+
+        if last is not None:
+            last["doc"] = None             # Documents leave our hands once the batch is queued
+        return kept, merges, last
+
+    def commit(self, driver_id, tail, pings: int, stored: int):
+        """Remembers the stored point a queued batch ended on, unless a newer batch already moved past it"""
+        with self._lock:
+            if tail is not None:
+                current = self._last.get(driver_id)
+                if current is None or current["dwell_until"] <= tail["dwell_until"]:
+                    self._last[driver_id] = tail
+                self._last.move_to_end(driver_id)
+                while len(self._last) > TRACKED_DRIVERS:
+                    self._last.popitem(last=False)
+
+            self.stats["pings"] += pings
+            self.stats["stored"] += stored
+            self.stats["merged"] += pings - stored
+
+    def apply(self, driver_id, logs):
+        """plan() and commit() in one step, for callers whose writes cannot be rejected"""
+        kept, merges, tail = self.plan(driver_id, logs)
+        self.commit(driver_id, tail, len(logs), len(kept))
+        return kept, merges
+
+def worked_seconds(pings):
+    """
+    Work time from time-ordered pings: gaps under WORK_GAP_SECONDS between
+    consecutive pings count. Merged points are intervals
+    [timestamp, dwell_until] that count in full; legacy points without
+    dwell_until are instants. Overlapping intervals are unioned, so points
+    stored by different workers are never double counted.
+    """
+    total = 0.0
+    span_start = span_end = None
+    for p in pings:
+        start = p["timestamp"]
+        end = max(p.get("dwell_until") or start, start)
+        if span_end is None:
+            span_start, span_end = start, end
+        elif start <= span_end:
+            span_end = max(span_end, end)
+        else:
+            total += (span_end - span_start).total_seconds()
+            gap = (start - span_end).total_seconds()
+            if gap < WORK_GAP_SECONDS:
+                total += gap
+            span_start, span_end = start, end
+    if span_end is not None:
+        total += (span_end - span_start).total_seconds()
+    return total
+
+
+stationary_filter = StationaryFilter()
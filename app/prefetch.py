@@ -0,0 +1,97 @@
+# app/prefetch.py
+import gzip
+import json
+from datetime import datetime, timedelta
+
+from fastapi import Request, Response
+from bson import ObjectId
+
+from app.database import order_collection, customer_collection
+from app.routing import plan_route
+
+PREFETCH_MAX_DAYS = 7
+WORKLIST_STATUSES = ["PENDING", "IN_PROGRESS", "DELIVERED"]
+GZIP_MIN_BYTES = 1024          # Smaller bodies are not worth the CPU or the header
+GZIP_LEVEL = 6
+
+# Column layouts of the compact format; the app zips each row with its column list
+ORDER_COLUMNS = ["_id", "date", "status", "customer_id", "customer_name", "total_amount", "is_rescheduled", "route_position"]
+CUSTOMER_COLUMNS = ["address", "phone", "city", "verified_lat", "verified_lng"]
+ORDER_FIELDS = {"assigned_date": 1, "created_at": 1, "status": 1, "customer_id": 1, "customer_name": 1, "total_amount": 1, "is_rescheduled": 1}
+CUSTOMER_FIELDS = {"landmark": 1, "phone_number": 1, "city": 1, "verified_lat": 1, "verified_lng": 1}
+
+
+def date_range(start: str, days: int):
+    first = datetime.strptime(start, "%Y-%m-%d")
+    return [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+
+
+def _order_date(order):
+    # Same rule as /driver/orders: assigned_date, else the UTC day the order was created
+    if order.get("assigned_date"):
+        return order["assigned_date"]
+    return order["created_at"].strftime("%Y-%m-%d") if order.get("created_at") else None
+
+
+def build_prefetch(driver_id: ObjectId, dates):
+    """
+    The driver's worklists for several days in one compact document: each
+    order appears once as a row of ORDER_COLUMNS, and customer details are
+    sent once per customer in a side table of CUSTOMER_COLUMNS rows keyed by
+    customer id. Active stops carry their planned route position per day.
+    """
+    first = datetime.strptime(dates[0], "%Y-%m-%d")
+    end = datetime.strptime(dates[-1], "%Y-%m-%d") + timedelta(days=1)
+    orders = list(order_collection.find({
+        "assigned_driver_id": driver_id,
+        "status": {"$in": WORKLIST_STATUSES},
+        "$or": [
+            {"assigned_date": {"$in": dates}},
+            {"assigned_date": {"$exists": False}, "created_at": {"$gte": first, "$lt": end}}
+        ]
+    }, ORDER_FIELDS).sort("_id", 1))
+
+    customers = {
+        c["_id"]: c for c in customer_collection.find(
+            {"_id": {"$in": list({ObjectId(o["customer_id"]) for o in orders})}},
+            CUSTOMER_FIELDS
+        )
+    }
+    # Orders whose customer is gone are dropped, as in /driver/orders
+    orders = [o for o in orders if ObjectId(o["customer_id"]) in customers and _order_date(o) in dates]
+
+    positions = {}
+    for date in dates:
+        stops = []
+        for o in orders:
+            if _order_date(o) == date and o["status"] in ("PENDING", "IN_PROGRESS"):
+                c = customers[ObjectId(o["customer_id"])]
+                stops.append((str(o["_id"]), c.get("verified_lat"), c.get("verified_lng")))
+        if stops:
+            # Planned directly: a start-less plan must not land in the route cache /driver/orders reuses
+            positions.update({key: i for i, key in enumerate(plan_route(None, stops))})
+
+    return {
+        "success": True,
+        "dates": dates,
+        "order_columns": ORDER_COLUMNS,
+        "orders": [[
+            str(o["_id"]), _order_date(o), o["status"], str(o["customer_id"]), o.get("customer_name"),
+            o.get("total_amount"), bool(o.get("is_rescheduled")), positions.get(str(o["_id"]))
+        ] for o in orders],
+        "customer_columns": CUSTOMER_COLUMNS,
+        "customers": {
+            str(c_id): [c.get("landmark", "No Address"), c.get("phone_number"), c.get("city", "Unknown"), c.get("verified_lat"), c.get("verified_lng")]
+            for c_id, c in customers.items()
+        }
+    }
+
+
+def compact_json_response(request: Request, payload) -> Response:
+    """Minified JSON, gzipped when the client accepts it and the body is big enough to gain"""
+    body = json.dumps(payload, separators=(",", ":"), default=str).encode()
+    headers = {"Vary": "Accept-Encoding"}
+    if len(body) >= GZIP_MIN_BYTES and "gzip" in request.headers.get("accept-encoding", "").lower():
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,165 @@
+# app/query_audit.py
+import json
+import os
+import threading
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+# Development mode: QUERY_AUDIT=1 audits every request; tests can audit a block without it
+ENABLED = os.getenv("QUERY_AUDIT", "").lower() in ("1", "true", "yes")
+REPEAT_LIMIT = int(os.getenv("QUERY_AUDIT_REPEAT", 5))   # Same shape more often than this in one request is reported
+STACK_FRAMES = 4
+
+# Cursor bookkeeping and handshakes are not queries the code asked for
+IGNORED_COMMANDS = {"getMore", "killCursors", "endSessions", "hello", "isMaster", "ismaster", "ping", "saslStart", "saslContinue"}
+_FILTER_FIELDS = {"find": "filter", "count": "query", "distinct": "query", "findAndModify": "query"}
+_BULK_FIELDS = {"update": ("updates", "q"), "delete": ("deletes", "q")}
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_current = ContextVar("query_audit", default=None)
+
+
+def _shape(value):
+    """The filter with every value replaced by ?, keeping field names, operators and $or/$and structure"""
+    if isinstance(value, dict):
+        return {k: _shape(v) for k, v in sorted(value.items())}
+    if isinstance(value, list) and value and all(isinstance(v, dict) for v in value):
+        return [_shape(v) for v in value]
+    return "?"
+
+
+def filter_shape(command_name, command):
+    if command_name in _FILTER_FIELDS:
+        query = command.get(_FILTER_FIELDS[command_name]) or {}
+    elif command_name in _BULK_FIELDS:
+        field, key = _BULK_FIELDS[command_name]
+        ops = command.get(field) or [{}]
+        query = ops[0].get(key, {})
+    elif command_name == "aggregate":
+        pipeline = command.get("pipeline") or []
+        if not pipeline or "$match" not in pipeline[0]:
+            return json.dumps([next(iter(stage), "") for stage in pipeline])
+        query = pipeline[0]["$match"]
+    else:
+        return ""
+    return json.dumps(_shape(query), sort_keys=True, default=str)
+
+
+def _stack_excerpt():
+    """The last few frames of application code that led to the command"""
+    frames = [
+        f for f in traceback.extract_stack()[:-3]
+        if f.filename.startswith(_ROOT) and "site-packages" not in f.filename
+        and not f.filename.endswith(("query_audit.py", "metrics.py"))
+    ]
+    return "".join(traceback.format_list(frames[-STACK_FRAMES:]))
+
+
+class RequestQueries:
+    """Mongo commands issued while serving one request (or one audited block), by collection, command and filter shape"""
+
+    def __init__(self, label):
+        self.label = label
+        self.total = 0
+        self.counts = {}
+        self._reported = set()
+        self._lock = threading.Lock()
+
+    def record(self, collection, command_name, shape):
+        key = (collection, command_name, shape)
+        with self._lock:
+            self.total += 1
+            self.counts[key] = count = self.counts.get(key, 0) + 1
+            report = count > REPEAT_LIMIT and key not in self._reported
+            if report:
+                self._reported.add(key)
+        if report:
+            print(
+                f"⚠️ N+1 QUERY: {self.label} ran {command_name} on {collection} with filter {shape or '-'} "
+                f"more than {REPEAT_LIMIT} times\n{_stack_excerpt()}"
+            )
+
+    def summary(self, top=5):
+        worst = sorted(self.counts.items(), key=lambda item: -item[1])[:top]
+        return "\n".join(f"  {n} x {cmd} {coll} {shape}" for (coll, cmd, shape), n in worst)
+
+
+class QueryAuditListener(monitoring.CommandListener):
+    """Feeds every command into the RequestQueries of the request that issued it; free when nothing is audited"""
+
+    def started(self, event):
+        queries = _current.get()
+        if queries is None or event.command_name in IGNORED_COMMANDS:
+            return
+        name = event.command_name
+        collection = event.command.get(name)
+        queries.record(collection if isinstance(collection, str) else "-", name, filter_shape(name, event.command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+query_listener = QueryAuditListener()
+_recorders = []        # Lists collecting the RequestQueries of every request while assert_max_queries is open
+
+
+class QueryAuditMiddleware:
+    """Audits each request in development mode, or while a test is counting queries; otherwise passes straight through"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (ENABLED or _recorders):
+            return await self.app(scope, receive, send)
+        queries = RequestQueries(f"{scope['method']} {scope['path']}")
+        token = _current.set(queries)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            for recorder in list(_recorders):
+                recorder.append(queries)
+
+
+@contextmanager
+def count_queries(label: str = "audited block"):
+    """
+    Collects the queries of the block itself and of every request it makes to
+    the app. Yields a list of RequestQueries, the block's own first.
+    """
+    block = RequestQueries(label)
+    audited = [block]
+    token = _current.set(block)
+    _recorders.append(audited)
+    try:
+        yield audited
+    finally:
+        _current.reset(token)
+        _recorders.remove(audited)
+
+
+@contextmanager
+def assert_max_queries(max_queries: int, label: str = "audited block"):
+    """
+    Fails with the most repeated shapes if the code in the block, or the
+    requests it makes to the app, run more than `max_queries` Mongo queries:
+
+        with assert_max_queries(6):
+            client.get("/driver/orders", headers=headers)
+    """
+    with count_queries(label) as audited:
+        yield audited
+    total = sum(q.total for q in audited)
+    if total > max_queries:
+        merged = RequestQueries(label)
+        for q in audited:
+            for key, n in q.counts.items():
+                merged.counts[key] = merged.counts.get(key, 0) + n
+        raise AssertionError(f"{label}: {total} queries, expected at most {max_queries}\n{merged.summary()}")
@@ -0,0 +1,187 @@
+# app/routing.py
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from app.geo import haversine_km, to_coord
+
+ROUTE_CACHE_SIZE = 2000      # (driver, date) plans kept in memory
+REPLAN_FRACTION = 0.5        # Re-solve from scratch when more than this share of stops is new
+TWO_OPT_MAX_PASSES = 50
+
+
+def distance_matrix(lats, lngs):
+    """Pairwise Haversine distances (km) between all points, in one broadcast"""
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    return haversine_km(lats[:, None], lngs[:, None], lats[None, :], lngs[None, :])
+
+
+def _located(lat, lng):
+    lat, lng = to_coord(lat), to_coord(lng)
+    return None if np.isnan(lat) or np.isnan(lng) else (lat, lng)
+
+
+def _nearest_neighbour(dist, first):
+    n = dist.shape[0]
+    visited = np.zeros(n, dtype=bool)
+    path = [first]
+    visited[first] = True
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, dist[path[-1]])
+        nxt = int(np.argmin(row))
+        path.append(nxt)
+        visited[nxt] = True
+    return path
+
+
+def _two_opt(dist, path):
+    """
+    2-opt on an open path whose first node is pinned (the driver's position).
+    Reverses path[i..j] whenever that shortens the route; for a given i all
+    candidate j are scored in one vectorised step.
+    """
+    path = np.array(path, dtype=np.int64)
+    n = len(path)
+    if n < 4:
+        return path.tolist()
+
+    for _ in range(TWO_OPT_MAX_PASSES):
+        improved = False
+        for i in range(1, n - 1):
+            a, b = path[i - 1], path[i]
+            js = np.arange(i + 1, n)
+            c = path[js]
+            # Last node has no successor: reversing a tail only changes one edge
+            e = path[np.minimum(js + 1, n - 1)]
+            has_next = js < n - 1
+            delta = dist[a, c] - dist[a, b] + np.where(has_next, dist[b, e] - dist[c, e], 0.0)
+            k = int(np.argmin(delta))
+            if delta[k] < -1e-9:
+                j = int(js[k])
+                path[i:j + 1] = path[i:j + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return path.tolist()
+
+
+def plan_route(start, stops):
+    """
+    Orders `stops` [(key, lat, lng)] into a short open route starting at
+    `start` (lat, lng), or at the first stop when the start is unknown.
+    Stops without coordinates keep their input order at the end.
+    Returns the stop keys in visiting order.
+    """
+    located, unlocated = [], []
+    for k, lat, lng in stops:
+        point = _located(lat, lng)
+        if point:
+            located.append((k, *point))
+        else:
+            unlocated.append(k)
+    if not located:
+        return unlocated
+
+    start = _located(*start) if start else None
+    has_start = start is not None
+    lats = [s[1] for s in located]
+    lngs = [s[2] for s in located]
+    if has_start:
+        lats.insert(0, start[0])
+        lngs.insert(0, start[1])
+
+    dist = distance_matrix(lats, lngs)
+    path = _two_opt(dist, _nearest_neighbour(dist, 0))
+    offset = 1 if has_start else 0
+    return [located[node - offset][0] for node in path if node >= offset] + unlocated
+
+
+def route_length_km(start, points):
+    """Length of the open route start -> points[0] -> ... (points are (lat, lng))"""
+    if not points:
+        return 0.0
+    lats = np.array([p[0] for p in points], dtype=float)
+    lngs = np.array([p[1] for p in points], dtype=float)
+    legs = haversine_km(lats[:-1], lngs[:-1], lats[1:], lngs[1:]) if len(points) > 1 else np.zeros(0)
+    first = haversine_km(to_coord(start[0]), to_coord(start[1]), lats[:1], lngs[:1]) if start else np.zeros(1)
+    return float(np.nansum(first) + np.nansum(legs))
+
+
+class RoutePlanner:
+    """
+    Cached route plans per (driver, date). A request whose stop set matches
+    the cached plan reuses it as-is. Completed or reassigned stops are simply
+    dropped, and new stops go in at their cheapest insertion point, so the
+    route the driver has been following stays stable during the day. A full
+    re-solve only happens on the first request or when most stops are new.
+    """
+
+    def __init__(self, max_entries: int = ROUTE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._plans = OrderedDict()   # (driver_id, date) -> [(key, lat, lng)] in route order
+        self._lock = threading.Lock()
+
+    def route(self, driver_id, date, start, stops):
+        """Stop keys of `stops` [(key, lat, lng)] in visiting order"""
+        cache_key = (str(driver_id), date)
+        start = _located(*start) if start else None
+        with self._lock:
+            plan = self._plans.get(cache_key)
+            if plan is not None:
+                self._plans.move_to_end(cache_key)
+
+        wanted = {k: (k, lat, lng) for k, lat, lng in stops}
+        if plan is None:
+            plan = self._solve(start, list(wanted.values()))
+        else:
+            kept = [s for s in plan if wanted.get(s[0]) == s]
+            kept_keys = {s[0] for s in kept}
+            new = [s for k, s in wanted.items() if k not in kept_keys]
+            if len(new) > REPLAN_FRACTION * max(len(wanted), 1):
+                plan = self._solve(start, list(wanted.values()))
+            elif new or len(kept) != len(plan):
+                plan = self._repair(start, kept, new)
+
+        with self._lock:
+            self._plans[cache_key] = plan
+            self._plans.move_to_end(cache_key)
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+        return [s[0] for s in plan]
+
+    def _solve(self, start, stops):
+        by_key = {s[0]: s for s in stops}
+        return [by_key[k] for k in plan_route(start, stops)]
+
+    def _repair(self, start, plan, new):
+        """Cheapest insertion of each new stop; stops without coordinates stay at the end"""
+        route = [s for s in plan if _located(s[1], s[2])]
+        tail = [s for s in plan if not _located(s[1], s[2])]
+        for stop in new:
+            point = _located(stop[1], stop[2])
+            if point is None:
+                tail.append(stop)
+                continue
+            nodes = ([start] if start else []) + [_located(s[1], s[2]) for s in route]
+            if not nodes:
+                route.append(stop)
+                continue
+            lats = np.array([p[0] for p in nodes])
+            lngs = np.array([p[1] for p in nodes])
+            to_new = haversine_km(point[0], point[1], lats, lngs)
+            # Inserting after node i replaces leg i -> i+1; appending after the last node adds one leg
+            leg = haversine_km(lats[:-1], lngs[:-1], lats[1:], lngs[1:])
+            cost = np.append(to_new[:-1] + to_new[1:] - leg, to_new[-1])
+            after = int(np.argmin(cost))
+            route.insert(after if start else after + 1, stop)
+        return route + tail
+
+    def invalidate(self, driver_id, date=None):
+        with self._lock:
+            for key in [k for k in self._plans if k[0] == str(driver_id) and date in (None, k[1])]:
+                del self._plans[key]
+
+
+route_planner = RoutePlanner()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, List, Literal
 
 class DriverLogin(BaseModel):
     phone_number: str = Field(..., max_length=15)
@@ -20,6 +20,24 @@ class LocationPing(BaseModel):
     lat: float = Field(..., ge=-90.0, le=90.0)
     lng: float = Field(..., ge=-180.0, le=180.0)
 
+class LocationPoint(BaseModel):
+    lat: float = Field(..., ge=-90.0, le=90.0)
+    lng: float = Field(..., ge=-180.0, le=180.0)
+    t: Optional[float] = Field(default=None, ge=0, le=1e10) # Unix seconds when recorded on the phone; server time if missing
+
+class LocationBatch(BaseModel):
+    points: List[LocationPoint] = Field(..., min_length=1, max_length=500)
+
+class OfflineAction(BaseModel):
+    action_type: Literal["COMPLETE_ORDER", "ACCEPT_ORDER"]
+    idempotency_key: str = Field(..., min_length=1, max_length=100) # Generated on the phone when the action is queued
+    payload: dict
+    recorded_at: Optional[float] = Field(default=None, ge=0, le=1e10) # Unix seconds when the driver did it offline
+
+class OfflineSyncRequest(BaseModel):
+    device_id: Optional[str] = None
+    offline_actions: List[OfflineAction] = Field(..., max_length=200)
+
 class ChangeRequestPayload(BaseModel):
     customer_id: str
     category: str
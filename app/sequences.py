@@ -0,0 +1,52 @@
+# app/sequences.py
+import os
+import threading
+
+from pymongo import ReturnDocument
+
+from app.database import counters_collection
+
+SEQUENCE_BLOCK_SIZE = 100
+
+
+class SequenceAllocator:
+    """
+    Hands out ids for named sequences from blocks reserved with one $inc on
+    the counters collection, instead of one find_one_and_update per id.
+    Blocks never overlap across threads or processes because each one is
+    carved out by an atomic $inc. Ids left in a block when a process exits
+    are skipped, so sequences are unique and increasing but may have gaps.
+    """
+
+    def __init__(self, block_size: int = SEQUENCE_BLOCK_SIZE):
+        self.block_size = block_size
+        self._blocks = {}          # name -> [next_id, last_id]
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _reserve(self, name: str, count: int):
+        result = counters_collection.find_one_and_update(
+            {"_id": name},
+            {"$inc": {"sequence_value": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        last = result["sequence_value"]
+        return [last - count + 1, last]
+
+    def next(self, name: str) -> int:
+        with self._lock:
+            if os.getpid() != self._pid:
+                # Forked worker: the parent's blocks are not ours to hand out
+                self._blocks.clear()
+                self._pid = os.getpid()
+
+            block = self._blocks.get(name)
+            if block is None or block[0] > block[1]:
+                block = self._blocks[name] = self._reserve(name, self.block_size)
+            value = block[0]
+            block[0] += 1
+            return value
+
+
+sequence_allocator = SequenceAllocator()
@@ -0,0 +1,139 @@
+# app/shifts.py
+import time
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
+
+from app.database import shifts_collection
+
+LEDGER_PAGE_SIZE = 50
+LEDGER_MAX_PAGE_SIZE = 500
+NO_SHIFT_TTL = 15           # Seconds a "no open shift" answer is reused; a shift opened on another server shows up within this
+
+
+def ensure_indexes():
+    # Ledger pages walk (date, _id) newest first, per admin and optionally per driver
+    shifts_collection.create_index([("admin_id", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)])
+    shifts_collection.create_index([("admin_id", ASCENDING), ("driver_id", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)])
+
+    # At most one OPEN shift per driver. Existing duplicates hold stock and cash, so they are
+    # reported for an admin to reconcile rather than folded automatically.
+    duplicates = list(shifts_collection.aggregate([
+        {"$match": {"status": "OPEN"}},
+        {"$group": {"_id": "$driver_id", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]))
+    if duplicates:
+        for d in duplicates:
+            print(f"⚠️ Driver {d['_id']} has {d['count']} open shifts; one-open-shift index not created")
+    else:
+        shifts_collection.create_index(
+            "driver_id", unique=True, name="one_open_shift_per_driver",
+            partialFilterExpression={"status": "OPEN"}
+        )
+    open_shifts.clear()
+
+
+class OpenShiftCache:
+    """
+    driver_id -> _id of their OPEN shift, kept in process. Filled on
+    /shifts/start and on first lookup, dropped on /shifts/close. Every write
+    that goes through a cached id still filters on status OPEN, so an entry
+    left behind by a shift closed on another server only costs a miss.
+    Drivers without a shift are remembered for NO_SHIFT_TTL seconds.
+    """
+
+    def __init__(self, no_shift_ttl: float = NO_SHIFT_TTL):
+        self.no_shift_ttl = no_shift_ttl
+        self._ids = {}             # driver_id -> (shift _id or None, cached at)
+
+    def get(self, driver_id: str):
+        entry = self._ids.get(driver_id)
+        if entry and (entry[0] is not None or time.monotonic() - entry[1] < self.no_shift_ttl):
+            return entry[0]
+        return self.refresh(driver_id)
+
+    def refresh(self, driver_id: str):
+        """Reads the open shift from the database and caches the answer"""
+        shift = shifts_collection.find_one({"driver_id": driver_id, "status": "OPEN"}, {"_id": 1})
+        self.put(driver_id, shift["_id"] if shift else None)
+        return shift["_id"] if shift else None
+
+    def find(self, driver_id: str, projection=None):
+        """The driver's open shift document, read by _id, or None"""
+        shift_id = self.get(driver_id)
+        shift = shifts_collection.find_one({"_id": shift_id, "status": "OPEN"}, projection) if shift_id else None
+        if shift is None and shift_id is not None:
+            # Closed on another server since it was cached
+            shift_id = self.refresh(driver_id)
+            shift = shifts_collection.find_one({"_id": shift_id, "status": "OPEN"}, projection) if shift_id else None
+        return shift
+
+    def load(self, driver_ids, projection=None):
+        """Open shift documents for several drivers in one query, refreshing the cache on the way"""
+        shifts = {}
+        for shift in shifts_collection.find({"driver_id": {"$in": list(driver_ids)}, "status": "OPEN"}, projection):
+            shifts.setdefault(shift["driver_id"], shift)
+        for driver_id in driver_ids:
+            self.put(driver_id, shifts[driver_id]["_id"] if driver_id in shifts else None)
+        return shifts
+
+    def put(self, driver_id: str, shift_id):
+        self._ids[driver_id] = (shift_id, time.monotonic())
+
+    def evict(self, driver_id: str):
+        self._ids.pop(driver_id, None)
+
+    def clear(self):
+        self._ids.clear()
+
+
+def encode_ledger_cursor(shift) -> str:
+    """Keyset position after `shift`: its date and _id"""
+    date = shift["date"]
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return f"{date.isoformat()}|{shift['_id']}"
+
+
+def ledger_page_filter(cursor: str):
+    """Filter for the shifts after a cursor in (date desc, _id desc) order, or None if it is malformed"""
+    try:
+        date_str, id_str = cursor.split("|")
+        date, shift_id = datetime.fromisoformat(date_str), ObjectId(id_str)
+    except (ValueError, InvalidId):
+        return None
+    return {"$or": [{"date": {"$lt": date}}, {"date": date, "_id": {"$lt": shift_id}}]}
+
+
+def ledger_totals(query):
+    """Ledger stat cards for every shift matching `query`, summed server-side"""
+    expected = {"$ifNull": ["$financials.expected_cash", 0]}
+    totals = next(shifts_collection.aggregate([
+        {"$match": query},
+        {"$group": {
+            "_id": None,
+            # Reconciled shifts count the cash actually handed in, the rest what is expected
+            "total_cash": {"$sum": {"$cond": [
+                {"$eq": ["$status", "RECONCILED"]},
+                {"$ifNull": ["$financials.actual_cash", expected]},
+                expected
+            ]}},
+            "total_upi": {"$sum": {"$ifNull": ["$financials.upi_total", 0]}},
+            "total_delivered": {"$sum": {"$ifNull": ["$load_return.full", 0]}},
+            "total_empties": {"$sum": {"$add": [
+                {"$ifNull": ["$load_departure.empty", 0]},
+                {"$ifNull": ["$load_return.empty", 0]}
+            ]}},
+            "shift_count": {"$sum": 1}
+        }}
+    ]), None)
+    if totals is None:
+        return {"total_cash": 0, "total_upi": 0, "total_delivered": 0, "total_empties": 0, "shift_count": 0}
+    totals.pop("_id")
+    return totals
+
+
+open_shifts = OpenShiftCache()
@@ -0,0 +1,102 @@
+# app/territories.py
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.cities import city_slug
+from app.database import territory_collection, driver_collection
+
+
+class TerritoryIndex:
+    """
+    City -> driver ownership ("one city = one driver"), one document per
+    (admin_id, city slug) under a unique index. A claim is a single bulk
+    upsert: cities the driver already owns match and are left alone, new
+    ones are inserted, and a city owned by someone else fails with a
+    duplicate key. The index decides the race, so two concurrent updates
+    can never both take the same city.
+    Only active drivers hold territory; deactivating or deleting a driver
+    releases everything it owned.
+    """
+
+    def ensure_indexes(self):
+        """Unique ownership index, then rebuilds ownership from active drivers (earliest driver wins overlaps and later ones keep the rest; drivers without an agency are reported and skipped)"""
+        territory_collection.create_index([("admin_id", 1), ("slug", 1)], unique=True)
+        territory_collection.create_index("driver_id")
+
+        active_ids = []
+        for d in driver_collection.find({"is_active": True}, {"admin_id": 1, "name": 1, "assigned_cities": 1}).sort("_id", 1):
+            if not d.get("admin_id"):
+                # Cities are unique per agency; without one the driver cannot hold territory
+                print(f"⚠️ Territory skipped: driver {d.get('name', d['_id'])} ({d['_id']}) has no admin_id")
+                continue
+            active_ids.append(d["_id"])
+            cities = d.get("assigned_cities") or []
+            # claim() is all-or-nothing, so retry without the overlaps: the driver keeps every city nobody else holds
+            while True:
+                conflicts = self.claim(d["admin_id"], d["_id"], cities)
+                if not conflicts:
+                    break
+                taken = {city_slug(city) for city, _ in conflicts}
+                cities = [c for c in cities if city_slug(c) not in taken]
+                for city, owner in conflicts:
+                    print(f"⚠️ Territory overlap: {city} of {d.get('name', d['_id'])} is already held by {owner}")
+        territory_collection.delete_many({"driver_id": {"$nin": active_ids}})
+
+    def claim(self, admin_id: ObjectId, driver_id: ObjectId, cities):
+        """
+        Makes `cities` exactly the driver's territory.
+        Returns [(city, owner_name)] for cities held by another driver; in that
+        case nothing changes, including cities the driver already owned.
+        """
+        wanted = {}
+        for city in cities:
+            wanted.setdefault(city_slug(city), city)
+
+        if wanted:
+            ops = [
+                UpdateOne(
+                    {"admin_id": admin_id, "slug": slug, "driver_id": driver_id},
+                    {"$setOnInsert": {"city": city}},
+                    upsert=True
+                )
+                for slug, city in wanted.items()
+            ]
+            try:
+                territory_collection.bulk_write(ops, ordered=False)
+            except BulkWriteError as bwe:
+                errors = bwe.details.get("writeErrors", [])
+                if any(err.get("code") != 11000 for err in errors):
+                    raise
+                slugs = list(wanted)
+                taken = [slugs[err["index"]] for err in errors]
+                claimed = [up["_id"] for up in bwe.details.get("upserted", [])]
+                if claimed:
+                    # Undo the partial claim so the driver keeps its previous territory
+                    territory_collection.delete_many({"_id": {"$in": claimed}})
+                return self._owners_of(admin_id, taken, wanted)
+
+        # Cities dropped from the list go back to the pool
+        territory_collection.delete_many({"driver_id": driver_id, "slug": {"$nin": list(wanted)}})
+        return []
+
+    def _owners_of(self, admin_id, slugs, names):
+        rows = list(territory_collection.find({"admin_id": admin_id, "slug": {"$in": slugs}}, {"slug": 1, "driver_id": 1}))
+        drivers = {
+            d["_id"]: d["name"]
+            for d in driver_collection.find({"_id": {"$in": [r["driver_id"] for r in rows]}}, {"name": 1})
+        }
+        return [(names[r["slug"]], drivers.get(r["driver_id"], "another driver")) for r in rows]
+
+    def release(self, driver_id: ObjectId):
+        territory_collection.delete_many({"driver_id": driver_id})
+
+    def owners(self, admin_id: ObjectId, cities):
+        """Driver ids owning any of `cities`: one lookup on the ownership index"""
+        slugs = list({city_slug(c) for c in cities})
+        return [row["driver_id"] for row in territory_collection.find(
+            {"admin_id": admin_id, "slug": {"$in": slugs}}, {"driver_id": 1}
+        )]
+
+
+territory_index = TerritoryIndex()
@@ -0,0 +1,589 @@
+# benchmarks.py
+# Performance checks for the hot paths. One scenario per process, since the round-trip
+# counters must be registered before app.database creates the MongoClient:
+#   python benchmarks.py assignment
+# Scenarios that import app.* need the same .env (MONGO_URI) as the server.
+import math
+import sys
+import time
+import random
+import statistics
+
+from bson import ObjectId
+from pymongo import monitoring
+
+# Padil / Mangalore area, used as the centre for synthetic positions
+BASE_LAT, BASE_LNG = 12.8698, 74.8430
+
+
+def _jitter(spread=0.08):
+    return BASE_LAT + random.uniform(-spread, spread), BASE_LNG + random.uniform(-spread, spread)
+
+
+def _report(label, samples_s):
+    samples_ms = sorted(s * 1000 for s in samples_s)
+    p95 = samples_ms[int(len(samples_ms) * 0.95) - 1]
+    print(f"  {label:<32} n={len(samples_ms):<6} p50={statistics.median(samples_ms):.3f}ms  p95={p95:.3f}ms  total={sum(samples_ms):.1f}ms")
+
+
+def bench_assignment(n_drivers=500, n_open_orders=10_000, n_cities=10):
+    """Auto-assignment of 10k orders across 500 drivers, load-only vs proximity scoring"""
+    from app.assignment import AssignmentEngine
+
+    random.seed(7)
+    cities = [f"City-{i}" for i in range(n_cities)]
+    drivers, shifts, loads = [], {}, {}
+    for i in range(n_drivers):
+        d_id = ObjectId()
+        lat, lng = _jitter()
+        drivers.append({
+            "_id": d_id, "name": f"Driver {i}",
+            "assigned_cities": [cities[i % n_cities]],
+            "current_lat": lat, "current_lng": lng
+        })
+        shifts[str(d_id)] = {"load_departure": {"full": 60, "empty": 0}, "load_return": {"full": 0, "empty": 0}}
+        loads[str(d_id)] = random.randint(0, 20)
+
+    orders = [(random.choice(cities), *_jitter()) for _ in range(n_open_orders)]
+    print(f"\n🚚 ASSIGNMENT: {n_drivers} drivers, {n_open_orders} orders, {n_cities} cities")
+
+    for label, use_coords in (("load-only (heap)", False), ("proximity (vectorised score)", True)):
+        engine = AssignmentEngine(drivers, shifts, dict(loads))
+        samples, unassigned = [], 0
+        for city, lat, lng in orders:
+            t0 = time.perf_counter()
+            driver = engine.assign(city, lat, lng) if use_coords else engine.assign(city)
+            samples.append(time.perf_counter() - t0)
+            unassigned += driver is None
+        _report(label, samples)
+        print(f"  {'':<32} unassigned={unassigned}  max_load={int(engine.load.max())}")
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts round trips to the server"""
+
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        self.commands.append(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _counting_client():
+    # Must be registered before app.database creates the MongoClient, or it never sees a command
+    if "app.database" in sys.modules:
+        raise RuntimeError("round-trip counter registered after app.database was imported; run one scenario per process")
+    counter = CommandCounter()
+    monitoring.register(counter)
+    return counter
+
+
+class LatencyInjector(monitoring.CommandListener):
+    """Simulates a slow app-to-database link: every command waits rtt_ms before it is sent"""
+
+    def __init__(self, rtt_ms=0):
+        self.rtt_s = rtt_ms / 1000
+
+    def started(self, event):
+        if self.rtt_s:
+            time.sleep(self.rtt_s)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def bench_bulk_order_round_trips(batch_sizes=(10, 50, 200)):
+    """Mongo round trips per order in /customers/bulk-order (writes to a throwaway admin_id)"""
+    import asyncio
+    counter = _counting_client()
+    from app.database import customer_collection, order_collection
+    from customer import bulk_order
+
+    print("\n📦 BULK ORDER ROUND TRIPS")
+    for n in batch_sizes:
+        admin_id = ObjectId()
+        ids = customer_collection.insert_many([
+            {"admin_id": admin_id, "name": f"Bench {i}", "city": "BenchCity", "records": [], "active_order_lock": False}
+            for i in range(n)
+        ]).inserted_ids
+        try:
+            counter.commands.clear()
+            asyncio.run(bulk_order(None, [str(i) for i in ids], admin_id))
+            trips = len(counter.commands)
+            print(f"  {n:>4} orders: {trips} round trips ({trips / n:.2f} per order)  {counter.commands}")
+        finally:
+            order_collection.delete_many({"admin_id": admin_id})
+            customer_collection.delete_many({"admin_id": admin_id})
+
+
+def bench_consumer_ids(n_ids=200_000, n_probes=1_000_000):
+    """Footprint, false-positive rate and probe speed of the consumer_id bitmap"""
+    import numpy as np
+    from app.consumer_ids import ConsumerIdIndex, CONSUMER_ID_SPACE
+
+    rng = np.random.default_rng(7)
+    stored = rng.choice(CONSUMER_ID_SPACE, size=n_ids, replace=False)
+    index = ConsumerIdIndex()
+    index.add_many(stored)
+    index._loaded = True
+    index._checked_at = float("inf")   # No refresh against the DB while probing
+
+    probes = rng.integers(0, CONSUMER_ID_SPACE, size=n_probes)
+    t0 = time.perf_counter()
+    hits = index.might_exist_many(probes)
+    elapsed = time.perf_counter() - t0
+    truth = np.isin(probes, stored)
+
+    stats = index.stats()
+    print(f"\n🔢 CONSUMER ID BITMAP: {n_ids} stored ids, {n_probes} probes")
+    print(f"  footprint={stats['footprint_bytes'] / 1024:.0f} KB  fill={stats['fill_ratio']:.4f}")
+    print(f"  false positives={int((hits & ~truth).sum())}  false negatives={int((~hits & truth).sum())}")
+    print(f"  probe rate={n_probes / elapsed / 1e6:.1f}M ids/s (vectorised)")
+
+
+def bench_driver_worklist(n_orders=150, records_per_customer=400, link_kbps=750, link_rtt_ms=300):
+    """/driver/orders for a heavy day: DB round trips, bytes pulled from Mongo and response size over a slow mobile link"""
+    import asyncio
+    import json
+    import bson
+    counter = _counting_client()
+    from app.database import customer_collection, order_collection
+    from driver import get_driver_worklist
+
+    admin_id, driver_id = ObjectId(), ObjectId()
+    history = [{"date": "2024-01-01", "status": "DELIVERED", "driver": "Bench", "qty": 1}] * records_per_customer
+    customers = []
+    for i in range(n_orders):
+        lat, lng = _jitter()
+        customers.append({
+            "admin_id": admin_id, "name": f"Bench {i}", "city": "BenchCity", "landmark": f"Near gate {i}",
+            "phone_number": f"90000{i:05d}", "verified_lat": lat, "verified_lng": lng, "records": history
+        })
+    ids = customer_collection.insert_many(customers).inserted_ids
+    order_collection.insert_many([
+        {"admin_id": admin_id, "customer_id": c_id, "assigned_driver_id": driver_id, "status": "PENDING",
+         "assigned_date": "2030-01-01", "customer_name": f"Bench {i}"}
+        for i, c_id in enumerate(ids)
+    ])
+    full_doc_bytes = len(bson.encode(customers[0]))
+
+    print(f"\n📋 DRIVER WORKLIST: {n_orders} orders, {records_per_customer} records per customer")
+    try:
+        samples = []
+        for _ in range(5):
+            counter.commands.clear()
+            t0 = time.perf_counter()
+            result = asyncio.run(get_driver_worklist("", str(BASE_LAT), str(BASE_LNG), "2030-01-01", driver_id=driver_id))
+            samples.append(time.perf_counter() - t0)
+        _report("worklist (server side)", samples)
+        body = len(json.dumps(result, default=str).encode())
+        print(f"  round trips={len(counter.commands)} {counter.commands}")
+        print(f"  customer bytes avoided by projection ≈ {full_doc_bytes * n_orders / 1024:.0f} KB")
+        print(f"  response={body / 1024:.1f} KB  ≈ {link_rtt_ms + body * 8 / link_kbps:.0f}ms on a {link_kbps} kbps / {link_rtt_ms}ms link")
+    finally:
+        order_collection.delete_many({"admin_id": admin_id})
+        customer_collection.delete_many({"admin_id": admin_id})
+
+
+def bench_routing(stop_counts=(20, 100, 300), repeats=5):
+    """Route planning time and length vs the old nearest-first sort, plus incremental repair"""
+    from app.geo import haversine_km
+    from app.routing import plan_route, route_length_km, RoutePlanner
+
+    random.seed(11)
+    start = (BASE_LAT, BASE_LNG)
+    print("\n🗺️  ROUTING: nearest-neighbour + 2-opt")
+    for n in stop_counts:
+        stops = [(str(i), *_jitter(0.15)) for i in range(n)]
+        coords = {k: (lat, lng) for k, lat, lng in stops}
+
+        samples = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            route = plan_route(start, stops)
+            samples.append(time.perf_counter() - t0)
+        _report(f"plan {n} stops", samples)
+
+        dist = haversine_km(BASE_LAT, BASE_LNG, [s[1] for s in stops], [s[2] for s in stops])
+        greedy = [stops[i][0] for i in dist.argsort()]
+        planned_km = route_length_km(start, [coords[k] for k in route])
+        greedy_km = route_length_km(start, [coords[k] for k in greedy])
+        print(f"  {'':<32} route={planned_km:.1f}km  nearest-first={greedy_km:.1f}km  ({100 * (1 - planned_km / greedy_km):.0f}% shorter)")
+
+        planner = RoutePlanner()
+        planner.route("bench", "day", start, stops)
+        samples = []
+        for i in range(repeats):
+            # Driver completes the next stop and the admin adds one new order
+            stops = stops[1:] + [(f"new-{i}", *_jitter(0.15))]
+            t0 = time.perf_counter()
+            planner.route("bench", "day", start, stops)
+            samples.append(time.perf_counter() - t0)
+        _report(f"repair {n} stops", samples)
+
+
+def bench_location_ingest(n_points=2000, batch_sizes=(10, 50, 200)):
+    """HTTP ingest throughput: one point per request vs /driver/locations/batch (throwaway driver)"""
+    counter = _counting_client()
+    from fastapi.testclient import TestClient
+    from app.database import driver_collection, driver_location_collection
+    from auth import create_access_token
+    from app.location_buffer import location_buffer
+    from main import app
+
+    driver_id = driver_collection.insert_one({"name": "Bench Driver", "is_active": True}).inserted_id
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': str(driver_id), 'role': 'driver'})}"}
+    t_base = time.time() - n_points
+    points = [{"lat": lat, "lng": lng, "t": t_base + i} for i, (lat, lng) in enumerate(_jitter() for _ in range(n_points))]
+
+    print(f"\n🛰️  LOCATION INGEST: {n_points} points over HTTP")
+    try:
+        with TestClient(app) as client:
+            counter.commands.clear()
+            t0 = time.perf_counter()
+            for p in points:
+                client.post("/driver/location", json={"lat": p["lat"], "lng": p["lng"]}, headers=headers)
+            elapsed = time.perf_counter() - t0
+            print(f"  {'single':<12} requests={n_points:<6} {n_points / elapsed:>8.0f} points/s  db commands/point={len(counter.commands) / n_points:.2f}")
+
+            for size in batch_sizes:
+                counter.commands.clear()
+                t0 = time.perf_counter()
+                for i in range(0, n_points, size):
+                    client.post("/driver/locations/batch", json={"points": points[i:i + size]}, headers=headers)
+                elapsed = time.perf_counter() - t0
+                requests = -(-n_points // size)
+                print(f"  {f'batch {size}':<12} requests={requests:<6} {n_points / elapsed:>8.0f} points/s  db commands/point={len(counter.commands) / n_points:.2f}")
+        # Lifespan shutdown has flushed the write-behind buffer by now
+        m = location_buffer.metrics()
+        print(f"  write-behind: flushes={m['flushes']}  max_queue_depth={m['max_queue_depth']}  flush latency {m['flush_latency_ms']}")
+    finally:
+        driver_location_collection.delete_many({"driver_id": driver_id})
+        driver_collection.delete_one({"_id": driver_id})
+
+
+def _synthetic_day(ping_every_s=30, n_stops=20, seed=5):
+    """One driver's day of pings: godown wait, drives, customer stops with GPS jitter, lunch and a signal outage"""
+    from datetime import datetime, timedelta, timezone
+
+    rng = random.Random(seed)
+    t = datetime(2030, 1, 7, 3, 0, tzinfo=timezone.utc)    # 08:30 IST
+    lat, lng = BASE_LAT, BASE_LNG
+    pings = []
+
+    def stay(minutes):
+        nonlocal t
+        for _ in range(int(minutes * 60 / ping_every_s)):
+            # ~5-10m GPS wander while parked
+            pings.append((lat + rng.gauss(0, 0.00005), lng + rng.gauss(0, 0.00005), t))
+            t += timedelta(seconds=ping_every_s)
+
+    def drive(minutes):
+        nonlocal t, lat, lng
+        heading = rng.uniform(0, 2 * math.pi)
+        for _ in range(int(minutes * 60 / ping_every_s)):
+            step = 0.003 * rng.uniform(0.5, 1.0)   # ~150-330m per ping
+            lat += step * math.cos(heading)
+            lng += step * math.sin(heading)
+            pings.append((lat, lng, t))
+            t += timedelta(seconds=ping_every_s)
+
+    stay(60)                                   # Loading at the godown
+    for i in range(n_stops):
+        drive(rng.uniform(4, 15))
+        stay(rng.uniform(3, 12))               # Waiting at a customer
+        if i == n_stops // 2:
+            stay(45)                           # Lunch
+        if i == n_stops // 3:
+            t += timedelta(minutes=75)         # Signal outage longer than the work-gap threshold
+    drive(20)
+    stay(30)                                   # Back at the godown
+    return pings
+
+
+def bench_ping_filter(batch_size=10):
+    """Stationary-ping merging on a synthetic day: storage saved and work-time parity with the legacy metric"""
+    import bson
+    from app.ping_filter import StationaryFilter, worked_seconds, WORK_GAP_SECONDS
+
+    raw = _synthetic_day()
+    driver_id = ObjectId()
+    raw_docs = [{"_id": ObjectId(), "driver_id": driver_id, "lat": la, "lng": ln, "address": "Near somewhere", "timestamp": ts} for la, ln, ts in raw]
+
+    # Legacy metric exactly as it was computed before merging existed
+    legacy = sum(
+        d for d in ((raw[i + 1][2] - raw[i][2]).total_seconds() for i in range(len(raw) - 1)) if d < WORK_GAP_SECONDS
+    )
+
+    stored, ping_filter = {}, StationaryFilter()
+    t0 = time.perf_counter()
+    for i in range(0, len(raw_docs), batch_size):
+        batch = [dict(d) for d in raw_docs[i:i + batch_size]]
+        kept, merges = ping_filter.apply(driver_id, batch)
+        for doc in kept:
+            stored[doc["_id"]] = doc
+        for log_id, (until, count) in merges.items():
+            stored[log_id]["dwell_until"] = max(stored[log_id]["dwell_until"], until)
+            stored[log_id]["dwell_count"] += count
+    elapsed = time.perf_counter() - t0
+
+    docs = sorted(stored.values(), key=lambda d: d["timestamp"])
+    raw_bytes = sum(len(bson.encode(d)) for d in raw_docs)
+    stored_bytes = sum(len(bson.encode(d)) for d in docs)
+    merged_s = worked_seconds(docs)
+
+    print(f"\n🅿️  STATIONARY PING FILTER: synthetic day, {len(raw)} pings")
+    print(f"  documents {len(raw_docs)} -> {len(docs)} ({100 * (1 - len(docs) / len(raw_docs)):.0f}% fewer)   bytes {raw_bytes / 1024:.0f} KB -> {stored_bytes / 1024:.0f} KB")
+    print(f"  work time legacy={legacy / 3600:.3f}h  raw via worked_seconds={worked_seconds(raw_docs) / 3600:.3f}h  merged={merged_s / 3600:.3f}h  parity={'✅' if abs(merged_s - legacy) < 1e-6 else '❌'}")
+    print(f"  filter cost {1e6 * elapsed / len(raw):.1f}µs per ping")
+
+
+def _legacy_complete_order(data, driver_id):
+    """The pre-optimisation /driver/complete-order write path: 8 sequential round trips, unprojected reads"""
+    from datetime import datetime, timezone
+    from app.database import shifts_collection, order_collection, customer_collection, driver_collection
+    o_id = ObjectId(data.order_id)
+    shift = shifts_collection.find_one({"driver_id": str(driver_id), "status": "OPEN"})
+    order = order_collection.find_one({"_id": o_id})
+    customer_collection.find_one({"_id": order["customer_id"]})
+    shifts_collection.update_one({"_id": shift["_id"]}, {"$inc": {"load_return.full": 1, "load_return.empty": data.empties_collected, "financials.expected_cash": data.amount_collected}})
+    driver_collection.update_one({"_id": driver_id}, {"$inc": {"current_stock": -1, "collected_cash": data.amount_collected}})
+    order_collection.update_one({"_id": o_id}, {"$set": {"status": "DELIVERED", "delivered_at": datetime.now(timezone.utc), "shift_id": str(shift["_id"])}})
+    customer_collection.update_one({"_id": order["customer_id"]}, {"$set": {"verified_lat": data.lat, "verified_lng": data.lng, "active_order_lock": False}})
+    customer_collection.update_one({"_id": order["customer_id"], "records.order_id": o_id}, {"$set": {"records.$.status": "DELIVERED"}})
+
+
+def bench_complete_order(n_orders=40, rtt_ms=100):
+    """/driver/complete-order latency on a simulated app-to-database RTT, legacy write path vs current"""
+    import asyncio
+    counter = _counting_client()
+    monitoring.register(LatencyInjector(rtt_ms))
+    from app.database import shifts_collection, order_collection, customer_collection, driver_collection
+    from app.schemas import CompleteOrderRequest
+    from driver import complete_order
+
+    driver_id = driver_collection.insert_one({"name": "Bench Driver", "is_active": True, "current_stock": n_orders}).inserted_id
+    shift_id = shifts_collection.insert_one({
+        "driver_id": str(driver_id), "status": "OPEN",
+        "load_departure": {"full": n_orders, "empty": 0}, "load_return": {"full": 0, "empty": 0},
+        "financials": {"expected_cash": 0.0, "actual_cash_collected": 0.0, "upi_total": 0.0}
+    }).inserted_id
+    order_ids = [ObjectId() for _ in range(n_orders)]
+    history = [{"date": "2024-01-01", "status": "DELIVERED", "qty": 1}] * 200
+    customer_ids = customer_collection.insert_many([
+        {"name": f"Bench {i}", "city": "BenchCity", "verified_lat": BASE_LAT, "verified_lng": BASE_LNG,
+         "records": history + [{"order_id": o_id, "status": "IN_PROGRESS"}]}
+        for i, o_id in enumerate(order_ids)
+    ]).inserted_ids
+    order_collection.insert_many([
+        {"_id": o_id, "customer_id": c_id, "assigned_driver_id": driver_id, "status": "IN_PROGRESS"}
+        for o_id, c_id in zip(order_ids, customer_ids)
+    ])
+    requests = [
+        CompleteOrderRequest(order_id=str(o_id), lat=BASE_LAT, lng=BASE_LNG, empties_collected=1, payment_mode="CASH", amount_collected=900)
+        for o_id in order_ids
+    ]
+    half = n_orders // 2
+
+    print(f"\n✅ COMPLETE ORDER: {half} deliveries per variant, {rtt_ms}ms simulated RTT to Mongo")
+    try:
+        for label, run, batch in (
+            ("legacy (8 round trips)", lambda r: _legacy_complete_order(r, driver_id), requests[:half]),
+            ("current", lambda r: asyncio.run(complete_order(r, driver_id)), requests[half:]),
+        ):
+            samples = []
+            counter.commands.clear()
+            for r in batch:
+                t0 = time.perf_counter()
+                run(r)
+                samples.append(time.perf_counter() - t0)
+            _report(label, samples)
+            print(f"  {'':<32} round trips/delivery={len(counter.commands) / len(batch):.1f}")
+    finally:
+        order_collection.delete_many({"_id": {"$in": order_ids}})
+        customer_collection.delete_many({"_id": {"$in": customer_ids}})
+        shifts_collection.delete_one({"_id": shift_id})
+        driver_collection.delete_one({"_id": driver_id})
+
+
+def bench_login_wave(n_logins=40, ping_interval_ms=20):
+    """Shift-start login wave over ASGI with GPS pings running alongside: bcrypt inline on the event loop vs the worker pool"""
+    import asyncio
+    import httpx
+    from app.database import driver_collection, driver_location_collection
+    from app.password_pool import password_pool
+    from app.utils import get_password_hash
+    from auth import create_access_token
+    from main import app
+
+    phone = f"9{random.randrange(10**9):09d}"
+    driver_id = driver_collection.insert_one({
+        "name": "Bench Driver", "phone_number": phone, "password_hash": get_password_hash("1234"), "is_active": True
+    }).inserted_id
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': str(driver_id), 'role': 'driver'})}"}
+
+    async def wave():
+        pings, logins = [], []
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            done = asyncio.Event()
+
+            async def ping_loop():
+                while not done.is_set():
+                    lat, lng = _jitter()
+                    t0 = time.perf_counter()
+                    await client.post("/driver/location", json={"lat": lat, "lng": lng}, headers=headers)
+                    pings.append(time.perf_counter() - t0)
+                    await asyncio.sleep(ping_interval_ms / 1000)
+
+            async def login():
+                t0 = time.perf_counter()
+                r = await client.post("/driver/login", json={"phone_number": phone, "password": "1234"})
+                logins.append(time.perf_counter() - t0)
+                return r.status_code
+
+            pinger = asyncio.create_task(ping_loop())
+            await asyncio.sleep(0.2)
+            t0 = time.perf_counter()
+            codes = await asyncio.gather(*[login() for _ in range(n_logins)])
+            elapsed = time.perf_counter() - t0
+            done.set()
+            await pinger
+        return pings, logins, elapsed, codes
+
+    async def inline(fn, *args):
+        return fn(*args)
+    pooled = password_pool._run
+
+    print(f"\n🔐 LOGIN WAVE: {n_logins} concurrent driver logins, GPS ping every {ping_interval_ms}ms")
+    try:
+        for label in ("inline (event loop)", f"pool ({password_pool.workers} workers)"):
+            password_pool._run = inline if label.startswith("inline") else pooled
+            pings, logins, elapsed, codes = asyncio.run(wave())
+            print(f"  {label}: {n_logins / elapsed:.1f} logins/s  ok={codes.count(200)}/{n_logins}")
+            _report("login latency", logins)
+            _report("ping latency during wave", pings)
+        m = password_pool.metrics()
+        print(f"  pool queue wait {m['queue_wait_ms']}  hash {m['hash_ms']}  rejected={m['rejected']}")
+    finally:
+        del password_pool._run
+        driver_location_collection.delete_many({"driver_id": driver_id})
+        driver_collection.delete_one({"_id": driver_id})
+
+
+def bench_prefetch(days=3, orders_per_day=60):
+    """Bytes to cache several days of worklist: one /driver/orders call per day vs one compact prefetch (raw and gzip)"""
+    import asyncio
+    import gzip
+    import json
+    from datetime import datetime, timedelta
+    from app.database import customer_collection, order_collection
+    from app.prefetch import build_prefetch, date_range
+    from driver import get_driver_worklist
+
+    admin_id, driver_id = ObjectId(), ObjectId()
+    dates = date_range((datetime.now() + timedelta(days=365)).strftime("%Y-%m-%d"), days)
+    # Regular customers order every few days, so the same customers recur across the range
+    n_customers = orders_per_day * days // 2
+    customers = []
+    for i in range(n_customers):
+        lat, lng = _jitter()
+        customers.append({
+            "admin_id": admin_id, "name": f"Bench {i}", "city": "BenchCity", "landmark": f"Near temple road gate {i}, 2nd cross",
+            "phone_number": f"90000{i:05d}", "verified_lat": lat, "verified_lng": lng
+        })
+    c_ids = customer_collection.insert_many(customers).inserted_ids
+    order_collection.insert_many([
+        {"admin_id": admin_id, "customer_id": c_ids[(d * orders_per_day + i) % n_customers], "assigned_driver_id": driver_id,
+         "status": "PENDING", "assigned_date": date, "customer_name": f"Bench {(d * orders_per_day + i) % n_customers}",
+         "city": "BenchCity", "assigned_driver_name": "Bench Driver", "created_at": datetime.utcnow(), "total_amount": 950.0}
+        for d, date in enumerate(dates) for i in range(orders_per_day)
+    ])
+
+    def sizes(payloads):
+        raw = [json.dumps(p, default=str).encode() for p in payloads]
+        return sum(len(b) for b in raw), sum(len(gzip.compress(b, compresslevel=6)) for b in raw)
+
+    print(f"\n📦 WORKLIST PREFETCH: {days} days x {orders_per_day} orders, {n_customers} customers")
+    try:
+        per_day = [asyncio.run(get_driver_worklist("", str(BASE_LAT), str(BASE_LNG), date, driver_id=driver_id)) for date in dates]
+        t0 = time.perf_counter()
+        compact = build_prefetch(driver_id, dates)
+        elapsed = time.perf_counter() - t0
+        raw, gz = sizes(per_day)
+        print(f"  {'per-day /driver/orders':<26} requests={days}  raw={raw / 1024:.1f} KB  gzip={gz / 1024:.1f} KB")
+        minified = json.dumps(compact, separators=(",", ":"), default=str).encode()
+        print(f"  {'prefetch (compact)':<26} requests=1  raw={len(minified) / 1024:.1f} KB  gzip={len(gzip.compress(minified, compresslevel=6)) / 1024:.1f} KB  built in {elapsed * 1000:.1f}ms")
+        print(f"  orders={len(compact['orders'])}  customers in side table={len(compact['customers'])}")
+    finally:
+        order_collection.delete_many({"admin_id": admin_id})
+        customer_collection.delete_many({"admin_id": admin_id})
+
+
+def bench_metrics_overhead(n_pings=2000):
+    """GPS ping latency over ASGI with and without the metrics middleware, and /metrics render time"""
+    import asyncio
+    import httpx
+    from app.database import driver_collection, driver_location_collection
+    from app.metrics import metrics, MetricsMiddleware
+    from auth import create_access_token
+    from main import app
+
+    driver_id = driver_collection.insert_one({"name": "Bench Driver", "is_active": True}).inserted_id
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': str(driver_id), 'role': 'driver'})}"}
+
+    async def pings():
+        samples = []
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            for _ in range(n_pings):
+                lat, lng = _jitter()
+                t0 = time.perf_counter()
+                await client.post("/driver/location", json={"lat": lat, "lng": lng}, headers=headers)
+                samples.append(time.perf_counter() - t0)
+        return samples
+
+    print(f"\n📈 METRICS OVERHEAD: {n_pings} GPS pings per run")
+    middleware = app.user_middleware[:]
+    try:
+        app.user_middleware = [m for m in middleware if m.cls is not MetricsMiddleware]
+        app.middleware_stack = app.build_middleware_stack()
+        _report("ping without metrics", asyncio.run(pings()))
+        app.user_middleware = middleware
+        app.middleware_stack = app.build_middleware_stack()
+        _report("ping with metrics", asyncio.run(pings()))
+        t0 = time.perf_counter()
+        body = metrics.render()
+        print(f"  /metrics render: {(time.perf_counter() - t0) * 1000:.2f}ms, {len(body) / 1024:.1f} KB")
+    finally:
+        app.user_middleware = middleware
+        app.middleware_stack = app.build_middleware_stack()
+        driver_location_collection.delete_many({"driver_id": driver_id})
+        driver_collection.delete_one({"_id": driver_id})
+
+
+SCENARIOS = {
+    "assignment": bench_assignment,
+    "bulk_order": bench_bulk_order_round_trips,
+    "consumer_ids": bench_consumer_ids,
+    "driver_worklist": bench_driver_worklist,
+    "routing": bench_routing,
+    "location_ingest": bench_location_ingest,
+    "ping_filter": bench_ping_filter,
+    "complete_order": bench_complete_order,
+    "login_wave": bench_login_wave,
+    "prefetch": bench_prefetch,
+    "metrics_overhead": bench_metrics_overhead,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in SCENARIOS:
+        sys.exit(f"usage: python benchmarks.py <scenario>\nscenarios: {', '.join(SCENARIOS)}")
+    SCENARIOS[sys.argv[1]]()
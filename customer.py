@@ -4,79 +4,42 @@ from fastapi.responses import RedirectResponse, JSONResponse
 from datetime import datetime
 from bson import ObjectId
 from typing import List
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
 
 # --- IMPORTS ---
 # Fix: Import auth from auth.py to avoid circular dependency with admin.py
 from auth import get_current_admin
 from app.database import (
     db, customer_collection, order_collection, 
-    cities_collection, driver_collection, counters_collection, shifts_collection
+    driver_collection, shifts_collection
 )
+from app.assignment import AssignmentEngine
+from app.consumer_ids import consumer_id_index, consumer_id_exists
+from app.sequences import sequence_allocator
+from app.cities import city_registry
+from app.order_sync import record_reassignments
 
 def get_next_sequence(name: str) -> int:
-    """Atomic sequence generator for custom IDs"""
-    result = counters_collection.find_one_and_update(
-        {"_id": name},
-        {"$inc": {"sequence_value": 1}},
-        return_document=True
-    )
-    return result["sequence_value"]
+    """Atomic sequence generator for custom IDs (served from per-process reserved blocks)"""
+    return sequence_allocator.next(name)
 
 customer_router = APIRouter()
 templates = Jinja2Templates(directory="templates")
 templates.env.add_extension('jinja2.ext.do')
 # --- HELPER FUNCTIONS ---
 
-def get_optimal_driver(admin_id: ObjectId, city: str):
+def get_optimal_driver(admin_id: ObjectId, city: str, lat=None, lng=None):
     """
     Finds the best driver for a specific city based on:
     1. Active Status
-    2. Assigned City
+    2. Owner of the city in the territory index
     3. Active Shift with Full Cylinders > 0
-    4. Lowest number of PENDING/IN_PROGRESS orders (Load Balancing)
+    4. Lowest number of PENDING/IN_PROGRESS orders (Load Balancing),
+       or a distance/load/stock score when the customer's lat/lng is known
+    Batch callers should use AssignmentEngine directly so state is loaded once.
     """
-    # 1. Find all active drivers for this admin in this city
-    drivers = list(driver_collection.find({
-        "admin_id": admin_id,
-        "is_active": True,
-        "assigned_cities": city
-    }))
-    
-    if not drivers:
-        return None
-        
-    # 2. Filter drivers: Must have an OPEN shift with current_full > 0
-    eligible_drivers = []
-    for d in drivers:
-        shift = shifts_collection.find_one({
-            "driver_id": str(d["_id"]),
-            "status": "OPEN"
-        })
-        if shift:
-            # Logic: Departure Full - Returned Full (consumption)
-            current_full = shift["load_departure"]["full"] - shift["load_return"]["full"]
-            if current_full > 0:
-                eligible_drivers.append(d)
-
-    if not eligible_drivers:
-        return None
-        
-    # 3. Find driver with least load among eligible ones
-    best_driver = None
-    min_load = float('inf')
-    
-    for driver in eligible_drivers:
-        # Count active orders for this driver
-        load = order_collection.count_documents({
-            "assigned_driver_id": driver["_id"],
-            "status": {"$in": ["PENDING", "IN_PROGRESS"]}
-        })
-        
-        if load < min_load:
-            min_load = load
-            best_driver = driver
-            
-    return best_driver
+    return AssignmentEngine.load(admin_id, [city]).assign(city, lat, lng)
 
 # --- ROUTES ---
 # customer.py
@@ -182,7 +145,7 @@ async def customer_management(
         elif filter_type == current_status_lower:
             processed_customers.append(c)
 
-    cities = list(cities_collection.find().sort("name", 1))
+    cities = city_registry.all()
     
     return templates.TemplateResponse("customers.html", {
         "request": request, 
@@ -197,11 +160,7 @@ async def customer_management(
 @customer_router.post("/add-city")
 async def add_city(city_name: str = Form(...)):
     try:
-        db["cities"].update_one(
-            {"name": city_name}, 
-            {"$set": {"name": city_name}}, 
-            upsert=True
-        )
+        city_registry.ensure(city_name)
         return RedirectResponse(url="/customers", status_code=303)
     except Exception as e:
         raise HTTPException(status_code=500, detail="Database error")
@@ -221,33 +180,34 @@ async def add_customer(
         return RedirectResponse(url="/", status_code=303)
 
     try:
-        # Check uniqueness
-        if customer_collection.find_one({"consumer_id": consumer_id}):
+        # Check uniqueness (in-process bitmap, DB only on a possible hit)
+        if consumer_id_exists(consumer_id):
             return RedirectResponse(url="/customers?error=Consumer ID already exists", status_code=303)
     except Exception as e:
         pass
 
-    city_name = city.strip()
-    db["cities"].update_one(
-        {"name": {"$regex": f"^{city_name}$", "$options": "i"}},
-        {"$set": {"name": city_name}},
-        upsert=True
-    )
+    city_name = city_registry.ensure(city)
 
-    customer_collection.insert_one({
-        "admin_id": admin_id,
-        "consumer_id": consumer_id, # EXPLICIT CONSUMER ID
-        "name": name,
-        "phone_number": phone, 
-        "city": city_name, 
-        "landmark": landmark,
-        "pincode": pincode,
-        "verified_lat": None, 
-        "verified_lng": None, 
-        "records": [],
-        "active_order_lock": False, # Lock for preventing Scenario C double orders
-        "created_at": datetime.utcnow()
-    })
+    try:
+        customer_collection.insert_one({
+            "admin_id": admin_id,
+            "consumer_id": consumer_id, # EXPLICIT CONSUMER ID
+            "name": name,
+            "phone_number": phone, 
+            "city": city_name, 
+            "landmark": landmark,
+            "pincode": pincode,
+            "verified_lat": None, 
+            "verified_lng": None, 
+            "records": [],
+            "active_order_lock": False, # Lock for preventing Scenario C double orders
+            "created_at": datetime.utcnow()
+        })
+    except DuplicateKeyError:
+        # Another worker took this ID after our bitmap refresh; the unique index caught it
+        consumer_id_index.add(consumer_id)
+        return RedirectResponse(url="/customers?error=Consumer ID already exists", status_code=303)
+    consumer_id_index.add(consumer_id)
     return RedirectResponse(url="/customers", status_code=303)
 
 # customer.py
@@ -259,8 +219,7 @@ async def validate_consumer_id(id: int = Query(...), admin_id: ObjectId = Depend
     if not admin_id:
         return JSONResponse({"valid": False, "error": "Unauthorized"}, status_code=401)
     
-    exists = customer_collection.find_one({"consumer_id": id})
-    if exists:
+    if consumer_id_exists(id):
         return JSONResponse({"valid": False, "error": "Consumer ID already exists."})
     return JSONResponse({"valid": True})
 
@@ -302,8 +261,8 @@ async def create_order(
     target_city = cust["city"].strip()
 
     if driver_id == "auto":
-        # Load Balancing: Find active driver in this city with the fewest pending tasks
-        assigned_driver = get_optimal_driver(admin_id, target_city)
+        # Proximity + Load Balancing: nearest eligible driver, weighted by pending tasks and stock
+        assigned_driver = get_optimal_driver(admin_id, target_city, cust.get("verified_lat"), cust.get("verified_lng"))
         if assigned_driver:
             final_driver_id = assigned_driver["_id"]
             final_driver_name = assigned_driver["name"]
@@ -324,6 +283,7 @@ async def create_order(
         "assigned_driver_name": final_driver_name,
         "created_at": datetime.utcnow()
     }
+    order_data["updated_at"] = order_data["created_at"]
     
     result = order_collection.insert_one(order_data)
     
@@ -350,54 +310,67 @@ async def bulk_order(
     if not admin_id:
         return JSONResponse(status_code=401, content={"success": False, "message": "Unauthorized"})
 
-    count = 0
-    for cid in customer_ids:
-        # Verify customer belongs to this admin
-        cust = customer_collection.find_one({"_id": ObjectId(cid), "admin_id": admin_id})
-        if not cust: 
-            continue
-
-        # Prevent duplicate active orders atomically (Scenario C Defense)
-        cust = customer_collection.find_one_and_update(
-            {"_id": ObjectId(cid), "admin_id": admin_id, "active_order_lock": {"$ne": True}},
-            {"$set": {"active_order_lock": True}},
-            return_document=True
-        )
-        if not cust:
-            continue
-
-        # AUTO ASSIGNMENT LOGIC
-        assigned_driver = get_optimal_driver(admin_id, cust["city"])
-        driver_id = assigned_driver["_id"] if assigned_driver else None
-        driver_name = assigned_driver["name"] if assigned_driver else "Unassigned"
+    requested = list(dict.fromkeys(ObjectId(cid) for cid in customer_ids))
+    batch_token = ObjectId()
 
-        order_data = {
-            "admin_id": admin_id,
-            "customer_id": cust["_id"],
-            "customer_name": cust["name"],
-            "city": cust["city"],
-            "status": "PENDING",
-            "assigned_driver_id": driver_id,
-            "assigned_driver_name": driver_name,
-            "created_at": datetime.utcnow()
-        }
-        res = order_collection.insert_one(order_data)
-        
-        # Sync update to customer's history records
-        customer_collection.update_one(
-            {"_id": cust["_id"]},
-            {"$push": {"records": {
-                "order_id": res.inserted_id,
-                "date": datetime.utcnow(),
-                "status": "PENDING",
-                "driver_name": driver_name
-            }}}
+    # 1. Ownership check + lock for the whole id set in one update (Scenario C Defense).
+    #    lock_batch tags the rows this request locked so they can be told apart afterwards.
+    customer_collection.update_many(
+        {"_id": {"$in": requested}, "admin_id": admin_id, "active_order_lock": {"$ne": True}},
+        {"$set": {"active_order_lock": True, "lock_batch": batch_token}}
+    )
+    owned = {
+        c["_id"]: c for c in customer_collection.find(
+            {"_id": {"$in": requested}, "admin_id": admin_id},
+            {"name": 1, "city": 1, "verified_lat": 1, "verified_lng": 1, "lock_batch": 1}
         )
-        count += 1
+    }
+    locked_customers = [owned[cid] for cid in requested if cid in owned and owned[cid].get("lock_batch") == batch_token]
+    skipped_locked = [str(cid) for cid in requested if cid in owned and owned[cid].get("lock_batch") != batch_token]
+    not_found = [str(cid) for cid in requested if cid not in owned]
+
+    orders = []
+    if locked_customers:
+        # 2. AUTO ASSIGNMENT LOGIC: load driver/shift/load state once for every city in the batch
+        engine = AssignmentEngine.load(admin_id, [c["city"] for c in locked_customers])
+        now = datetime.utcnow()
+        for cust in locked_customers:
+            assigned_driver = engine.assign(cust["city"], cust.get("verified_lat"), cust.get("verified_lng"))
+            orders.append({
+                "admin_id": admin_id,
+                "customer_id": cust["_id"],
+                "customer_name": cust["name"],
+                "city": cust["city"],
+                "status": "PENDING",
+                "assigned_driver_id": assigned_driver["_id"] if assigned_driver else None,
+                "assigned_driver_name": assigned_driver["name"] if assigned_driver else "Unassigned",
+                "created_at": now,
+                "updated_at": now
+            })
+
+        # 3. One insert for all orders, one bulk write for every customer's history
+        res = order_collection.insert_many(orders)
+        customer_collection.bulk_write([
+            UpdateOne(
+                {"_id": order["customer_id"]},
+                {
+                    "$push": {"records": {
+                        "order_id": order_id,
+                        "date": now,
+                        "status": "PENDING",
+                        "driver_name": order["assigned_driver_name"]
+                    }},
+                    "$unset": {"lock_batch": ""}
+                }
+            ) for order, order_id in zip(orders, res.inserted_ids)
+        ], ordered=False)
 
     return JSONResponse(content={
         "success": True, 
-        "message": f"Successfully created {count} orders with auto-assignment."
+        "message": f"Successfully created {len(orders)} orders with auto-assignment.",
+        "created_count": len(orders),
+        "skipped_locked": skipped_locked,
+        "not_found": not_found
     })
 @customer_router.post("/customers/reassign-driver")
 async def reassign_driver(
@@ -417,11 +390,14 @@ async def reassign_driver(
         return JSONResponse(status_code=404, content={"success": False, "message": "Driver not found"})
 
     # Update Order
+    now = datetime.utcnow()
+    record_reassignments([order], driver["_id"], now)
     order_collection.update_one(
         {"_id": ObjectId(order_id)},
         {"$set": {
             "assigned_driver_id": driver["_id"],
-            "assigned_driver_name": driver["name"]
+            "assigned_driver_name": driver["name"],
+            "updated_at": now
         }}
     )
     
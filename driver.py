@@ -1,9 +1,10 @@
 # driver.py
-from fastapi import APIRouter, Depends, HTTPException, Body, Query
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request
 from datetime import datetime, timedelta, timezone
 from jose import jwt
 from bson import ObjectId
 import math
+import numpy as np
 
 # Internal Imports
 from auth import get_current_driver, SECRET_KEY, ALGORITHM
@@ -11,11 +12,24 @@ from app.database import (
     driver_collection, order_collection, customer_collection,
     driver_audit_collection, driver_location_collection, change_requests_collection, shifts_collection
 )
-from app.utils import verify_password
-from app.schemas import DriverLogin, AcceptOrderRequest, CompleteOrderRequest, LocationPing, ChangeRequestPayload
+from app.password_pool import password_pool
+from app.geo import haversine_km, to_coord
+from app.routing import route_planner
+from app.geocoding import geocoding_service, geohash, PENDING_ADDRESS
+from app.location_buffer import location_buffer, BufferFull
+from app.ping_filter import stationary_filter
+from app.offline_sync import apply_offline_batch
+from app.order_sync import make_sync_token, parse_sync_token, removed_since
+from app.prefetch import build_prefetch, compact_json_response, date_range, PREFETCH_MAX_DAYS
+from app.inventory_ledger import record_movements, delivery_movements
+from app.shifts import open_shifts
+from app.utils import ist_now
+from app.schemas import DriverLogin, AcceptOrderRequest, CompleteOrderRequest, LocationPing, LocationBatch, OfflineSyncRequest, ChangeRequestPayload
 
 driver_router = APIRouter()
 
+WORKLIST_CUSTOMER_FIELDS = {"landmark": 1, "phone_number": 1, "city": 1, "verified_lat": 1, "verified_lng": 1}
+
 # --- 🛠️ SENIOR UTILS ---
 
 def stringify_doc(doc):
@@ -46,6 +60,14 @@ def calculate_distance(lat1, lon1, lat2, lon2):
         return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
     except: return 999.0
 
+def calculate_distances(lat, lng, lats, lngs):
+    """Vectorised calculate_distance from one point to many (999.0 where a coordinate is missing)"""
+    def coords(values):
+        return np.array([to_coord(v) if v else np.nan for v in values], dtype=float)
+    origin_lat, origin_lng = (to_coord(lat) if lat else np.nan), (to_coord(lng) if lng else np.nan)
+    dist = haversine_km(origin_lat, origin_lng, coords(lats), coords(lngs))
+    return np.where(np.isnan(dist), 999.0, dist)
+
 # --- 🚀 ROUTES ---
 
 @driver_router.post("/driver/login")
@@ -54,7 +76,7 @@ async def driver_login(data: DriverLogin = Body(...)):
     password = data.password
     driver = driver_collection.find_one({"phone_number": phone})
     
-    if not driver or not verify_password(password, driver.get("password_hash")):
+    if not driver or not await password_pool.verify(password, driver.get("password_hash")):
         raise HTTPException(
             status_code=401, 
             detail="Invalid Credentials: Check your phone number or PIN."
@@ -75,9 +97,10 @@ async def driver_login(data: DriverLogin = Body(...)):
 async def accept_order(data: dict = Body(...), driver_id: ObjectId = Depends(get_current_driver)):
     """Moves order from PENDING to IN_PROGRESS"""
     o_id = ObjectId(data.get("order_id"))
+    now = datetime.now(timezone.utc)
     order_collection.update_one(
         {"_id": o_id, "assigned_driver_id": driver_id},
-        {"$set": {"status": "IN_PROGRESS", "started_at": datetime.now(timezone.utc)}}
+        {"$set": {"status": "IN_PROGRESS", "started_at": now, "updated_at": now}}
     )
     return {"success": True}
 
@@ -85,13 +108,17 @@ async def accept_order(data: dict = Body(...), driver_id: ObjectId = Depends(get
 async def get_driver_worklist(
     cities: str = Query(""), lat: str = "0.0", lng: str = "0.0", 
     date: str = Query(None), 
+    sync_token: str = Query(None),
     driver_id: ObjectId = Depends(get_current_driver)
 ):
-    """Fetches ALL assigned orders for a specific date to maintain a persistent checklist"""
+    """
+    Fetches ALL assigned orders for a specific date to maintain a persistent checklist.
+    With the sync_token of an earlier response for the same date, only orders changed
+    since then are sent in full, plus the ids to drop and the current sequence.
+    """
     try:
-        # 🟢 TERMINAL DEBUG 1: Request Details
-        print(f"\n--- 🛰️  CHECKLIST REQUEST ---")
-        print(f"Driver: {driver_id} | Date Filter: {date}")
+        started_at = datetime.now(timezone.utc)
+        since = parse_sync_token(sync_token) if sync_token else None
 
         # 1. Build the Base Query: Orders assigned to THIS driver
         query = {
@@ -124,40 +151,89 @@ async def get_driver_worklist(
         # Sorting priority: IN_PROGRESS -> PENDING -> DELIVERED
         orders_cursor = order_collection.find(query)
         raw_orders = list(orders_cursor)
+        changed = {
+            str(o["_id"]) for o in raw_orders
+            if since and o.get("updated_at") and o["updated_at"].replace(tzinfo=timezone.utc) > since
+        }
 
-        # 🟢 TERMINAL DEBUG 2: MongoDB Findings
-        print(f"📦 DATABASE RESULT: Found {len(raw_orders)} total orders for checklist.")
+        # Linked customer details for the UI: one $in query, only the fields the checklist shows
+        customers = {
+            c["_id"]: c
+            for c in customer_collection.find(
+                {"_id": {"$in": list({ObjectId(o["customer_id"]) for o in raw_orders})}},
+                WORKLIST_CUSTOMER_FIELDS
+            )
+        }
 
         processed = []
         for o in raw_orders:
-            o = stringify_doc(o) # Recursive ObjectId to String conversion
-            
-            # Fetch linked customer details for the UI
-            cust = customer_collection.find_one({"_id": ObjectId(o["customer_id"])})
+            cust = customers.get(ObjectId(o["customer_id"]))
             if cust:
+                o = stringify_doc(o) # Recursive ObjectId to String conversion
                 o["address"] = cust.get("landmark", "No Address")
                 o["phone"] = cust.get("phone_number")
                 o["city"] = cust.get("city", "Unknown")
                 o["verified_lat"] = cust.get("verified_lat")
                 o["verified_lng"] = cust.get("verified_lng")
-                # Calculate real-time distance for sorting
-                o["distance"] = calculate_distance(lat, lng, o["verified_lat"], o["verified_lng"])
                 processed.append(o)
 
-        # 4. Final Business Logic Sort
-        # Keeps Active (Blue) at the top, then Pending (Orange), then Delivered (Green)
+        # Real-time distance for sorting, in one vectorised pass
+        distances = calculate_distances(lat, lng, [o["verified_lat"] for o in processed], [o["verified_lng"] for o in processed])
+        for o, distance in zip(processed, distances.tolist()):
+            o["distance"] = distance
+
+        # 4. Route order for the stops still to visit (cached per driver and day, repaired as stops change)
+        active = [o for o in processed if o["status"] in ("PENDING", "IN_PROGRESS")]
+        start = (lat, lng) if to_coord(lat) or to_coord(lng) else None
+        route = route_planner.route(
+            driver_id, date or datetime.now(timezone.utc).strftime("%Y-%m-%d"), start,
+            [(o["_id"], o["verified_lat"], o["verified_lng"]) for o in active]
+        )
+        route_position = {order_id: i for i, order_id in enumerate(route)}
+        for o in active:
+            o["route_position"] = route_position[o["_id"]]
+
+        # 5. Final Business Logic Sort
+        # Keeps Active (Blue) at the top, then Pending (Orange) in route order, then Delivered (Green) by distance
         status_priority = {"IN_PROGRESS": 0, "PENDING": 1, "DELIVERED": 2}
-        processed.sort(key=lambda x: (status_priority.get(x["status"], 3), x["distance"]))
+        processed.sort(key=lambda x: (status_priority.get(x["status"], 3), x.get("route_position", 0), x["distance"]))
 
-        print(f"✅ SUCCESS: Returning {len(processed)} checklist items.")
-        print(f"--- 🛰️  END REQUEST ---\n")
-        
-        return {"success": True, "orders": processed}
+        if since is None:
+            return {"success": True, "full": True, "sync_token": make_sync_token(started_at), "orders": processed}
+
+        # 6. Delta: full documents only for orders written since the token
+        removed = removed_since(driver_id, since, [ObjectId(o["_id"]) for o in processed])
+        return {
+            "success": True,
+            "full": False,
+            "sync_token": make_sync_token(started_at),
+            "orders": [o for o in processed if o["_id"] in changed],
+            "removed": [str(o_id) for o_id in removed],
+            "sequence": [{"_id": o["_id"], "distance": o["distance"], "route_position": o.get("route_position")} for o in processed]
+        }
     
     except Exception as e:
         print(f"❌ CRITICAL CHECKLIST ERROR: {e}")
         raise HTTPException(status_code=500, detail="Internal Checklist Error")
     
+@driver_router.get("/driver/orders/prefetch")
+async def prefetch_worklist(
+    request: Request,
+    start: str = Query(None),
+    days: int = Query(2, ge=1, le=PREFETCH_MAX_DAYS),
+    driver_id: ObjectId = Depends(get_current_driver)
+):
+    """Several days of worklist in one compact response, so the app can cache tomorrow's stops before leaving coverage"""
+    try:
+        dates = date_range(start or ist_now().strftime("%Y-%m-%d"), days)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start must be YYYY-MM-DD")
+    try:
+        return compact_json_response(request, build_prefetch(driver_id, dates))
+    except Exception as e:
+        print(f"❌ PREFETCH ERROR: {e}")
+        raise HTTPException(status_code=500, detail="Internal Checklist Error")
+
 # --- 🚀 LIFECYCLE & TRACKING ROUTES ---
 
 @driver_router.post("/driver/accept-order")
@@ -170,11 +246,13 @@ async def accept_order(data: AcceptOrderRequest = Body(...), driver_id: ObjectId
         print(f"🚛 DRIVER STARTING JOB: {o_id}")
 
         # 1. Update the Order status and set 'started_at' timestamp
+        now = datetime.now(timezone.utc)
         result = order_collection.update_one(
             {"_id": o_id, "assigned_driver_id": driver_id},
             {"$set": {
                 "status": "IN_PROGRESS", 
-                "started_at": datetime.now(timezone.utc)
+                "started_at": now,
+                "updated_at": now
             }}
         )
 
@@ -196,59 +274,82 @@ async def accept_order(data: AcceptOrderRequest = Body(...), driver_id: ObjectId
         return {"success": False, "message": str(e)}
 
 
-# --- ADD THESE IMPORTS TO THE TOP OF driver.py ---
-# --- ADD THESE IMPORTS TO THE TOP OF driver.py ---
-from geopy.geocoders import Nominatim
-from geopy.exc import GeopyError
-
-# Initialize the Python Geocoder (User agent is required)
-geolocator = Nominatim(user_agent="gas_flow_enterprise_system")
-
 @driver_router.post("/driver/location")
 async def update_driver_location(data: LocationPing = Body(...), driver_id: ObjectId = Depends(get_current_driver)):
     """
-    Receives GPS from phone, uses Python to resolve the street address,
-    and updates the driver's master record.
+    Receives GPS from phone and updates the driver's master record.
+    The street address comes from the geohash cache, or is filled in
+    by the background geocoder once resolved.
     """
     try:
-        lat = data.lat
-        lng = data.lng
-        now = datetime.now(timezone.utc)
-        
-        # 🛰️ PYTHON REVERSE GEOCODING
-        resolved_address = "Address Pending..."
-        try:
-            # Resolves Lat/Lng to a real street name using Python
-            location = geolocator.reverse(f"{lat}, {lng}", timeout=3)
-            if location:
-                resolved_address = location.address
-        except (GeopyError, ValueError):
-            resolved_address = "Satellite Link Active (Address Busy)"
-
-        # 1. Update Driver Collection with the NEW Address field
-        driver_collection.update_one(
-            {"_id": driver_id},
-            {"$set": {
-                "current_lat": lat, 
-                "current_lng": lng, 
-                "current_address": resolved_address, # 🚀 This fixes the display issue
-                "last_seen": now
-            }}
-        )
-        
-        # 2. Log entry for historical pathing
-        driver_location_collection.insert_one({
+        address = await queue_location_points(driver_id, [(data.lat, data.lng, None)])
+        return {"success": True, "address": address}
+    except BufferFull:
+        raise HTTPException(status_code=503, detail="Location ingest busy, retry shortly", headers={"Retry-After": "5"})
+    except Exception as e:
+        print(f"🛰️ GPS BACKEND ERROR: {e}")
+        return {"success": False}
+
+@driver_router.post("/driver/locations/batch")
+async def ingest_location_batch(data: LocationBatch = Body(...), driver_id: ObjectId = Depends(get_current_driver)):
+    """
+    Buffered GPS points from the phone in one request: one log document per
+    point and one update for the driver's latest position.
+    """
+    try:
+        address = await queue_location_points(driver_id, [(p.lat, p.lng, p.t) for p in data.points])
+        return {"success": True, "accepted": len(data.points), "address": address}
+    except BufferFull:
+        raise HTTPException(status_code=503, detail="Location ingest busy, retry shortly", headers={"Retry-After": "5"})
+    except Exception as e:
+        # Not a 200: the phone keeps the points buffered and sends them again
+        print(f"🛰️ GPS BATCH ERROR: {e}")
+        raise HTTPException(status_code=500, detail="Failed to store location batch")
+
+async def queue_location_points(driver_id: ObjectId, points):
+    """
+    Builds path-log documents for [(lat, lng, unix_ts or None)] and hands them,
+    with the driver's newest position, to the write-behind buffer.
+    Returns the newest point's address (cached, or the pending placeholder).
+    """
+    now = datetime.now(timezone.utc)
+    points = sorted(points, key=lambda p: p[2] if p[2] is not None else now.timestamp())
+
+    logs = []
+    for lat, lng, t in points:
+        cached = geocoding_service.cache.peek(geohash(lat, lng))
+        logs.append({
+            "_id": ObjectId(),
             "driver_id": driver_id,
             "lat": lat,
             "lng": lng,
-            "address": resolved_address,
-            "timestamp": now
+            "address": cached or PENDING_ADDRESS,
+            # Clamp phone clocks that run ahead of the server
+            "timestamp": min(datetime.fromtimestamp(t, timezone.utc), now) if t is not None else now
         })
-        
-        return {"success": True, "address": resolved_address}
-    except Exception as e:
-        print(f"🛰️ GPS BACKEND ERROR: {e}")
-        return {"success": False}
+    latest = logs[-1]
+
+    # Pings from a driver who has not moved extend the stored point's dwell instead of adding a new one
+    kept, merges, tail = stationary_filter.plan(driver_id, logs)
+
+    unresolved = {}
+    for log in kept:
+        if log["address"] == PENDING_ADDRESS:
+            unresolved.setdefault(geohash(log["lat"], log["lng"]), (log["lat"], log["lng"], driver_id, []))[3].append(log["_id"])
+
+    position = {
+        "current_lat": latest["lat"],
+        "current_lng": latest["lng"],
+        "current_geohash": geohash(latest["lat"], latest["lng"]),
+        "last_seen": latest["timestamp"]
+    }
+    if latest["address"] != PENDING_ADDRESS:
+        position["current_address"] = latest["address"]
+
+    await location_buffer.enqueue(driver_id, kept, position, list(unresolved.values()), merges)
+    # Only now: a rejected batch (BufferFull) must not leave later pings merging into a log that was never written
+    stationary_filter.commit(driver_id, tail, len(logs), len(kept))
+    return latest["address"]
 
 @driver_router.post("/driver/location-ping")
 async def simple_location_ping(data: LocationPing = Body(...)):
@@ -274,30 +375,30 @@ async def simple_location_ping(data: LocationPing = Body(...)):
         raise HTTPException(status_code=400, detail=str(e))
 
 @driver_router.post("/driver/sync-offline")
-async def sync_offline_data(data: dict = Body(...)):
-    """Receives buffered actions from the Flutter Hive sync_queue"""
+async def sync_offline_data(data: OfflineSyncRequest = Body(...), driver_id: ObjectId = Depends(get_current_driver)):
+    """
+    Replays actions buffered in the Flutter Hive queue while the phone was offline.
+    Every action carries an idempotency key, so resending a batch after a dropped
+    response never delivers (or charges) an order twice. The phone keeps only the
+    actions whose result says retry.
+    """
     try:
-        actions = data.get("offline_actions", [])
-        device_id = data.get("device_id")
-        
-        print(f"🔄 RECEIVED BATCH SYNC: {len(actions)} actions from {device_id}")
-        
-        success_count = 0
-        for action in actions:
-            # Here we would safely map 'action_type' to internal functions
-            # e.g., if action["action_type"] == "COMPLETE_ORDER": complete_order(...)
-            print(f"  -> Processing: {action['action_type']} | Order: {action.get('payload', {}).get('order_id')}")
-            success_count += 1
-            
-        return {
-            "success": True, 
-            "synced_count": success_count,
-            "message": "Offline data synchronized with main ledger."
-        }
+        print(f"🔄 RECEIVED BATCH SYNC: {len(data.offline_actions)} actions from {data.device_id}")
+        results = apply_offline_batch(driver_id, data.offline_actions)
     except Exception as e:
         print(f"❌ SYNC ERROR: {e}")
         raise HTTPException(status_code=500, detail="Failed to process offline batch")
 
+    synced = sum(1 for r in results if r["status"] == "applied")
+    pending = sum(1 for r in results if r["retry"])
+    return {
+        "success": True,
+        "synced_count": synced,
+        "pending_count": pending,
+        "results": results,
+        "message": "Offline data synchronized with main ledger." if not pending else f"{pending} actions could not be applied yet."
+    }
+
 @driver_router.post("/driver/change-request")
 async def driver_change_request(data: ChangeRequestPayload = Body(...), driver_id: ObjectId = Depends(get_current_driver)):
     driver = driver_collection.find_one({"_id": driver_id})
@@ -312,7 +413,7 @@ async def driver_change_request(data: ChangeRequestPayload = Body(...), driver_i
             # Mark the specific order as PENDING_APPROVAL
             order_collection.update_one(
                 {"_id": ObjectId(data.order_id)},
-                {"$set": {"status": "PENDING_APPROVAL"}}
+                {"$set": {"status": "PENDING_APPROVAL", "updated_at": datetime.now(timezone.utc)}}
             )
             customer_collection.update_one(
                 {"_id": ObjectId(data.customer_id), "records.order_id": ObjectId(data.order_id)},
@@ -377,26 +478,42 @@ async def complete_order(data: CompleteOrderRequest = Body(...), driver_id: Obje
         
         print(f"--- ✅ COMPLETING ORDER ---")
         print(f"Order ID: {o_id}")
-        
-        # 1. Fetch Active Shift
-        shift = shifts_collection.find_one({"driver_id": str(driver_id), "status": "OPEN"})
-        if not shift:
+
+        # 1. Active shift, from the open-shift map
+        shift_id = open_shifts.get(str(driver_id)) or open_shifts.refresh(str(driver_id))
+        if not shift_id:
             raise HTTPException(status_code=403, detail="No active shift found. Please ask Admin to start your shift.")
 
-        # 2. Check Inventory
-        current_full = shift["load_departure"]["full"] - shift["load_return"]["full"]
-        if current_full <= 0:
+        # 2. Order, customer pin and the shift's stock in one round trip, only the fields we use
+        order = next(order_collection.aggregate([
+            {"$match": {"_id": o_id}},
+            {"$lookup": {"from": customer_collection.name, "localField": "customer_id", "foreignField": "_id", "as": "customer"}},
+            {"$addFields": {"open_shift_id": {"$literal": shift_id}}},
+            {"$lookup": {"from": shifts_collection.name, "localField": "open_shift_id", "foreignField": "_id", "as": "shift"}},
+            {"$project": {
+                "customer_id": 1, "customer.verified_lat": 1, "customer.verified_lng": 1,
+                "shift.status": 1, "shift.load_departure.full": 1, "shift.load_return.full": 1
+            }}
+        ]), None)
+        shift = order["shift"][0] if order and order["shift"] else None
+        if not shift or shift.get("status") != "OPEN":
+            # Failure path only: no such order, or the cached shift was closed on another server
+            shift_id = open_shifts.refresh(str(driver_id))
+            shift = shifts_collection.find_one({"_id": shift_id, "status": "OPEN"}, {"load_departure.full": 1, "load_return.full": 1}) if shift_id else None
+            if not shift:
+                raise HTTPException(status_code=403, detail="No active shift found. Please ask Admin to start your shift.")
+
+        # 3. Check Inventory
+        if shift["load_departure"]["full"] - shift["load_return"]["full"] <= 0:
             raise HTTPException(status_code=400, detail="Insufficient Stock on Truck.")
 
-        order = order_collection.find_one({"_id": o_id})
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
 
-        # 3. Distance Check & Flagging (The Gold Standard)
+        # 4. Distance Check & Flagging (The Gold Standard)
         is_flagged = False
-        requires_change_request = False
-        customer = customer_collection.find_one({"_id": order["customer_id"]})
-        
+        customer = order["customer"][0] if order["customer"] else None
+
         if customer and customer.get("verified_lat") and customer.get("verified_lng"):
             distance = calculate_distance(lat, lng, customer["verified_lat"], customer["verified_lng"])
             if distance > 0.15: # 150m threshold
@@ -411,7 +528,8 @@ async def complete_order(data: CompleteOrderRequest = Body(...), driver_id: Obje
                 is_flagged = True
                 print(f"⚠️ Flagged: Driver is {distance*1000:.0f}m away (within 150m limit).")
 
-        # 4. Atomic Shift Update (Cylinders & Cash)
+        # 5. Atomic Shift Update (Cylinders & Cash). The stock check is repeated in the filter,
+        #    so two deliveries racing for the last cylinder cannot both succeed.
         update_fields = {
             "$inc": {
                 "load_return.full": 1, # Incrementing returned full cylinders actually means we consumed one from the departing load
@@ -425,7 +543,29 @@ async def complete_order(data: CompleteOrderRequest = Body(...), driver_id: Obje
         elif data.payment_mode == "UPI":
             update_fields["$inc"]["financials.upi_total"] = float(data.amount_collected)
 
-        shifts_collection.update_one({"_id": shift["_id"]}, update_fields)
+        def take_stock(shift_id):
+            return shifts_collection.find_one_and_update(
+                {
+                    "_id": shift_id, "status": "OPEN",
+                    "$expr": {"$gt": [{"$subtract": ["$load_departure.full", "$load_return.full"]}, 0]}
+                },
+                update_fields,
+                projection={"_id": 1, "admin_id": 1}
+            )
+
+        shift = take_stock(shift_id)
+        if not shift:
+            # Failure path only: the shift closed or ran dry since step 1. Then tell
+            # "no shift" apart from "no stock".
+            current_id = open_shifts.refresh(str(driver_id))
+            if not current_id:
+                raise HTTPException(status_code=403, detail="No active shift found. Please ask Admin to start your shift.")
+            if current_id != shift_id:
+                shift = take_stock(current_id)
+            if not shift:
+                raise HTTPException(status_code=400, detail="Insufficient Stock on Truck.")
+
+        record_movements(delivery_movements(shift, driver_id, o_id, data.payment_mode, data.amount_collected, data.empties_collected))
 
         # 6. Legacy Driver Stats Update (Optional but kept for compatibility)
         driver_collection.update_one(
@@ -437,9 +577,11 @@ async def complete_order(data: CompleteOrderRequest = Body(...), driver_id: Obje
         )
 
         # 7. Update Order Collection
+        now = datetime.now(timezone.utc)
         order_collection.update_one({"_id": o_id}, {"$set": {
             "status": "DELIVERED", 
-            "delivered_at": datetime.now(timezone.utc),
+            "delivered_at": now,
+            "updated_at": now,
             "verified_lat": lat,
             "verified_lng": lng,
             "payment_status": "PAID" if data.payment_mode == "UPI" else "CASH_COLLECTED",
@@ -452,21 +594,22 @@ async def complete_order(data: CompleteOrderRequest = Body(...), driver_id: Obje
             "amount_paid": float(data.amount_collected)
         }})
 
-        # 8. Sync Customer Record status
-        customer_collection.update_one(
-            {"_id": order["customer_id"]}, 
-            {"$set": {
-                "verified_lat": lat, 
-                "verified_lng": lng,
-                "active_order_lock": False,
-                "last_order_date": datetime.now(timezone.utc)
-            }}
-        )
-
-        customer_collection.update_one(
-            {"_id": order["customer_id"], "records.order_id": o_id},
-            {"$set": {"records.$.status": "DELIVERED"}}
+        # 8. Sync Customer pin and record status in one update. The array filter leaves
+        #    customers without a matching record entry untouched apart from the pin.
+        customer_pin = {
+            "verified_lat": lat, 
+            "verified_lng": lng,
+            "active_order_lock": False,
+            "last_order_date": datetime.now(timezone.utc)
+        }
+        result = customer_collection.update_one(
+            {"_id": order["customer_id"], "records": {"$exists": True}},
+            {"$set": {**customer_pin, "records.$[rec].status": "DELIVERED"}},
+            array_filters=[{"rec.order_id": o_id}]
         )
+        if not result.matched_count:
+            # Legacy customers without a records array: an array filter there is a write error
+            customer_collection.update_one({"_id": order["customer_id"]}, {"$set": customer_pin})
 
         print(f"✅ SUCCESS: Shift {shift['_id']} updated.")
         return {"success": True, "is_flagged": is_flagged, "message": f"Success: ₹{data.amount_collected} recorded."}
@@ -481,7 +624,7 @@ async def complete_order(data: CompleteOrderRequest = Body(...), driver_id: Obje
 async def get_shift_status(driver_id: ObjectId = Depends(get_current_driver)):
     """Fetches real-time inventory and financial status for the active shift"""
     try:
-        shift = shifts_collection.find_one({"driver_id": str(driver_id), "status": "OPEN"})
+        shift = open_shifts.find(str(driver_id))
         if not shift:
             return {"active": False, "message": "No active shift found"}
         
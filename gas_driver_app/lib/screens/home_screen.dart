@@ -43,15 +43,17 @@ class _HomeScreenState extends State<HomeScreen> {
   @override
   void dispose() {
     _locationTimer?.cancel();
+    ApiService().flushLocations(widget.token);
     super.dispose();
   }
 
-  // 🛰️ Periodic GPS Heartbeat
+  // 🛰️ Periodic GPS Heartbeat: sampled every 30s, uploaded in batches by ApiService
   void _startLocationPulse() {
-    _locationTimer = Timer.periodic(const Duration(minutes: 5), (timer) async {
-      if (currentPos != null) {
+    _locationTimer = Timer.periodic(const Duration(seconds: 30), (timer) async {
+      final pos = await Geolocator.getLastKnownPosition() ?? currentPos;
+      if (pos != null) {
         await ApiService().sendLocationPing(
-          widget.token, currentPos!.latitude, currentPos!.longitude
+          widget.token, pos.latitude, pos.longitude
         );
       }
     });
@@ -60,7 +62,9 @@ class _HomeScreenState extends State<HomeScreen> {
   Future<void> _initDashboard() async {
     LocationPermission p = await Geolocator.checkPermission();
     if (p == LocationPermission.denied) await Geolocator.requestPermission();
-    _refreshData();
+    await _refreshData();
+    // Cache today's and tomorrow's stops while we still have signal
+    ApiService().prefetchOrders(widget.token);
   }
 
   // 🔄 REFRESH ENGINE: Now handles Background Sync + Offline Caching
@@ -1,5 +1,6 @@
 import 'dart:convert';
 import 'dart:io';
+import 'dart:math';
 import 'package:http/http.dart' as http;
 import 'package:shared_preferences/shared_preferences.dart';
 import 'package:hive_flutter/hive_flutter.dart';
@@ -92,24 +93,36 @@ class ApiService {
   // --- OFFLINE-READY ORDER FETCHING ---
   Future<Map<String, dynamic>> getOrders(String cities, String token, double lat, double lng, String date) async {
     var box = Hive.box(orderBoxName);
+    // Cached list for this date: lets the server send only what changed since
+    String? cachedDay = box.get('orders_$date');
+    Map<String, dynamic>? cached = cachedDay != null ? jsonDecode(cachedDay) : null;
+    final syncToken = cached?['sync_token'];
 
     try {
       final res = await http.get(
-        Uri.parse('$baseUrl/driver/orders?cities=$cities&lat=$lat&lng=$lng&date=$date'),
+        Uri.parse('$baseUrl/driver/orders?cities=$cities&lat=$lat&lng=$lng&date=$date${syncToken != null ? '&sync_token=$syncToken' : ''}'),
         headers: {'Authorization': 'Bearer $token'},
       ).timeout(const Duration(seconds: 10));
 
       if (res.statusCode == 200) {
-        final data = jsonDecode(res.body);
+        Map<String, dynamic> data = jsonDecode(res.body);
+        if (data['full'] == false && cached != null) {
+          data = _mergeOrderDelta(cached, data);
+        }
+        final body = jsonEncode(data);
         // 💾 Cache successful response for offline use
-        await box.put('last_orders', res.body);
+        await box.put('orders_$date', body);
+        await box.put('last_orders', body);
         return data;
       }
     } catch (e) {
       print("Offline Mode: Loading cached orders.");
     }
 
-    // 🏮 Fallback: Load from Cache
+    // 🏮 Fallback: Load from Cache (this date's list, prefetched or last seen)
+    if (cachedDay != null) {
+      return jsonDecode(cachedDay);
+    }
     String? cachedData = box.get('last_orders');
     if (cachedData != null) {
       return jsonDecode(cachedData);
@@ -118,7 +131,80 @@ class ApiService {
     return {'orders': [], 'message': 'No internet and no cached data.'};
   }
 
+  // --- MULTI-DAY PREFETCH (before leaving coverage) ---
+  Future<bool> prefetchOrders(String token, {int days = 2}) async {
+    var box = Hive.box(orderBoxName);
+    try {
+      final res = await http.get(
+        Uri.parse('$baseUrl/driver/orders/prefetch?days=$days'),
+        headers: {'Authorization': 'Bearer $token'},
+      ).timeout(const Duration(seconds: 20));
+      if (res.statusCode != 200) return false;
+
+      // Compact format: rows zipped with their column lists, customers in a side table
+      final data = jsonDecode(res.body);
+      final orderCols = List<String>.from(data['order_columns']);
+      final customerCols = List<String>.from(data['customer_columns']);
+      final byDate = {for (var d in data['dates']) d: []};
+      for (var row in data['orders'] as List) {
+        final order = Map<String, dynamic>.fromIterables(orderCols, row);
+        final customer = Map<String, dynamic>.fromIterables(customerCols, data['customers'][order['customer_id']]);
+        byDate[order['date']]?.add({...order, ...customer});
+      }
+      for (var entry in byDate.entries) {
+        // Same key format as getOrders (unpadded y-m-d). No sync token: the first online refresh fetches the full list
+        final d = DateTime.parse(entry.key);
+        final key = 'orders_${d.year}-${d.month}-${d.day}';
+        // Days getOrders already cached (today, usually) keep their sync token and distances
+        final String? existing = box.get(key);
+        if (existing != null && jsonDecode(existing)['sync_token'] != null) continue;
+        await box.put(key, jsonEncode({'success': true, 'full': true, 'orders': entry.value}));
+      }
+      return true;
+    } catch (e) {
+      print("Prefetch failed: $e");
+      return false;
+    }
+  }
+
+  // Applies a delta response to the cached list: changed orders replace their old copy,
+  // removed ones are dropped, and the server's sequence gives the order and fresh distances
+  Map<String, dynamic> _mergeOrderDelta(Map<String, dynamic> cached, Map<String, dynamic> delta) {
+    final byId = {for (var o in cached['orders'] as List) o['_id']: Map<String, dynamic>.from(o)};
+    for (var o in delta['orders'] as List) {
+      byId[o['_id']] = Map<String, dynamic>.from(o);
+    }
+    for (var id in delta['removed'] as List) {
+      byId.remove(id);
+    }
+    final orders = [];
+    var missing = false;
+    for (var entry in delta['sequence'] as List) {
+      final o = byId[entry['_id']];
+      if (o == null) {
+        missing = true; // Cache fell out of step: the next refresh fetches the full list
+        continue;
+      }
+      o['distance'] = entry['distance'];
+      if (entry['route_position'] != null) o['route_position'] = entry['route_position'];
+      orders.add(o);
+    }
+    return {'success': true, 'full': true, 'sync_token': missing ? null : delta['sync_token'], 'orders': orders};
+  }
+
   // --- ACTION QUEUEING (OFFLINE SYNC) ---
+  static final Random _keyRandom = Random.secure();
+
+  // Random v4 UUID, one per queued action: the server remembers every key's result,
+  // so a key derived from the order would replay an old rejection for a later completion
+  static String _newIdempotencyKey() {
+    final b = List<int>.generate(16, (_) => _keyRandom.nextInt(256));
+    b[6] = (b[6] & 0x0f) | 0x40;
+    b[8] = (b[8] & 0x3f) | 0x80;
+    final hex = b.map((x) => x.toRadixString(16).padLeft(2, '0')).join();
+    return '${hex.substring(0, 8)}-${hex.substring(8, 12)}-${hex.substring(12, 16)}-${hex.substring(16, 20)}-${hex.substring(20)}';
+  }
+
   Future<Map<String, dynamic>> completeOrder(String token, String orderId, double lat, double lng, int emptiesCollected, String paymentMode, double amountCollected) async {
     final payload = {
       'order_id': orderId, 
@@ -144,8 +230,14 @@ class ApiService {
       List currentQueue = syncBox.get('pending_completions', defaultValue: []);
       
       // Prevent duplicate queueing
-      if (!currentQueue.any((item) => item['order_id'] == orderId)) {
-        currentQueue.add(payload);
+      if (!currentQueue.any((item) => (item['payload'] ?? item)['order_id'] == orderId)) {
+        // The key, stored with the item, lets the server recognise a replay if a sync response is lost
+        currentQueue.add({
+          'action_type': 'COMPLETE_ORDER',
+          'idempotency_key': _newIdempotencyKey(),
+          'recorded_at': DateTime.now().millisecondsSinceEpoch / 1000.0,
+          'payload': payload,
+        });
         await syncBox.put('pending_completions', currentQueue);
         
         // 💾 OFFLINE STOCK UPDATE: Update the cached shift status so UI stays accurate
@@ -180,25 +272,39 @@ class ApiService {
 
     if (pending.isEmpty) return;
 
-    List remaining = List.from(pending);
-    for (var action in pending) {
-      try {
-        final res = await http.post(
-          Uri.parse('$baseUrl/driver/complete-order'),
-          headers: {'Content-Type': 'application/json', 'Authorization': 'Bearer $token'},
-          body: jsonEncode(action),
-        );
-
-        if (res.statusCode == 200) {
-          remaining.remove(action);
-          print("Successfully synced order: ${action['order_id']}");
-        }
-      } catch (e) {
-        print("Sync failed for ${action['order_id']}, will retry later.");
-        break; // Stop loop if network is still down
+    // Items queued by older app versions are bare complete-order payloads without a stored key
+    Map asAction(dynamic item) => item['action_type'] != null ? item : {
+      'action_type': 'COMPLETE_ORDER',
+      'idempotency_key': 'complete-${item['order_id']}',
+      'payload': item,
+    };
+    final actions = pending.map(asAction).toList();
+    final batch = actions.take(200).toList(); // Server limit per request; the rest goes next time
+
+    try {
+      // One request for the whole queue; resending it is safe because every action carries its key
+      final res = await http.post(
+        Uri.parse('$baseUrl/driver/sync-offline'),
+        headers: {'Content-Type': 'application/json', 'Authorization': 'Bearer $token'},
+        body: jsonEncode({'offline_actions': batch}),
+      ).timeout(const Duration(seconds: 20));
+
+      if (res.statusCode != 200) {
+        print("Sync rejected (${res.statusCode}), will retry later.");
+        return;
+      }
+
+      final results = jsonDecode(res.body)['results'] as List;
+      final doneKeys = results.where((r) => r['retry'] != true).map((r) => r['idempotency_key']).toSet();
+      for (var r in results) {
+        print("Sync ${r['status']}: ${r['order_id']} ${r['message']}");
       }
+      // Re-read: actions queued while the request was in flight must survive
+      List latest = syncBox.get('pending_completions', defaultValue: []);
+      await syncBox.put('pending_completions', latest.map(asAction).where((a) => !doneKeys.contains(a['idempotency_key'])).toList());
+    } catch (e) {
+      print("Sync failed, will retry later.");
     }
-    await syncBox.put('pending_completions', remaining);
   }
 
   // --- OTHER API CALLS ---
@@ -228,14 +334,53 @@ class ApiService {
     }
   }
 
+  // --- 🛰️ BUFFERED GPS ---
+  // Points are queued on the phone and sent as one batch, so the radio
+  // wakes once per flush instead of once per point.
+  static const int locationBatchSize = 10;
+  static const Duration locationFlushInterval = Duration(minutes: 5);
+  static const int locationBufferLimit = 500; // Oldest points are dropped beyond this while offline
+  static final List<Map<String, dynamic>> _locationBuffer = [];
+  static DateTime _lastLocationFlush = DateTime.now();
+  static bool _flushingLocations = false; // One batch in flight at a time, so no point is sent twice
+
   Future<void> sendLocationPing(String token, double lat, double lng) async {
+    _locationBuffer.add({
+      'lat': lat,
+      'lng': lng,
+      't': DateTime.now().millisecondsSinceEpoch / 1000.0,
+    });
+    if (_locationBuffer.length > locationBufferLimit) {
+      _locationBuffer.removeRange(0, _locationBuffer.length - locationBufferLimit);
+    }
+    final due = DateTime.now().difference(_lastLocationFlush) >= locationFlushInterval;
+    if (_locationBuffer.length >= locationBatchSize || due) {
+      await flushLocations(token);
+    }
+  }
+
+  Future<void> flushLocations(String token) async {
+    if (_locationBuffer.isEmpty || _flushingLocations) return;
+    _flushingLocations = true;
+    final batch = List<Map<String, dynamic>>.from(_locationBuffer);
     try {
-      await http.post(
-        Uri.parse('$baseUrl/driver/location'),
+      final res = await http.post(
+        Uri.parse('$baseUrl/driver/locations/batch'),
         headers: {'Content-Type': 'application/json', 'Authorization': 'Bearer $token'},
-        body: jsonEncode({'lat': lat, 'lng': lng}),
-      ).timeout(const Duration(seconds: 5));
-    } catch (_) {}
+        body: jsonEncode({'points': batch}),
+      ).timeout(const Duration(seconds: 10));
+      if (res.statusCode == 200 && jsonDecode(res.body)['success'] == true) {
+        // Removed by identity: points buffered while the request was in flight stay
+        // queued, and points the buffer limit already dropped are not counted twice
+        final sent = Set<Map<String, dynamic>>.identity()..addAll(batch);
+        _locationBuffer.removeWhere(sent.contains);
+        _lastLocationFlush = DateTime.now();
+      }
+    } catch (_) {
+      // Offline: the batch stays buffered for the next flush
+    } finally {
+      _flushingLocations = false;
+    }
   }
 
   Future<Map<String, dynamic>> getShiftStatus(String token) async {
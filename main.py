@@ -1,8 +1,19 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.exceptions import RequestValidationError
 from fastapi.staticfiles import StaticFiles
 from app.database import db 
+from app.consumer_ids import consumer_id_index
+from app.cities import city_registry
+from app.territories import territory_index
+from app.geocoding import geocoding_service
+from app.location_buffer import location_buffer
+from app import offline_sync, order_sync, shifts, inventory_ledger
+from app.password_pool import password_pool, PasswordPoolBusy
+from app.metrics import metrics, MetricsMiddleware
+from app.query_audit import QueryAuditMiddleware
+import os
 import traceback
 
 # Import Routers
@@ -10,7 +21,32 @@ from admin import admin_router
 from customer import customer_router
 from driver import driver_router
 
-app = FastAPI(title="Gas Delivery System", version="2.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Database connection logic is already handled in app.database
+    city_registry.ensure_indexes()
+    territory_index.ensure_indexes()
+    offline_sync.ensure_indexes()
+    order_sync.ensure_indexes()
+    shifts.ensure_indexes()
+    inventory_ledger.ensure_indexes()
+    inventory_ledger.record_opening_balances()
+    consumer_id_index.load()
+    geocoding_service.start()
+    location_buffer.start()
+    print("--- 🚀 App Started ---")
+    yield
+    # Flush queued GPS pings before the geocoder stops; it resolves what is queued before exiting
+    await location_buffer.stop()
+    await geocoding_service.stop()
+    password_pool.shutdown()
+    print("--- 🛑 App Stopped ---")
+
+app = FastAPI(title="Gas Delivery System", version="2.0", lifespan=lifespan)
+app.add_middleware(QueryAuditMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")   # When set, scrapers must send it as a Bearer token
 
 # --- GLOBAL EXCEPTION HANDLERS ---
 @app.exception_handler(Exception)
@@ -31,12 +67,23 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         content={"success": False, "message": f"Validation Error: {error_msg}"},
     )
 
+@app.exception_handler(PasswordPoolBusy)
+async def password_pool_busy_handler(request: Request, exc: PasswordPoolBusy):
+    # Login wave beyond what the bcrypt pool can queue: ask the client to come back shortly
+    return JSONResponse(
+        status_code=503,
+        content={"success": False, "message": "Too many sign-ins right now. Please retry in a few seconds."},
+        headers={"Retry-After": "2"},
+    )
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    """Route latency and MongoDB command metrics in Prometheus text format"""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        return JSONResponse(status_code=401, content={"success": False, "message": "Unauthorized"})
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Include Routers
 app.include_router(admin_router)
 app.include_router(customer_router)
 app.include_router(driver_router)
-
-@app.on_event("startup")
-async def startup_db_client():
-    # Database connection logic is already handled in app.database
-    print("--- 🚀 App Started ---")
\ No newline at end of file
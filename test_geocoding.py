@@ -0,0 +1,60 @@
+import asyncio
+
+from app.database import geocode_cache_collection
+from app.geocoding import ReverseGeocodingService, GeocodeCache, FakeGeocoder, geohash
+
+# Two points ~5m apart share a cell; the third is ~1km away
+NEAR_A = (12.869800, 74.843000)
+NEAR_B = (12.869830, 74.843020)
+FAR = (12.879000, 74.843000)
+
+def run_test():
+    print("\n🚀 STARTING REVERSE GEOCODING TEST (offline fake geocoder)...\n")
+    cells = [geohash(*p) for p in (NEAR_A, NEAR_B, FAR)]
+    geocode_cache_collection.delete_many({"_id": {"$in": cells}})
+    passed = True
+
+    try:
+        if geohash(57.64911, 10.40744, 11) != "u4pruydqqvj" or cells[0] != cells[1] or cells[0] == cells[2]:
+            print(f"❌ FAIL: Unexpected geohash cells {cells}")
+            passed = False
+        else:
+            print("✅ Geohash cells group nearby pings.")
+
+        # 1. 20 concurrent lookups of one cell -> one geocoder call
+        fake = FakeGeocoder(delay=0.2)
+        service = ReverseGeocodingService(geocoder=fake, cache=GeocodeCache())
+        async def burst():
+            return await asyncio.gather(*[service.resolve(*(NEAR_A if i % 2 else NEAR_B)) for i in range(20)])
+        addresses = asyncio.run(burst())
+        if fake.calls == 1 and len(set(addresses)) == 1:
+            print(f"✅ In-flight dedup: 20 lookups, {fake.calls} geocoder call.")
+        else:
+            print(f"❌ FAIL: {fake.calls} geocoder calls for one cell.")
+            passed = False
+
+        # 2. A fresh process (empty memory tier) is served from Mongo
+        fresh_fake = FakeGeocoder()
+        fresh = ReverseGeocodingService(geocoder=fresh_fake, cache=GeocodeCache())
+        address = asyncio.run(fresh.resolve(*NEAR_A))
+        if fresh_fake.calls == 0 and address == addresses[0]:
+            print("✅ Mongo tier served the cell without a network lookup.")
+        else:
+            print("❌ FAIL: Persistent cache tier missed.")
+            passed = False
+
+        # 3. A different cell is a real lookup
+        asyncio.run(fresh.resolve(*FAR))
+        if fresh_fake.calls != 1:
+            print("❌ FAIL: Distinct cell was not looked up.")
+            passed = False
+    finally:
+        geocode_cache_collection.delete_many({"_id": {"$in": cells}})
+
+    if passed:
+        print("\n🎉 PASS: Reverse geocoding cache works correctly.")
+    else:
+        print("\n❌ FAIL: Reverse geocoding cache failed.")
+
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+
+from app.database import inventory_movements_collection, inventory_snapshots_collection
+from app import inventory_ledger
+from app.inventory_ledger import movement, record_movements, balance_at, SNAPSHOT_SETTLE
+
+def run_test():
+    print("\n🚀 STARTING INVENTORY LEDGER SNAPSHOT TEST...\n")
+    admin_id, driver_id = str(ObjectId()), str(ObjectId())
+    base = datetime.now(timezone.utc) - timedelta(hours=3)
+    cadence = inventory_ledger._cadence.every
+    inventory_ledger._cadence.every = 10
+    passed = True
+
+    try:
+        # 1. A shift's worth of movements, one per minute: load 40, then deliveries
+        record_movements([movement("LOAD", admin_id, driver_id, None, full=40)], now=base + SNAPSHOT_SETTLE)
+        for i in range(1, 35):
+            moves = [movement("DELIVER", admin_id, driver_id, None, full=-1, cash=900)]
+            if i % 2 == 0:
+                moves.append(movement("EMPTY_COLLECTED", admin_id, driver_id, None, empty=1))
+            record_movements(moves, now=base + timedelta(minutes=i) + SNAPSHOT_SETTLE)
+
+        snapshots = inventory_snapshots_collection.count_documents({"key": {"$in": [driver_id, admin_id]}})
+        if snapshots:
+            print(f"✅ {snapshots} snapshots written along the way.")
+        else:
+            print("❌ FAIL: No snapshots were written")
+            passed = False
+
+        # 2. Snapshot + replay gives the same balance as summing every movement
+        for minute in (0, 7, 20, 34):
+            at = base + timedelta(minutes=minute, seconds=30)
+            moves = list(inventory_movements_collection.find({"driver_id": driver_id, "at": {"$lte": at}}))
+            expected = (sum(m["full"] for m in moves), sum(m["empty"] for m in moves), sum(m["cash"] for m in moves))
+            truck = balance_at("driver", driver_id, at)
+            if (truck["full"], truck["empty"], truck["cash"]) != expected:
+                print(f"❌ FAIL: Truck at minute {minute} is {truck}, expected {expected}")
+                passed = False
+        if passed:
+            print("✅ Truck balances match a full replay.")
+
+        # 3. The agency does not count the load, only what left for customers
+        agency = balance_at("agency", admin_id, base + timedelta(hours=1))
+        if agency["full"] == -34 and agency["empty"] == 17 and agency["cash"] == 34 * 900:
+            print("✅ Agency balance counts deliveries only.")
+        else:
+            print(f"❌ FAIL: Agency balance {agency}")
+            passed = False
+    finally:
+        inventory_ledger._cadence.every = cadence
+        inventory_movements_collection.delete_many({"admin_id": admin_id})
+        inventory_snapshots_collection.delete_many({"key": {"$in": [driver_id, admin_id]}})
+
+    if passed:
+        print("\n🎉 PASS: Inventory ledger snapshots are consistent.")
+    else:
+        print("\n❌ FAIL: Inventory ledger snapshots failed.")
+
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,91 @@
+import time
+from bson import ObjectId
+
+from app.database import (
+    driver_collection, shifts_collection, order_collection,
+    customer_collection, sync_receipts_collection
+)
+from app.offline_sync import apply_offline_batch
+from app.schemas import OfflineAction
+
+LAT, LNG = 12.8698, 74.8430
+
+def complete(order_id, key):
+    return OfflineAction(
+        action_type="COMPLETE_ORDER", idempotency_key=key, recorded_at=time.time() - 600,
+        payload={"order_id": str(order_id), "lat": LAT, "lng": LNG, "payment_mode": "CASH", "amount_collected": 900, "empties_collected": 1}
+    )
+
+def run_test():
+    print("\n🚀 STARTING OFFLINE SYNC REPLAY TEST...\n")
+    driver_id = ObjectId()
+    order_ids = [ObjectId() for _ in range(3)]
+    customer_ids = [ObjectId() for _ in range(3)]
+    passed = True
+
+    driver_collection.insert_one({"_id": driver_id, "name": "Sync Test Driver", "is_active": True, "current_stock": 3, "collected_cash": 0.0})
+    shift_id = shifts_collection.insert_one({
+        "driver_id": str(driver_id), "status": "OPEN",
+        "load_departure": {"full": 3, "empty": 0}, "load_return": {"full": 0, "empty": 0},
+        "financials": {"expected_cash": 0.0, "actual_cash_collected": 0.0, "upi_total": 0.0}
+    }).inserted_id
+    for o_id, c_id in zip(order_ids, customer_ids):
+        customer_collection.insert_one({"_id": c_id, "verified_lat": LAT, "verified_lng": LNG, "records": [{"order_id": o_id, "status": "PENDING"}]})
+        order_collection.insert_one({"_id": o_id, "customer_id": c_id, "assigned_driver_id": driver_id, "status": "PENDING"})
+
+    try:
+        batch = [
+            OfflineAction(action_type="ACCEPT_ORDER", idempotency_key="accept-0", payload={"order_id": str(order_ids[0])}),
+            complete(order_ids[0], "complete-0"),
+            complete(order_ids[1], "complete-1"),
+            complete(order_ids[1], "complete-1"),
+        ]
+
+        # 1. First sync applies each action once, even when repeated in the batch
+        results = apply_offline_batch(driver_id, batch)
+        statuses = [r["status"] for r in results]
+        if statuses == ["applied", "applied", "applied", "duplicate"]:
+            print("✅ Batch applied, in-batch repeat ignored.")
+        else:
+            print(f"❌ FAIL: Unexpected statuses {statuses}")
+            passed = False
+
+        # 2. The phone lost the response and resends everything
+        results = apply_offline_batch(driver_id, batch)
+        if all(r["status"] == "duplicate" and not r["retry"] for r in results):
+            print("✅ Replayed batch returned stored results.")
+        else:
+            print(f"❌ FAIL: Replay was not recognised {[r['status'] for r in results]}")
+            passed = False
+
+        # 3. Shift counted exactly two deliveries
+        shift = shifts_collection.find_one({"_id": shift_id})
+        driver = driver_collection.find_one({"_id": driver_id})
+        if shift["load_return"]["full"] == 2 and shift["financials"]["expected_cash"] == 1800 and driver["current_stock"] == 1:
+            print("✅ Stock and cash counted once per delivery.")
+        else:
+            print(f"❌ FAIL: Shift {shift['load_return']} {shift['financials']}, driver stock {driver['current_stock']}")
+            passed = False
+
+        # 4. A new key for an order delivered live is skipped, not counted again
+        results = apply_offline_batch(driver_id, [complete(order_ids[0], "complete-0-again")])
+        shift = shifts_collection.find_one({"_id": shift_id})
+        if results[0]["status"] == "skipped" and shift["load_return"]["full"] == 2:
+            print("✅ Already delivered order was skipped.")
+        else:
+            print(f"❌ FAIL: Delivered order re-applied ({results[0]['status']})")
+            passed = False
+    finally:
+        driver_collection.delete_one({"_id": driver_id})
+        shifts_collection.delete_one({"_id": shift_id})
+        order_collection.delete_many({"_id": {"$in": order_ids}})
+        customer_collection.delete_many({"_id": {"$in": customer_ids}})
+        sync_receipts_collection.delete_many({"driver_id": driver_id})
+
+    if passed:
+        print("\n🎉 PASS: Offline sync replay is idempotent.")
+    else:
+        print("\n❌ FAIL: Offline sync replay failed.")
+
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,76 @@
+import asyncio
+import httpx
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+from app.database import driver_collection, customer_collection, order_collection
+from app.query_audit import count_queries, assert_max_queries
+from auth import create_access_token
+from main import app
+
+LAT, LNG = 12.8698, 74.8430
+
+def seed_orders(admin_id, driver_id, date, n):
+    customer_ids = customer_collection.insert_many([
+        {"admin_id": admin_id, "name": f"Budget {i}", "city": "BudgetCity", "verified_lat": LAT + i / 1000, "verified_lng": LNG}
+        for i in range(n)
+    ]).inserted_ids
+    order_collection.insert_many([
+        {"admin_id": admin_id, "customer_id": c_id, "assigned_driver_id": driver_id, "status": "PENDING",
+         "assigned_date": date, "customer_name": f"Budget {i}", "created_at": datetime.utcnow(), "total_amount": 950.0}
+        for i, c_id in enumerate(customer_ids)
+    ])
+
+async def fetch_worklist(headers, date):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        r = await client.get("/driver/orders", params={"date": date, "lat": LAT, "lng": LNG}, headers=headers)
+        return r.status_code
+
+def run_test():
+    print("\n🚀 STARTING QUERY BUDGET TEST...\n")
+    admin_id = ObjectId()
+    driver_id = driver_collection.insert_one({"admin_id": admin_id, "name": "Budget Driver", "is_active": True}).inserted_id
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': str(driver_id), 'role': 'driver'})}"}
+    small_day = (datetime.now() + timedelta(days=400)).strftime("%Y-%m-%d")
+    big_day = (datetime.now() + timedelta(days=401)).strftime("%Y-%m-%d")
+    passed = True
+
+    try:
+        seed_orders(admin_id, driver_id, small_day, 3)
+        seed_orders(admin_id, driver_id, big_day, 30)
+
+        # 1. Baseline: queries for a 3-stop day
+        with count_queries("GET /driver/orders (3 stops)") as audited:
+            status = asyncio.run(fetch_worklist(headers, small_day))
+        budget = sum(q.total for q in audited)
+        if status != 200 or budget == 0:
+            # Zero means no command listener saw the request, so the comparison below would prove nothing
+            print(f"❌ FAIL: 3-stop worklist returned HTTP {status} with {budget} queries counted")
+            passed = False
+        else:
+            print(f"✅ 3-stop worklist: HTTP {status}, {budget} queries.")
+
+            # 2. Ten times the stops must not cost more queries
+            try:
+                with assert_max_queries(budget, "GET /driver/orders (30 stops)"):
+                    status = asyncio.run(fetch_worklist(headers, big_day))
+                if status == 200:
+                    print("✅ 30-stop worklist stayed within the same query budget.")
+                else:
+                    print(f"❌ FAIL: 30-stop worklist returned HTTP {status}")
+                    passed = False
+            except AssertionError as e:
+                print(f"❌ FAIL: {e}")
+                passed = False
+    finally:
+        order_collection.delete_many({"admin_id": admin_id})
+        customer_collection.delete_many({"admin_id": admin_id})
+        driver_collection.delete_one({"_id": driver_id})
+
+    if passed:
+        print("\n🎉 PASS: Worklist query count does not grow with the number of stops.")
+    else:
+        print("\n❌ FAIL: Worklist issues a query per stop.")
+
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+from bson import ObjectId
+
+from app.database import counters_collection
+from app.sequences import SequenceAllocator
+
+THREADS = 8
+PROCESSES = 4
+IDS_PER_WORKER = 500
+BLOCK_SIZE = 100
+
+def draw_ids(name):
+    # Each process gets its own allocator, exactly like separate uvicorn workers
+    allocator = SequenceAllocator(block_size=BLOCK_SIZE)
+    return [allocator.next(name) for _ in range(IDS_PER_WORKER)]
+
+def run_test():
+    print("\n🚀 STARTING SEQUENCE ALLOCATOR CONCURRENCY TEST...\n")
+    name = f"TEST_SEQ_{ObjectId()}"
+
+    try:
+        # 1. Many threads sharing one allocator
+        shared = SequenceAllocator(block_size=BLOCK_SIZE)
+        with ThreadPoolExecutor(max_workers=THREADS) as pool:
+            thread_ids = [i for batch in pool.map(lambda _: [shared.next(name) for _ in range(IDS_PER_WORKER)], range(THREADS)) for i in batch]
+        print(f"✅ Threads: drew {len(thread_ids)} ids across {THREADS} threads.")
+
+        # 2. Separate processes, each with its own allocator
+        with Pool(PROCESSES) as pool:
+            process_ids = [i for batch in pool.map(draw_ids, [name] * PROCESSES) for i in batch]
+        print(f"✅ Processes: drew {len(process_ids)} ids across {PROCESSES} processes.")
+
+        # 3. Two independent named sequences do not interfere
+        other = f"{name}_OTHER"
+        first_other = shared.next(other)
+
+        all_ids = thread_ids + process_ids
+        reserved = counters_collection.find_one({"_id": name})["sequence_value"]
+        print(f"   -> Total ids: {len(all_ids)} | Unique: {len(set(all_ids))} | Counter reserved up to: {reserved}")
+
+        if len(all_ids) == len(set(all_ids)) and max(all_ids) <= reserved and first_other == 1:
+            print("\n🎉 PASS: No id was handed out twice across threads or processes.")
+        else:
+            print("\n❌ FAIL: Duplicate ids detected or counter out of range.")
+    finally:
+        counters_collection.delete_many({"_id": {"$in": [name, f"{name}_OTHER"]}})
+
+if __name__ == "__main__":
+    run_test()